@@ -0,0 +1,281 @@
+from datetime import date, timedelta
+import warnings
+
+import polars as pl
+import requests
+
+from database import DatabaseManager
+from scheduler import get_scheduler, PRIORITY_SCHEDULE
+
+
+ISS_BONDIZATION_URL = ("https://iss.moex.com/iss/statistics/engines/stock/markets/bonds/bondization/{isin}.json"
+                       "?iss.meta=off&iss.only=coupons,amortizations,offers&limit=unlimited")
+
+# Графики меняются редко, поэтому перезагружаем их не чаще раза в неделю
+SCHEDULE_MAX_AGE_DAYS = 7
+
+# Схема таблицы графиков выплат (значения на одну облигацию в валюте номинала)
+SCHEDULE_SCHEMA = {
+    'ISIN': pl.String,
+    'DATE': pl.Date,
+    'KIND': pl.String,  # coupon / amortization / offer
+    'VALUE': pl.Float64,
+    'VALUEPRC': pl.Float64,
+}
+
+# Блок ISS: (тип выплаты, столбец с датой)
+BLOCKS = {
+    'coupons': ('coupon', 'coupondate'),
+    'amortizations': ('amortization', 'amortdate'),
+    'offers': ('offer', 'offerdate'),
+}
+
+
+def parse_bondization(isin, data) -> list:
+    # Разбор ответа bondization в список строк для таблицы cashflows
+    # Столбцы ищутся по названию, а не по номеру
+
+    rows = []
+    for block, (kind, date_column) in BLOCKS.items():
+        if block not in data:
+            continue
+
+        columns = data[block]['columns']
+        for values in data[block]['data']:
+            record = dict(zip(columns, values))
+
+            # Для оферты значение - цена выкупа в процентах от номинала
+            if kind == 'offer':
+                value_prc = record.get('price')
+            else:
+                value_prc = record.get('valueprc')
+
+            rows.append({
+                'ISIN': isin,
+                'DATE': record.get(date_column),
+                'KIND': kind,
+                'VALUE': record.get('value'),
+                'VALUEPRC': value_prc,
+            })
+
+    return rows
+
+
+def load_schedules(isins, db=None, max_age_days=SCHEDULE_MAX_AGE_DAYS):
+    """
+    Загружает с мосбиржи графики выплат для ISIN, которых нет в базе или они устарели
+    max_age_days <= 0 - загружаются все графики, даже загруженные сегодня
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    isins = list(dict.fromkeys(isins))
+
+    # ISIN, загруженные не раньше чем max_age_days назад
+    fresh = set()
+    if max_age_days > 0 and db.table_exists('cashflows_loaded'):
+        border = (date.today() - timedelta(days=max_age_days)).isoformat()
+        fresh = set(db.scan_table(isins, 'cashflows_loaded', key_column='ISIN')
+                    .filter(pl.col('LOADED').cast(pl.String) >= border)
+                    .collect()['ISIN'].to_list())
+
+    stale = [isin for isin in isins if isin not in fresh]
+    if not stale:
+        return
+
+    scheduler = get_scheduler()
+    futures = {isin: scheduler.submit(ISS_BONDIZATION_URL.format(isin=isin), priority=PRIORITY_SCHEDULE)
+               for isin in stale}
+
+    rows = []
+    loaded = []
+    for isin, future in futures.items():
+        try:
+            response = future.result()
+        except requests.RequestException:
+            response = None
+
+        if response is None or response.status_code != 200:
+            warnings.warn(f"Не удалось загрузить график выплат по {isin}", RuntimeWarning)
+            continue
+
+        rows.extend(parse_bondization(isin, response.json()))
+        loaded.append({'ISIN': isin, 'LOADED': date.today().isoformat()})
+
+    # Перезапись графиков только для обновленных ISIN
+    updated = [row['ISIN'] for row in loaded]
+    db.delete_rows('cashflows', updated, key_column='ISIN')
+    db.delete_rows('cashflows_loaded', updated, key_column='ISIN')
+    db.insert_dicts('cashflows', rows)
+    db.insert_dicts('cashflows_loaded', loaded)
+
+
+def get_schedules(isins, db=None, refresh=True) -> pl.DataFrame:
+    """
+    Графики выплат по списку ISIN из локальной базы (с дозагрузкой недостающих)
+    Столбцы: ISIN, DATE, KIND, VALUE, VALUEPRC
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    if refresh:
+        load_schedules(isins, db)
+
+    if not db.table_exists('cashflows'):
+        return pl.DataFrame(schema=SCHEDULE_SCHEMA)
+
+    df = db.scan_table(list(isins), 'cashflows', key_column='ISIN').collect()
+    if df.is_empty():
+        return pl.DataFrame(schema=SCHEDULE_SCHEMA)
+
+    return df.select(
+        pl.col('ISIN').cast(pl.String),
+        pl.col('DATE').cast(pl.String).str.to_date(),
+        pl.col('KIND').cast(pl.String),
+        pl.col('VALUE').cast(pl.Float64),
+        pl.col('VALUEPRC').cast(pl.Float64),
+    ).sort('ISIN', 'DATE')
+
+
+def coupon_types(schedules, today=None) -> pl.DataFrame:
+    """
+    Тип купона по графику выплат: floating, если у будущего купона нет ни суммы, ни ставки
+    (ISS не знает наперед купоны флоатеров), иначе fixed.
+    Текущий купон флоатера ISS публикует, поэтому COUPONPERCENT для этого не подходит
+    Возвращает ISIN, COUPON_TYPE (бумаги без купонов в графике не попадают)
+    """
+    today = today or date.today()
+
+    unknown = pl.col('VALUE').is_null() & pl.col('VALUEPRC').is_null() & (pl.col('DATE') >= today)
+
+    return (schedules
+            .filter(pl.col('KIND') == 'coupon')
+            .group_by('ISIN')
+            .agg(unknown.any().alias('floating'))
+            .select('ISIN', pl.when(pl.col('floating')).then(pl.lit('floating'))
+                    .otherwise(pl.lit('fixed')).alias('COUPON_TYPE'))
+            .sort('ISIN'))
+
+
+def schedule_cashflows(df, schedules, end_date=None, to_offer=False, start_date=None) -> pl.DataFrame:
+    """
+    Будущие выплаты по позициям портфеля по точным графикам
+
+    df - позиции с ISIN, FACEUNIT, QUANTITY, CURRENCY_RUB
+    schedules - результат get_schedules
+    to_offer - считать, что бумага предъявляется к выкупу в ближайшую оферту:
+               остаток номинала выплачивается в дату оферты, последующие выплаты не учитываются
+
+    Возвращает ISIN, FACEUNIT, DATE, KIND, AMOUNT (на позицию в валюте номинала), AMOUNT_RUB
+    Неизвестные будущие купоны (флоатеры) принимаются равными последнему известному
+    """
+    start_date = start_date or date.today()
+
+    flows = (schedules
+             .sort('ISIN', 'DATE')
+             .with_columns(
+                 # Для купонов без значения берем последний известный купон
+                 pl.when(pl.col('KIND') == 'coupon')
+                 .then(pl.col('VALUE').forward_fill().over(['ISIN', 'KIND']))
+                 .otherwise(pl.col('VALUE'))
+                 .alias('VALUE'))
+             .filter(pl.col('DATE') >= start_date))
+
+    if to_offer:
+        offers = (flows.filter(pl.col('KIND') == 'offer')
+                  .group_by('ISIN').agg(pl.col('DATE').min().alias('OFFER')))
+
+        flows = flows.join(offers, on='ISIN', how='left')
+        after_offer = pl.col('OFFER').is_not_null() & (pl.col('DATE') > pl.col('OFFER'))
+
+        # Погашение остатка номинала в дату оферты
+        redemption = (flows.filter(after_offer & (pl.col('KIND') == 'amortization'))
+                      .group_by('ISIN')
+                      .agg(pl.col('OFFER').first().alias('DATE'), pl.col('VALUE').sum())
+                      .with_columns(pl.lit('amortization').alias('KIND')))
+
+        flows = pl.concat([flows.filter(~after_offer).drop('OFFER'), redemption], how='diagonal_relaxed')
+
+    # Оферта сама по себе не выплата
+    flows = flows.filter(pl.col('KIND') != 'offer')
+
+    if end_date is not None:
+        flows = flows.filter(pl.col('DATE') <= end_date)
+
+    positions = df.select(pl.col('ISIN').cast(pl.String), pl.col('FACEUNIT').cast(pl.String),
+                          'QUANTITY', 'CURRENCY_RUB')
+
+    return (flows.join(positions, on='ISIN', how='inner')
+            .with_columns((pl.col('VALUE') * pl.col('QUANTITY')).alias('AMOUNT'))
+            .with_columns((pl.col('AMOUNT') * pl.col('CURRENCY_RUB')).alias('AMOUNT_RUB'))
+            .select('ISIN', 'FACEUNIT', 'DATE', 'KIND', 'AMOUNT', 'AMOUNT_RUB')
+            .sort('DATE'))
+
+
+def estimated_cashflows(df, end_date, start_date=None) -> pl.DataFrame:
+    """
+    Оценка выплат для бумаг без графика: купоны каждые COUPONPERIOD дней начиная
+    с NEXTCOUPON и погашение номинала в MATDATE. Результат в том же формате, что schedule_cashflows
+    """
+    start_date = start_date or date.today()
+
+    columns = df.columns
+    quantity = pl.col('QUANTITY') if 'QUANTITY' in columns else pl.col('Количество лотов') * pl.col('LOTSIZE')
+    last_date = pl.min_horizontal(pl.col('MATDATE'), pl.lit(end_date))
+
+    bonds = df.select(
+        pl.col('ISIN').cast(pl.String),
+        pl.col('FACEUNIT').cast(pl.String),
+        'NEXTCOUPON', 'MATDATE', 'COUPONPERIOD', 'COUPONVALUE', 'FACEVALUE', 'CURRENCY_RUB',
+        quantity.cast(pl.Float64).alias('QUANTITY'),
+        # Количество купонов до погашения или end_date
+        ((last_date - pl.col('NEXTCOUPON')).dt.total_days() // pl.col('COUPONPERIOD') + 1)
+        .clip(0).fill_null(0).alias('N_COUPONS'),
+    )
+
+    coupons = (bonds.filter(pl.col('N_COUPONS') > 0, pl.col('COUPONPERIOD') > 0)
+               .with_columns(pl.int_ranges(0, pl.col('N_COUPONS')).alias('N'))
+               .explode('N')
+               .select(
+                   'ISIN', 'FACEUNIT',
+                   (pl.col('NEXTCOUPON') + pl.duration(days=pl.col('N') * pl.col('COUPONPERIOD'))).alias('DATE'),
+                   pl.lit('coupon').alias('KIND'),
+                   (pl.col('COUPONVALUE') * pl.col('QUANTITY')).alias('AMOUNT'),
+                   'CURRENCY_RUB'))
+
+    redemptions = (bonds.filter(pl.col('MATDATE') <= end_date)
+                   .select(
+                       'ISIN', 'FACEUNIT',
+                       pl.col('MATDATE').alias('DATE'),
+                       pl.lit('amortization').alias('KIND'),
+                       (pl.col('FACEVALUE') * pl.col('QUANTITY')).alias('AMOUNT'),
+                       'CURRENCY_RUB'))
+
+    return (pl.concat([coupons, redemptions], how='vertical_relaxed')
+            .filter(pl.col('DATE') >= start_date)
+            .with_columns(pl.col('AMOUNT').cast(pl.Float64),
+                          (pl.col('AMOUNT') * pl.col('CURRENCY_RUB')).cast(pl.Float64).alias('AMOUNT_RUB'))
+            .select('ISIN', 'FACEUNIT', 'DATE', 'KIND', 'AMOUNT', 'AMOUNT_RUB')
+            .sort('DATE'))
+
+
+def portfolio_cashflows(df, end_date, schedules=None, to_offer=False, fx=None) -> pl.DataFrame:
+    """
+    Все будущие выплаты по позициям: точные по графикам (если есть), для остальных бумаг - оценка
+    fx - fx.FxConverter, пересчет по курсу на дату выплаты вместо текущего
+    """
+    flows = []
+
+    if schedules is not None and not schedules.is_empty():
+        flows.append(schedule_cashflows(df, schedules, end_date=end_date, to_offer=to_offer))
+
+        # Бумаги без графика считаются по купонному периоду и дате погашения
+        df = df.filter(~pl.col('ISIN').cast(pl.String).is_in(schedules['ISIN'].unique().implode()))
+
+    flows.append(estimated_cashflows(df, end_date=end_date))
+
+    flows = pl.concat(flows)
+    if fx is not None:
+        flows = fx.convert(flows)
+
+    return flows
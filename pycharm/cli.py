@@ -0,0 +1,307 @@
+import argparse
+import sys
+import warnings
+
+import polars as pl
+
+import database
+from bondization import load_schedules, get_schedules
+from currency import get_currency
+from database import DatabaseManager
+from df_process import read_portfolio, build_portfolio_plan, portfolio_info
+from fx import FxConverter, fx_history, load_fixings
+from marketdata import get_marketdata_many
+from report import generate_report
+from riskoff_yields import get_riskoff_yeilds
+from scheduler import configure_scheduler, get_scheduler
+from scrapers import SOURCES, get_curves, cached_curve, save_curve, trading_day
+from service import metrics_payload, dumps
+from visualization import create_monthly_dict, fill_calendar_with_sums, plot_coupon_calendar_seaborn
+
+
+STAGES = ('refresh', 'analyze', 'report')
+
+# Режимы работы с локальной базой:
+#   online - все данные портфеля загружаются заново
+#   refresh-stale - загружаются только отсутствующие и устаревшие данные (не за текущий торговый день)
+#   offline - без обращений к сети, только локальная база
+CACHE_MODES = ('online', 'refresh-stale', 'offline')
+
+# Глубина хранения графиков выплат без перезагрузки в режимах refresh-stale и missing, дней
+SCHEDULE_MAX_AGE_DAYS = {'online': 0, 'refresh-stale': 7, 'missing': 365 * 100}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Анализ портфеля облигаций мосбиржи. Этапы выполняются в порядке refresh, analyze, report: "
+                    "refresh - загрузка данных в локальную базу, analyze - показатели и календарь выплат, "
+                    "report - HTML отчет. analyze и report работают по снимку в базе")
+    # choices со списком по умолчанию не работает: argparse проверяет весь список как один вариант
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"этапы: {', '.join(STAGES)} (по умолчанию refresh analyze)")
+    parser.add_argument('-p', '--portfolio', default='bonds.xlsx',
+                        help="эксель файл со столбцами 'ISIN' и 'Количество лотов' (по умолчанию bonds.xlsx)")
+    parser.add_argument('--db', default=database.DEFAULT_DB_PATH,
+                        help=f"путь к локальной базе (по умолчанию {database.DEFAULT_DB_PATH})")
+    parser.add_argument('--backend', choices=('sqlite', 'parquet'), default=database.DEFAULT_BACKEND,
+                        help="хранилище снимков")
+    parser.add_argument('--cache', choices=CACHE_MODES, default='refresh-stale',
+                        help="работа с локальной базой: online - загрузить все заново, refresh-stale - "
+                             "только отсутствующее и устаревшее, offline - без сети (по умолчанию refresh-stale)")
+    parser.add_argument('--fetch-workers', type=int, default=8,
+                        help="число параллельных запросов к сети (лимиты хостов соблюдаются всегда)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="число процессов для построения отчета (по умолчанию по числу ядер)")
+    parser.add_argument('--format', choices=('text', 'json'), default='text', dest='output_format',
+                        help="формат результата analyze")
+    parser.add_argument('-o', '--output', default=None,
+                        help="файл для результата analyze (по умолчанию вывод в консоль)")
+    parser.add_argument('--report', default='report.html',
+                        help="файл HTML отчета (по умолчанию report.html)")
+    parser.add_argument('--headless', action='store_true',
+                        help="без окон с графиками (для серверов и запуска по расписанию)")
+    parser.add_argument('--to-offer', action='store_true',
+                        help="календарь с погашением в дату ближайшей оферты")
+    parser.add_argument('--fx', choices=('current', 'spot', 'forward'), default='current', dest='fx_mode',
+                        help="пересчет выплат календаря в рубли: current - по текущему курсу, spot - по фиксингу "
+                             "на дату выплаты, forward - по форвардному курсу из безрисковых кривых "
+                             "(по умолчанию current)")
+    parser.add_argument('--stats', action='store_true',
+                        help="вывести статистику очереди запросов к сети (в stderr)")
+
+    args = parser.parse_args(argv)
+
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"неизвестные этапы: {', '.join(unknown)} (доступны: {', '.join(STAGES)})")
+    args.stages = args.stages or ['refresh', 'analyze']
+
+    if args.fetch_workers < 1 or (args.workers is not None and args.workers < 1):
+        parser.error("число потоков и процессов должно быть положительным")
+
+    return args
+
+
+def stale_bonds(isins, db, mode) -> list:
+    # ISIN, по которым нужно загрузить данные с мосбиржи
+    if mode == 'online' or not db.table_exists('bonds_info'):
+        return list(isins)
+
+    updated = dict(db.scan_table(list(isins), 'bonds_info')
+                   .select(pl.col('SECID').cast(pl.String), pl.col('UPDATED').cast(pl.Date))
+                   .collect().iter_rows())
+
+    if mode == 'missing':
+        return [isin for isin in isins if isin not in updated]
+
+    day = trading_day()
+    return [isin for isin in isins if updated.get(isin) is None or updated[isin] < day]
+
+
+def currency_is_stale(db, mode) -> bool:
+    if mode == 'online' or not db.table_exists('currency'):
+        return True
+    if mode == 'missing':
+        return False
+
+    if db.backend == 'parquet':
+        last = (db.scan_parquet('currency')
+                .select(pl.col('TRADEDATE').cast(pl.String).max()).collect().item())
+    else:
+        with db as cursor:
+            cursor.execute("SELECT max(TRADEDATE) FROM currency")
+            last = cursor.fetchone()[0]
+
+    return last is None or str(last) < trading_day().isoformat()
+
+
+def refresh_curves(currencies, db, mode) -> dict:
+    """
+    Безрисковые кривые валют портфеля в таблицу curves
+    (кривые мосбиржи и yfinance тоже сохраняются, чтобы анализ работал без сети)
+    """
+    day = trading_day()
+    curves = {}
+    for currency in currencies:
+        cached = cached_curve(db, currency, None if mode == 'missing' else day)
+        if mode != 'online' and cached is not None:
+            curves[currency] = cached
+
+    # Страницы иностранных сайтов загружаются параллельно
+    scraped = [currency for currency in currencies if currency not in curves and currency in SOURCES]
+    if scraped:
+        curves.update(get_curves(scraped, db, refresh=mode == 'online'))
+
+    for currency in currencies:
+        if currency in curves:
+            continue
+        try:
+            curve = get_riskoff_yeilds(currency, db)
+        except Exception as e:
+            warnings.warn(f"Нет кривой для {currency}: {e}", UserWarning)
+            curve = None
+
+        if curve is not None and not curve.is_empty():
+            save_curve(db, currency, day, curve)
+        curves[currency] = curve
+
+    return curves
+
+
+def refresh(isins, db, mode):
+    """
+    Загрузка данных портфеля в локальную базу: облигации, курсы валют, графики выплат, кривые
+    mode - online / refresh-stale, а также missing - только то, чего в базе нет совсем
+    """
+    stale = stale_bonds(isins, db, mode)
+    if stale:
+        get_marketdata_many(stale, db=db)
+
+    if currency_is_stale(db, mode):
+        get_currency(db=db)
+
+    # Фиксинги догружаются только за новые даты, в режиме missing - только если истории нет совсем
+    if mode != 'missing' or not db.table_exists('fx_history'):
+        load_fixings(db)
+
+    load_schedules(isins, db, max_age_days=SCHEDULE_MAX_AGE_DAYS[mode])
+
+    currencies = (db.scan_table(list(isins), 'bonds_info')
+                  .select(pl.col('FACEUNIT').cast(pl.String)).unique()
+                  .collect()['FACEUNIT'].drop_nulls().to_list()) if db.table_exists('bonds_info') else []
+    # Рублевая кривая нужна и для форвардных курсов (--fx forward)
+    refresh_curves(sorted(set(currencies) | {'RUB'}), db, mode)
+
+    if stale or mode != 'missing':
+        print(f"Обновлено облигаций: {len(stale)} из {len(isins)}")
+
+
+def load_curves(currencies, db) -> dict:
+    # Кривые из локальной базы (пустая таблица - кривой нет, загружать не нужно)
+    curves = {}
+    for currency in currencies:
+        curve = cached_curve(db, currency)
+        curves[currency] = curve if curve is not None else pl.DataFrame()
+    return curves
+
+
+def fx_converter(mode, db, curves):
+    # Пересчет выплат по курсу на дату выплаты по данным из базы (None - по текущему курсу)
+    if mode == 'current':
+        return None
+    return FxConverter(mode, db, history=fx_history(db), spot=db.currency_table(), curves=curves)
+
+
+def calendar_rows(calendar) -> list:
+    return [{'month': month.isoformat(), 'amount_rub': amount} for month, amount in calendar.items() if amount]
+
+
+def analyze(df, schedules, curves, args, fx=None):
+    """
+    Показатели по валютам и календарь выплат по снимку в базе
+    """
+    end_date = df['MATDATE'].max()
+    calendar = fill_calendar_with_sums(create_monthly_dict(end_date), df, end_date,
+                                       schedules=schedules, to_offer=args.to_offer, fx=fx)
+
+    if args.output_format == 'json':
+        payload = metrics_payload(df)
+        payload['calendar'] = calendar_rows(calendar)
+        # NaN (например, показатели валюты без курса) записываются как null, иначе это не JSON
+        text = dumps(payload, indent=2)
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                file.write(text)
+        else:
+            print(text)
+        return
+
+    for currency in df['FACEUNIT'].cast(pl.String).unique().sort().to_list():
+        filtered_df = df.filter(pl.col('FACEUNIT') == currency)
+        if round(filtered_df['Доля'].sum(), 5) > 0:
+            portfolio_info(filtered_df, currency, curve=curves.get(currency), plot=not args.headless)
+
+    print("Выплаты по месяцам, руб.:")
+    for row in calendar_rows(calendar):
+        print(f"{row['month'][:7]}: {round(row['amount_rub'], 2)}")
+
+    if not args.headless:
+        plot_coupon_calendar_seaborn(calendar_dict=calendar)
+
+
+def run(args):
+    """
+    Выполнение этапов args.stages, возвращает код завершения
+    """
+    positions = read_portfolio(args.portfolio)
+    if positions is None:
+        return 1
+    isins = positions['ISIN'].cast(pl.String).unique().to_list()
+
+    db = DatabaseManager(args.db, args.backend)
+
+    if 'refresh' in args.stages:
+        if args.cache == 'offline':
+            print("Режим offline: этап refresh пропущен")
+        else:
+            refresh(isins, db, args.cache)
+
+    if not {'analyze', 'report'} & set(args.stages):
+        return 0
+
+    # Если в базе чего-то нет совсем, докачиваем это (кроме режима offline)
+    if args.cache != 'offline':
+        refresh(isins, db, 'missing')
+
+    df = build_portfolio_plan(positions, db).collect() if db.table_exists('bonds_info') else pl.DataFrame()
+    if df.is_empty():
+        print("В локальной базе нет данных ни по одной бумаге портфеля")
+        return 1
+
+    for currency in df.filter(pl.col('CURRENCY_RUB') == 0)['FACEUNIT'].cast(pl.String).unique().to_list():
+        print(f"Значение для валюты {currency} не найдены!")
+
+    schedules = get_schedules(isins, db, refresh=False)
+    curves = load_curves(df['FACEUNIT'].cast(pl.String).unique().to_list(), db)
+    fx = fx_converter(args.fx_mode, db, {**load_curves(['RUB'], db), **curves})
+
+    if 'analyze' in args.stages:
+        analyze(df, schedules, curves, args, fx)
+
+    if 'report' in args.stages:
+        path = generate_report(df, args.report, schedules=schedules, workers=args.workers, curves=curves, db=db,
+                               fx=fx)
+        print(f"Отчет сохранен в {path}")
+
+    return 0
+
+
+def print_stats():
+    # Ожидание запросов в очереди планировщика по хостам, с
+    stats = get_scheduler().stats()
+    for host, host_stats in stats.items():
+        if isinstance(host_stats, dict):
+            print(f"{host}: запросов {host_stats['requests']}, ожидание среднее {host_stats['mean_wait']:.2f}, "
+                  f"p95 {host_stats['p95_wait']:.2f}, max {host_stats['max_wait']:.2f}", file=sys.stderr)
+    print(f"Объединено одинаковых запросов: {stats['coalesced']}, в очереди: {stats['queued']}", file=sys.stderr)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    configure_scheduler(workers=args.fetch_workers)
+
+    if args.headless:
+        import matplotlib.pyplot as plt
+        plt.switch_backend('Agg')
+
+    try:
+        return run(args)
+    finally:
+        if args.stats:
+            print_stats()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,11 @@
 import warnings
 import requests
 from database import DatabaseManager
+from scheduler import get_scheduler, PRIORITY_CURRENCY
 
 
-def get_currency(try_counter=1):
+def get_currency(try_counter=1, db=None):
+    # db - локальная база (по умолчанию DatabaseManager())
 
     # Проверка количества попыток для подключения (максимум 4)
     if try_counter >= 4:
@@ -11,14 +13,17 @@ def get_currency(try_counter=1):
         return
 
     url = "https://iss.moex.com/iss/engines/currency/markets/index/securities.json"
-    response = requests.get(url)  # запрос данных по url
+    try:
+        response = get_scheduler().get(url, priority=PRIORITY_CURRENCY)  # запрос данных по url
+    except requests.RequestException:
+        response = None
 
     # Проверка успешного подключения
-    if response.status_code != 200:
+    if response is None or response.status_code != 200:
         warnings.warn("Не удалось подключиться к API мосбиржи", RuntimeWarning)
 
         # Выполняем повторное подключение
-        get_currency(try_counter = try_counter + 1)
+        get_currency(try_counter = try_counter + 1, db=db)
         return
 
     data = response.json()  # Преобразование ответа в JSON
@@ -27,6 +32,7 @@ def get_currency(try_counter=1):
     str_number = min(len(data['securities']['data']), len(data['marketdata']['data']))
 
     inf = {}
+    rows = []
 
     # проходим по всем валютам
     for i in range(str_number):
@@ -58,10 +64,16 @@ def get_currency(try_counter=1):
         except:
             print(f"Ошибка при загрузке валют")
             warnings.warn(f"Информация не найдена", UserWarning)
-            return inf
+            break
 
-        # Сохранение в базу данных
-        db = DatabaseManager('bonds.db')
-        db.insert_dict("currency", inf)
+        rows.append(dict(inf))
+
+    # Сохранение в базу данных одной пачкой
+    if db is None:
+        db = DatabaseManager()
+    db.insert_dicts("currency", rows)
+
+    if len(rows) < str_number:
+        return inf
 
     print("Данные о валютах обновлены")
\ No newline at end of file
@@ -1,22 +1,122 @@
+import os
+import shutil
 import sqlite3
 import re
+import threading
+import warnings
+from datetime import date
 import polars as pl
 
+from schema import TABLES, polars_schema, create_table, migrate
+
+
+# База по умолчанию (меняется, например, параметром --db командной строки)
+DEFAULT_DB_PATH = 'bonds.db'
+
+# Хранилище снимков по умолчанию: 'sqlite' или 'parquet'
+DEFAULT_BACKEND = 'sqlite'
+
+# Максимум параметров в одном запросе SQLite (старые сборки ограничены 999)
+SQLITE_MAX_PARAMS = 900
+
+# parquet: новые строки пишутся отдельными файлами-частями, основной файл таблицы переписывается,
+# только когда в частях строк не меньше, чем в нем (и не меньше PARQUET_COMPACT_ROWS)
+PARQUET_COMPACT_ROWS = 10000
+
+# Базы, для которых миграции уже проверены в этом процессе
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def _convert_date(value):
+    # Столбцы DATE читаются как datetime.date, пустые даты ISS (0000-00-00) - как None
+    try:
+        return date.fromisoformat(value.decode())
+    except ValueError:
+        return None
+
+
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter('DATE', _convert_date)
+
 
 class DatabaseManager:
-    def __init__(self, db_path):
-        self.db_path = db_path
+    def __init__(self, db_path=None, backend=None, shared=False):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self.backend = backend or DEFAULT_BACKEND
+
+        if self.backend not in ('sqlite', 'parquet'):
+            raise ValueError(f"Неизвестное хранилище {self.backend}")
+
+        # Для parquet каждая таблица - отдельный файл в папке рядом с базой
+        self.parquet_dir = os.path.splitext(self.db_path)[0] + '_parquet'
+
+        # shared=True - одно соединение на все запросы (например, в сервисе),
+        # запросы из разных потоков выполняются по очереди
+        self.shared = shared
+        self._shared_lock = threading.RLock()
+        self._shared_conn = None
+        self._depth = 0
+
+    def __reduce__(self):
+        # В другой процесс (например, в пул отчета) передается только расположение базы,
+        # соединение и блокировка создаются там заново
+        return DatabaseManager, (self.db_path, self.backend, self.shared)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=not self.shared)
+
+        if self.db_path not in _migrated:
+            with _migrate_lock:
+                if self.db_path not in _migrated:
+                    migrate(conn)
+                    _migrated.add(self.db_path)
+
+        return conn
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
+        if not self.shared:
+            self.conn = self._connect()
+            return self.conn.cursor()
+
+        self._shared_lock.acquire()
+        try:
+            if self._shared_conn is None:
+                self._shared_conn = self._connect()
+        except Exception:
+            self._shared_lock.release()
+            raise
+
+        self.conn = self._shared_conn
+        self._depth += 1
         return self.conn.cursor()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            self.conn.commit()
-        else:
-            self.conn.rollback()
-        self.conn.close()
+        if not self.shared:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+            self.conn.close()
+            return
+
+        # Общее соединение не закрывается, транзакция завершается на внешнем уровне вложенности
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                if exc_type is None:
+                    self._shared_conn.commit()
+                else:
+                    self._shared_conn.rollback()
+        finally:
+            self._shared_lock.release()
+
+    def close(self):
+        # Закрытие общего соединения (shared=True)
+        with self._shared_lock:
+            if self._shared_conn is not None:
+                self._shared_conn.close()
+                self._shared_conn = None
 
     def is_date_string(self, value):
         """
@@ -32,48 +132,213 @@ class DatabaseManager:
 
         return False
 
+    def parquet_path(self, table_name):
+        # Основной файл таблицы (дописанные строки лежат рядом, см. scan_parquet)
+        return os.path.join(self.parquet_dir, f"{table_name}.parquet")
+
+    def _parts_dir(self, table_name):
+        return os.path.join(self.parquet_dir, f"{table_name}_parts")
+
+    def _parquet_parts(self, table_name) -> list:
+        # Дописанные части таблицы в порядке записи: [(путь, первый id, число строк)]
+        directory = self._parts_dir(table_name)
+        if not os.path.isdir(directory):
+            return []
+
+        parts = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.parquet'):
+                start, rows = name[:-len('.parquet')].split('_')
+                parts.append((os.path.join(directory, name), int(start), int(rows)))
+        return parts
+
+    def scan_parquet(self, table_name) -> pl.LazyFrame:
+        """
+        Ленивое чтение таблицы parquet: основной файл и дописанные части
+        Для объявленных таблиц по ключу остается последняя запись (как INSERT OR REPLACE)
+        """
+        paths = [path for path, _, _ in self._parquet_parts(table_name)]
+        if os.path.exists(self.parquet_path(table_name)):
+            paths.insert(0, self.parquet_path(table_name))
+
+        if not paths:
+            return pl.LazyFrame()
+        if len(paths) == 1:
+            return pl.scan_parquet(paths[0])
+
+        lf = pl.concat([pl.scan_parquet(path) for path in paths], how='diagonal_relaxed')
+        if table_name in TABLES:
+            lf = lf.unique(subset=TABLES[table_name]['key'], keep='last', maintain_order=True)
+        return lf
+
+    def table_exists(self, table_name):
+        if self.backend == 'parquet':
+            return os.path.exists(self.parquet_path(table_name)) or bool(self._parquet_parts(table_name))
+
+        with self as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+            return cursor.fetchone() is not None
+
     def insert_dict(self, table_name, data_dict):
+        self.insert_dicts(table_name, [data_dict])
+
+    def insert_dicts(self, table_name, rows):
+        """
+        Запись пачки строк (список словарей) одной транзакцией
+        """
+        if not rows:
+            return
+
+        # Объединение ключей всех строк (в блоках ISS могут отсутствовать поля)
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        date_keys = []
+        if table_name in TABLES:
+            keys, date_keys = self._declared_keys(table_name, keys)
+
+        # Каждая строка копируется один раз, некорректные даты правятся в копии
+        rows = [{key: row.get(key) for key in keys} for row in rows]
+        for row in rows:
+            for key in date_keys:
+                value = row[key]
+                if isinstance(value, str) and (not self.is_date_string(value) or value.startswith('0000')):
+                    row[key] = None
+
+        if self.backend == 'parquet':
+            self._append_parquet(table_name, rows)
+            return
+
         with self as cursor:
-            # Проверяем существование таблицы
-            cursor.execute("""
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name=?
-            """, (table_name,))
-
-            table_exists = cursor.fetchone() is not None
-            if not table_exists:
-                # Создаем таблицу на основе ключей словаря
-                columns = []
-                for key, value in data_dict.items():
-                    if isinstance(value, int):
-                        col_type = 'INTEGER'
-                    elif isinstance(value, float):
-                        col_type = 'REAL'
-                    elif self.is_date_string(value):
-                        col_type = 'TEXT'
-                    else:
-                        col_type = 'TEXT'
-                    columns.append(f'{key} {col_type}')
-
-                create_query = f'''
-                    CREATE TABLE {table_name} (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        {", ".join(columns)}
-                    )
-                '''
-                cursor.execute(create_query)
-
-            columns = ', '.join(data_dict.keys())
-            placeholders = ':' + ', :'.join(data_dict.keys())
+            if table_name in TABLES:
+                # Таблица по объявленной схеме, строка с тем же ключом заменяет старую
+                create_table(cursor, table_name)
+                statement = 'INSERT OR REPLACE'
+            else:
+                self._create_inferred_table(cursor, table_name, keys, rows)
+                statement = 'INSERT'
+
+            columns = ', '.join(keys)
+            placeholders = ':' + ', :'.join(keys)
 
             # Выполняем запрос - SQLite сам преобразует None в NULL
-            cursor.execute(f'''
-                INSERT INTO {table_name} ({columns})
+            cursor.executemany(f'''
+                {statement} INTO {table_name} ({columns})
                 VALUES ({placeholders})
-            ''', data_dict)
+            ''', rows)
+
+    def _declared_keys(self, table_name, keys):
+        # Столбцы для объявленной таблицы: только известные, отдельно - столбцы с датами
+        columns = TABLES[table_name]['columns']
+
+        unknown = [key for key in keys if key not in columns]
+        if unknown:
+            warnings.warn(f"Столбцы {', '.join(unknown)} нет в схеме таблицы {table_name}, они не сохраняются",
+                          UserWarning)
+            keys = [key for key in keys if key in columns]
+
+        return keys, [key for key in keys if columns[key] == 'DATE']
+
+    def _create_inferred_table(self, cursor, table_name, keys, rows):
+        # Таблица вне объявленной схемы: тип столбца по первому непустому значению
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if cursor.fetchone() is not None:
+            return
+
+        columns = []
+        for key in keys:
+            value = next((row[key] for row in rows if row[key] is not None), None)
+            if isinstance(value, bool) or isinstance(value, int):
+                col_type = 'INTEGER'
+            elif isinstance(value, float):
+                col_type = 'REAL'
+            elif isinstance(value, date) or self.is_date_string(value):
+                col_type = 'DATE'
+            else:
+                col_type = 'TEXT'
+            columns.append(f'{key} {col_type}')
+
+        cursor.execute(f'''
+            CREATE TABLE {table_name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                {", ".join(columns)}
+            )
+        ''')
+
+    def _append_parquet(self, table_name, rows):
+        """
+        Дозапись строк в таблицу parquet отдельной частью, без перезаписи всей таблицы
+        Части сливаются как разряды двоичного счетчика (последние две, пока последняя не меньше
+        предыдущей), поэтому частей O(log n) и каждая строка переписывается O(log n) раз
+        """
+        new_df = pl.DataFrame(rows, infer_schema_length=None)
+
+        if table_name in TABLES:
+            # Типы как у объявленной таблицы SQLite
+            schema = polars_schema(table_name)
+            new_df = new_df.with_columns(
+                [pl.col(column).cast(pl.String).str.to_date(strict=False)
+                 if schema[column] == pl.Date and new_df.schema[column] != pl.Date
+                 else pl.col(column).cast(schema[column], strict=False)
+                 for column in new_df.columns]
+            )
+
+        # id как у AUTOINCREMENT в SQLite: продолжает последний записанный
+        parts = self._parquet_parts(table_name)
+        last = parts[-1][0] if parts else self.parquet_path(table_name)
+        start = 1
+        if os.path.exists(last) and 'id' in pl.read_parquet_schema(last):
+            start = (pl.scan_parquet(last).select(pl.col('id').max()).collect().item() or 0) + 1
+
+        new_df = new_df.with_row_index('id', offset=start).cast({'id': pl.Int64})
+
+        os.makedirs(self._parts_dir(table_name), exist_ok=True)
+        parts.append(self._write_part(table_name, start, new_df))
+
+        while len(parts) >= 2 and parts[-1][2] >= parts[-2][2]:
+            (first, first_start, _), (second, _, _) = parts[-2], parts[-1]
+            merged = self._write_part(table_name, first_start, self._dedup(table_name, pl.concat(
+                [pl.read_parquet(first), pl.read_parquet(second)], how='diagonal_relaxed')), replace=[first, second])
+            parts[-2:] = [merged]
+
+        main = self.parquet_path(table_name)
+        main_rows = pl.scan_parquet(main).select(pl.len()).collect().item() if os.path.exists(main) else 0
+        if sum(rows for _, _, rows in parts) >= max(main_rows, PARQUET_COMPACT_ROWS):
+            self._compact_parquet(table_name)
+
+    def _dedup(self, table_name, df):
+        # Как INSERT OR REPLACE: по ключу объявленной таблицы остается последняя запись
+        if table_name in TABLES:
+            df = df.unique(subset=TABLES[table_name]['key'], keep='last', maintain_order=True)
+        return df
+
+    def _write_part(self, table_name, start, df, replace=()):
+        # Запись части (имя - первый id и число строк), replace - файлы, которые она заменяет
+        path = os.path.join(self._parts_dir(table_name), f"{start:012d}_{df.height}.parquet")
+        temporary = path + '.tmp'
+        df.write_parquet(temporary)
+        for old in replace:
+            os.remove(old)
+        os.replace(temporary, path)
+        return path, start, df.height
+
+    def _compact_parquet(self, table_name):
+        # Слияние частей с основным файлом таблицы
+        if not self._parquet_parts(table_name):
+            return
+
+        df = self._dedup(table_name, self.scan_parquet(table_name).collect())
+        temporary = self.parquet_path(table_name) + '.tmp'
+        df.write_parquet(temporary)
+        os.replace(temporary, self.parquet_path(table_name))
+        shutil.rmtree(self._parts_dir(table_name))
 
     def delete_table(self, table_name):
         "Удаление таблицы"
+        if self.backend == 'parquet':
+            if os.path.exists(self.parquet_path(table_name)):
+                os.remove(self.parquet_path(table_name))
+            shutil.rmtree(self._parts_dir(table_name), ignore_errors=True)
+            return
+
         with self as cursor:
             # Проверяем существование таблицы
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
@@ -81,35 +346,143 @@ class DatabaseManager:
                 # Удаляем таблицу
                 cursor.execute(f"DROP TABLE {table_name}")
 
-    def fetch_data_from_sqlite(self, df, keys_list, table_name, join_parameter):
-        """Получение данных об облигациях из SQLite по списку ISIN"""
+    def write_frame(self, table_name, df, indexes=(), sort_by=None):
+        """
+        Перезапись таблицы целиком из pl.DataFrame
+        indexes - список индексов (каждый - список столбцов), для parquet данные
+        сортируются по sort_by, чтобы фильтры отсекали группы строк по статистикам
+        """
+        self.delete_table(table_name)
+
+        if sort_by:
+            df = df.sort(sort_by, nulls_last=True)
+
+        if self.backend == 'parquet':
+            os.makedirs(self.parquet_dir, exist_ok=True)
+            df.write_parquet(self.parquet_path(table_name), statistics=True)
+            return
+
+        columns = []
+        for name, dtype in df.schema.items():
+            if dtype.is_integer() or dtype == pl.Boolean:
+                col_type = 'INTEGER'
+            elif dtype.is_float():
+                col_type = 'REAL'
+            elif dtype == pl.Date:
+                col_type = 'DATE'
+            else:
+                col_type = 'TEXT'
+            columns.append(f'{name} {col_type}')
+
+        # Даты храним строками YYYY-MM-DD (при чтении столбцы DATE снова становятся датами)
+        df = df.with_columns(pl.col(pl.Date).dt.to_string('%Y-%m-%d'))
+
+        with self as cursor:
+            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(columns)})")
+
+            placeholders = ', '.join(['?'] * len(df.columns))
+            cursor.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", df.iter_rows())
+
+            for index in indexes:
+                cursor.execute(f"CREATE INDEX idx_{table_name}_{'_'.join(index)} "
+                               f"ON {table_name} ({', '.join(index)})")
+
+    def delete_rows(self, table_name, keys_list, key_column='SECID'):
+        "Удаление строк таблицы по списку ключей"
+        if not keys_list or not self.table_exists(table_name):
+            return
+
+        if self.backend == 'parquet':
+            self._compact_parquet(table_name)
+            path = self.parquet_path(table_name)
+            pl.read_parquet(path).filter(~pl.col(key_column).is_in(keys_list)).write_parquet(path)
+            return
+
+        with self as cursor:
+            for i in range(0, len(keys_list), SQLITE_MAX_PARAMS):
+                chunk = keys_list[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join(['?'] * len(chunk))
+                cursor.execute(f"DELETE FROM {table_name} WHERE {key_column} IN ({placeholders})", chunk)
+
+    def fetch_data_from_sqlite(self, df, keys_list, table_name, join_parameter, key_column='SECID'):
+        """Получение данных об облигациях по списку ключей (столбец key_column в таблице)"""
 
         # Проверка что список ISIN не пустой
         if not keys_list:
             print("Передан пустой список ключей")
             return
 
+        result_df = self.scan_table(keys_list, table_name, key_column).collect()
+
+        return df.join(result_df, on=join_parameter, how="inner")
+
+    def scan_table(self, keys_list, table_name, key_column='SECID') -> pl.LazyFrame:
+        """
+        Ленивое чтение строк таблицы по списку ключей из выбранного хранилища
+        """
+        if self.backend == 'parquet':
+            # Чтение parquet без копирования, фильтр проталкивается в сканер
+            return self.scan_parquet(table_name).filter(pl.col(key_column).is_in(keys_list))
+
+        return self.scan_data_from_sqlite(keys_list, table_name, key_column)
+
+    def scan_data_from_sqlite(self, keys_list, table_name, key_column='SECID') -> pl.LazyFrame:
+        """Ленивое чтение строк таблицы по списку ключей (для построения плана в polars)"""
+
+        # Для объявленных таблиц типы известны заранее и не зависят от первых строк
+        schema = polars_schema(table_name) if table_name in TABLES else None
+
+        frames = []
         with self as cursor:
-            placeholders = ','.join(['?'] * len(keys_list))
+            # Список ключей разбивается на части, чтобы не упереться в лимит параметров SQLite
+            for i in range(0, len(keys_list), SQLITE_MAX_PARAMS):
+                chunk = keys_list[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join(['?'] * len(chunk))
 
-            query = f"""
-            SELECT *
-            FROM {table_name} 
-            WHERE secid IN ({placeholders})
-            """
+                query = f"""
+                SELECT *
+                FROM {table_name} 
+                WHERE {key_column} IN ({placeholders})
+                """
 
-            # Если self возвращает курсор, получаем соединение из него
-            if hasattr(cursor, 'connection'):
-                conn = cursor.connection
-            else:
-                # Или предполагаем, что cursor это соединение
-                conn = cursor
+                frames.append(pl.read_database(query, cursor.connection, execute_options={'parameters': chunk},
+                                               schema_overrides=schema))
+
+        if not frames:
+            return pl.LazyFrame()
 
-            result_df = pl.read_database(query, conn, execute_options={'parameters': keys_list})
+        return pl.concat(frames, how='diagonal_relaxed').lazy()
 
-            result_df = df.join(result_df, on=join_parameter, how="inner")
+    def currency_table(self) -> pl.DataFrame:
+        """Курсы всех валют в рублях: FACEUNIT, CURRENCY_RUB"""
 
-            return result_df
+        rub = pl.DataFrame({'FACEUNIT': ['RUB'], 'CURRENCY_RUB': [1.0]},
+                           schema={'FACEUNIT': pl.String, 'CURRENCY_RUB': pl.Float32})
+
+        if not self.table_exists('currency'):
+            return rub
+
+        if self.backend == 'parquet':
+            # Последняя загруженная запись фиксинга для каждой валюты
+            rows = (self.scan_parquet('currency')
+                    .filter(pl.col('SECID').str.ends_with('FIX'))
+                    .sort('id')
+                    .group_by('SECID').last()
+                    .select(pl.col('SECID').str.head(-3), 'LASTVALUE')
+                    .collect().rows())
+        else:
+            with self as cursor:
+                # Берем последнюю загруженную запись фиксинга для каждой валюты
+                cursor.execute("""
+                SELECT substr(SECID, 1, length(SECID) - 3), LASTVALUE
+                FROM currency
+                WHERE SECID LIKE '%FIX' AND id IN (SELECT max(id) FROM currency GROUP BY SECID)
+                """)
+                rows = cursor.fetchall()
+
+        fixings = pl.DataFrame(rows, schema={'FACEUNIT': pl.String, 'CURRENCY_RUB': pl.Float32}, orient='row')
+
+        return pl.concat([rub, fixings.filter(pl.col('FACEUNIT') != 'RUB')])
 
     def currency_value(self, currency: str):
         # Получение знчаения валюты currency
@@ -120,6 +493,13 @@ class DatabaseManager:
         if currency == 'RUB' or currency == 'RUBFIX':
             return 1
 
+        if self.backend == 'parquet':
+            if not self.table_exists('currency'):
+                return None
+            rows = self.scan_parquet('currency').filter(pl.col('SECID') == currency).select('LASTVALUE').collect()
+            # Как fetchone() в SQLite: кортеж или None
+            return rows.row(0) if rows.height else None
+
         with self as cursor:
             query = """
             SELECT LASTVALUE
@@ -1,13 +1,15 @@
 import polars as pl
 from database import DatabaseManager
-from marketdata import get_marketdata
+from marketdata import get_marketdata_many
 from datetime import date
+from valuation import add_valuation
+from bondization import get_schedules
 import warnings
 from visualization import create_monthly_dict, fill_calendar_with_sums, plot_coupon_calendar_seaborn, freerisk_plot
 
 
-def portfolio_upload(path):
-    # Загрузка портфеля облигаций из эксель файла. Файл содержит 2 столбца: ISIN'ы и доля каждого isin
+def read_portfolio(path):
+    # Чтение портфеля облигаций из эксель файла. Файл содержит 2 столбца: ISIN'ы и количество лотов каждого isin
     try:
         df = pl.read_excel(path)
     except IOError as e:
@@ -25,32 +27,33 @@ def portfolio_upload(path):
             "Файл эксель должен состоять из 2 столбцов: 'ISIN' (строковое) и 'Количество лотов' (float) каждого из ISIN в портфеле")
         return
 
+    return df
+
+
+def portfolio_upload(path):
+    # Загрузка портфеля облигаций из эксель файла и расчет показателей
+    df = read_portfolio(path)
+    if df is None:
+        return
+
     # Подключение к базе данных
-    db = DatabaseManager('bonds.db')
+    db = DatabaseManager()
 
     # Удаление старой таблицы с данными по облигациям
     db.delete_table("bonds_info")
 
-    # обновление данных по каждому ISIN в базе данных
-    for row in df.iter_rows():
-        get_marketdata(row[0])
+    # обновление данных по каждому ISIN в базе данных (запросы идут параллельно через планировщик)
+    get_marketdata_many(df['ISIN'].to_list())
 
-    # Уникальные ISIN из датафрейма
-    unique_isins = df["ISIN"].unique().to_list()
-
-    bond_data_df = db.fetch_data_from_sqlite(df, unique_isins, "bonds_info", "ISIN")
-
-    df = dataframe_process(bond_data_df,
-                           date_columns=['NEXTCOUPON', 'MATDATE', 'YIELDDATE', 'OFFERDATE'],
-                           drop_columns=['SECID', 'BOARDID', 'id', 'ISSUESIZE'])
+    # Весь путь от чтения базы до долей в портфеле - один ленивый план, собирается один раз
+    df = build_portfolio_plan(df, db).collect()
 
     # Уникальные валюты в портфеле
     unique_currency = df['FACEUNIT'].unique().to_list()
 
-    df = add_currency_rub(df)
-
-    # Преобразуем количество бумаг в долю в портфеле (по стоимости)
-    df = get_share(df)
+    missing_currency = df.filter(pl.col('CURRENCY_RUB') == 0)['FACEUNIT'].unique().to_list()
+    for currency in missing_currency:
+        print(f"Значение для валюты {currency} не найдены!")
 
     # return df
 
@@ -67,8 +70,12 @@ def portfolio_upload(path):
     # пустой календарь с текущей даты по end_date
     calendar = create_monthly_dict(end_date)
 
-    # Заполнение календаря (учитываются купоны и погашение)
-    payment_calendar = fill_calendar_with_sums(calendar_dict=calendar, df=df, end_date=end_date)
+    # Графики купонов, амортизаций и оферт (кэшируются в базе)
+    schedules = get_schedules(df['ISIN'].unique().to_list(), db)
+
+    # Заполнение календаря (учитываются купоны, амортизации и погашение)
+    payment_calendar = fill_calendar_with_sums(calendar_dict=calendar, df=df, end_date=end_date,
+                                               schedules=schedules)
 
     # Построение графика с выплатами
     plot_coupon_calendar_seaborn(calendar_dict=payment_calendar)
@@ -76,33 +83,85 @@ def portfolio_upload(path):
     return df
 
 
-def get_share(df):
-    # Добавляет в датафрейм столбец с долей каждой бумаги
+# Компактные типы для позиций: категориальные строки, 32-битные числа там, где хватает точности
+# Денежные суммы (стоимость позиций) считаются в Float64 поверх этих столбцов
+POSITION_DTYPES = {
+    'ISIN': pl.Categorical,
+    'SECID': pl.Categorical,
+    'BOARDID': pl.Categorical,
+    'FACEUNIT': pl.Categorical,
+    'STATUS': pl.Categorical,
+    'YIELDDATETYPE': pl.Categorical,
+    'Количество лотов': pl.Int32,
+    'LOTSIZE': pl.Int32,
+    'COUPONPERIOD': pl.Int32,
+    'DURATION': pl.Int32,
+    'FACEVALUE': pl.Float32,
+    'COUPONVALUE': pl.Float32,
+    'COUPONPERCENT': pl.Float32,
+    'ACCRUEDINT': pl.Float32,
+    'LAST': pl.Float32,
+    'MARKETPRICE': pl.Float32,
+    'YIELD': pl.Float32,
+    'YIELDTOOFFER': pl.Float32,
+    'EFFECTIVEYIELD': pl.Float32,
+    'ZSPREADBP': pl.Float32,
+    'GSPREADBP': pl.Float32,
+}
+
+
+def compact_positions(df):
+    # Приведение позиций к компактным типам (только присутствующие столбцы)
+    columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+
+    return df.with_columns(
+        [pl.col(column).cast(pl.String).cast(dtype) if dtype == pl.Categorical else pl.col(column).cast(dtype)
+         for column, dtype in POSITION_DTYPES.items() if column in columns]
+    )
 
-    try:
-        df.cast({'Количество лотов': pl.Int32})
-    except:
-        print("В столбце 'Доля' должны быть только числовые значения")
-        raise ValueError
+
+def build_portfolio_plan(df, db):
+    """
+    Ленивый план обработки портфеля:
+    чтение из базы -> даты и дельты -> курс валюты -> стоимость -> доли
+    Возвращает pl.LazyFrame, ничего не материализуя
+    """
+    # Уникальные ISIN из датафрейма
+    unique_isins = df["ISIN"].unique().to_list()
+
+    bonds_lf = db.scan_table(unique_isins, "bonds_info")
+    lf = df.lazy().join(bonds_lf, on="ISIN", how="inner")
+
+    # Сразу после чтения переходим к компактным типам, чтобы дальше не тащить широкие столбцы
+    lf = compact_positions(lf)
+
+    lf = dataframe_process(lf,
+                           date_columns=['NEXTCOUPON', 'MATDATE', 'YIELDDATE', 'OFFERDATE'],
+                           drop_columns=['SECID', 'BOARDID', 'id', 'ISSUESIZE', 'UPDATED'])
+
+    lf = add_currency_rub(lf, db)
+
+    # Преобразуем количество бумаг в долю в портфеле (по стоимости)
+    lf = get_share(lf)
+
+    return lf
+
+
+def get_share(df, day_count='ACT/ACT'):
+    # Добавляет в датафрейм столбец с долей каждой бумаги
+    # Работает как с pl.DataFrame, так и с pl.LazyFrame
 
     # Создание стоблца с оставшимися днями до выплаты купона в формате int
     df = df.with_columns(
         pl.col('NEXTCOUPON_delta').dt.total_days().alias('NEXTCOUPON_delta_int')
     )
 
-    # Расчет полной стоимости каждой облигации в портфеле
-    # В идеале брать курс валют ЦБ для правильного расчета, но пока что беру что есть
-    df = df.with_columns(
-        (pl.col('FACEVALUE') * pl.coalesce(pl.col('LAST'), pl.col('MARKETPRICE')) / 100 * pl.col(
-            'CURRENCY_RUB') * pl.col('Количество лотов') * pl.col('LOTSIZE') +
-         (pl.col('COUPONPERIOD') - pl.col('NEXTCOUPON_delta_int')) / pl.col('COUPONPERIOD') * pl.col(
-                    'COUPONVALUE') * pl.col('CURRENCY_RUB'))
-        .alias('FULLVALUE_RUB'))
-
-    full_sum = df['FULLVALUE_RUB'].sum()
+    # Полная (грязная) стоимость каждой позиции в рублях с учетом количества облигаций и НКД
+    df = add_valuation(df, day_count=day_count)
 
+    # Доля считается оконной суммой, без отдельной материализации итога
     df = df.with_columns(
-        (pl.col('FULLVALUE_RUB') / full_sum).alias('Доля')
+        (pl.col('FULLVALUE_RUB') / pl.col('FULLVALUE_RUB').sum()).alias('Доля')
     )
 
     return df
@@ -110,101 +169,106 @@ def get_share(df):
 
 def dataframe_process(df, date_columns: list = [], drop_columns=[]):
     # обработка датафрейма
+    # Все преобразования собираются в выражения и применяются одним проходом,
+    # поэтому функция одинаково работает с pl.DataFrame и pl.LazyFrame
 
     today = date.today()
+    date_columns = [column for column in date_columns if column]
 
-    try:
-        for column in date_columns:
-            if column:
-                df = df.cast({column: pl.Date})
-                # Добавление столбцов: дата - текущая дата для всех столбцов где есть даты
-                delta_days = (pl.Series(df[column]) - today).alias(f"{column}_delta")
-                column_index = df.get_column_index(column)
-                df.insert_column(column_index + 1, delta_days)
+    columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
 
-    except:
+    # Столбцы дата - текущая дата для всех столбцов где есть даты
+    # располагаются сразу после исходного столбца
+    order = []
+    for column in columns:
+        order.append(column)
+        if column in date_columns:
+            order.append(f"{column}_delta")
+
+    missing = [column for column in date_columns if column not in columns]
+    if missing:
         warnings.warn(f"Возникла ошибка с трансформацией строки в дату.", UserWarning)
-        raise
+        raise pl.exceptions.ColumnNotFoundError(missing)
 
-    try:
-        for column in drop_columns:
-            df = df.drop(column)
-    except:
+    df = df.with_columns(
+        [pl.col(column).cast(pl.Date) for column in date_columns]
+    ).with_columns(
+        [(pl.col(column) - pl.lit(today)).alias(f"{column}_delta") for column in date_columns]
+    )
+
+    missing = [column for column in drop_columns if column not in order]
+    if missing:
         warnings.warn(f"Возникла ошибка с при удалении столбца.", UserWarning)
 
-    return df
+    return df.select([column for column in order if column not in drop_columns])
 
 
-def add_currency_rub(df):
+def add_currency_rub(df, db=None, currencies=None):
     # Добавление стоимости валюты в рублях для каждой облигации
+    # Курсы присоединяются join'ом, поэтому работает и с ленивым планом
+    # currencies - готовая таблица курсов (например, из кэша), иначе читается из базы
 
-    # Уникальные валюты в датафрейме
-    unique_currency = df['FACEUNIT'].unique().to_list()
-
-    # Получение значения валюты в рублях для каждой уникльной валюты в датафрейме
-    db = DatabaseManager('bonds.db')
-    values = []
-    for currency in unique_currency:
-        value = db.currency_value(currency)
-        if value == 1:  # обработка для рублей
-            values.append(float(value))
-        elif value is not None:  # если валюта найдена
-            values.append(float(value[0]))
-        else:
-            values.append(0)
-            print(f"Значение для валюты {currency} не найдены!")
-
-    # Словарь валюта : значение в рублях
-    currencies = dict(zip(unique_currency, values))
-
-    # Вставка столбца в датафрейм
-    df = df.with_columns(
-        pl.col('FACEUNIT').replace(currencies).alias('CURRENCY_RUB')
-    )
+    if currencies is None:
+        if db is None:
+            db = DatabaseManager()
 
-    # Преобразование столбца в flaot формат
-    df = df.cast({'CURRENCY_RUB': pl.Float32})
+        # Таблица FACEUNIT : значение в рублях
+        currencies = db.currency_table()
 
-    return df
+    # Тип ключа как у позиций (после compact_positions это Categorical)
+    schema = df.collect_schema() if isinstance(df, pl.LazyFrame) else df.schema
+    currencies = currencies.with_columns(pl.col('FACEUNIT').cast(schema['FACEUNIT']))
 
-def portfolio_info(df, currency):
-    # Расчет показателей портфеля
+    df = df.join(currencies.lazy() if isinstance(df, pl.LazyFrame) else currencies,
+                 on='FACEUNIT', how='left')
 
-    weighted_YTM = 0.0
-    weighted_duration = 0.0
-    weighted_couponperid = 0.0
-    weighted_couponpercent = 0.0
-    weighted_yield = 0.0
-    weighted_maturity_date = 0.0
+    # Ненайденные валюты получают 0, как и раньше
+    df = df.with_columns(pl.col('CURRENCY_RUB').fill_null(0.0))
 
-    # пересчет долей
-    sum_share = df['Доля'].sum()
-    df = df.with_columns(
-        (pl.col('Доля') / sum_share).alias('Доля')  # то же имя столбца
-    )
+    return df
 
 
-    for row in df.iter_rows(named=True):
-        # взвешенный купонный период
-        weighted_couponperid += row['Доля'] * row['COUPONPERIOD']
+# Показатели бумаги, которые взвешиваются по доле в портфеле
+METRICS = {
+    # купонный период
+    'couponperiod': pl.col('COUPONPERIOD'),
+    # YTM
+    'ytm': pl.col('EFFECTIVEYIELD'),
+    # дюрация
+    'duration': pl.col('DURATION'),
+    # процент по купонам
+    'couponpercent': pl.col('COUPONPERCENT'),
+    # доходность
+    'yield': pl.col('YIELD'),
+    # срок до погашения
+    'maturity_days': pl.col('MATDATE_delta').dt.total_days(),
+}
+
+
+def portfolio_metrics(df) -> dict:
+    """
+    Взвешенные по долям показатели портфеля (одним векторным проходом)
+    """
+    # пересчет долей
+    share = pl.col('Доля') / pl.col('Доля').sum()
 
-        # взвешенный YTM
-        weighted_YTM += row['Доля'] * row['EFFECTIVEYIELD']
+    metrics = df.select([(share * expr).sum().alias(name) for name, expr in METRICS.items()])
 
-        # взвешенная дюрация
-        weighted_duration += row['Доля'] * row['DURATION']
+    return {key: float(value or 0.0) for key, value in metrics.row(0, named=True).items()}
 
-        # взвешенный процент по купонам
-        weighted_couponpercent += row['Доля'] * row['COUPONPERCENT']
 
-        # взвешенная доходность
-        weighted_yield += row['Доля'] * row['YIELD']
+def portfolio_info(df, currency, curve=None, plot=True):
+    # Расчет показателей портфеля
+    # curve - безрисковая кривая (иначе загружается), plot=False - без графика
 
-        # Взвешенный срок до погашения
-        weighted_maturity_date += row['Доля'] * (row['MATDATE_delta'].total_seconds() / 86400)
+    metrics = portfolio_metrics(df)
 
-        # # Взвешенный срок до события
-        # weighted_maturity_date += row['Доля'] * (row[7].total_seconds() / 86400)
+    weighted_YTM = metrics['ytm']
+    weighted_duration = metrics['duration']
+    weighted_couponperid = metrics['couponperiod']
+    weighted_couponpercent = metrics['couponpercent']
+    weighted_yield = metrics['yield']
+    weighted_maturity_date = metrics['maturity_days']
 
     print(f"Информация по портфелю в валюте {currency}")
     print(f"YTM портфеля: {round(weighted_YTM, 2)}%")
@@ -215,6 +279,5 @@ def portfolio_info(df, currency):
     print(f"Взвешенный срок до погашения: {round(weighted_maturity_date, 2)} дней")
     print(f"Взвешенный срок до погашения: {round(weighted_maturity_date / 365, 3)} лет")
 
-    freerisk_plot(weighted_maturity_date / 365, weighted_YTM, currency)
-
-
+    if plot:
+        freerisk_plot(weighted_maturity_date / 365, weighted_YTM, currency, curve=curve)
@@ -0,0 +1,199 @@
+from datetime import date, timedelta
+import warnings
+
+import numpy as np
+import polars as pl
+import requests
+from dateutil.relativedelta import relativedelta
+
+from database import DatabaseManager
+from riskoff_yields import get_riskoff_yeilds
+from scheduler import get_scheduler, PRIORITY_CURRENCY
+
+
+ISS_FIXING_HISTORY_URL = ("https://iss.moex.com/iss/history/engines/currency/markets/index/securities/{secid}.json"
+                          "?iss.meta=off&iss.only=history&from={start}&start={offset}")
+
+# Валюта номинала -> фиксинг мосбиржи
+FIXINGS = {'USD': 'USDFIX', 'EUR': 'EURFIX', 'CNY': 'CNYFIX'}
+
+# Глубина истории при первой загрузке, лет
+HISTORY_YEARS = 5
+
+HISTORY_SCHEMA = {'FACEUNIT': pl.String, 'TRADEDATE': pl.Date, 'RATE': pl.Float64}
+
+
+def load_fixings(db=None, fixings=FIXINGS):
+    """
+    Загрузка истории фиксингов в таблицу fx_history
+    Догружаются только даты после последней загруженной
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    history = fx_history(db)
+    last_dates = dict(history.group_by('FACEUNIT').agg(pl.col('TRADEDATE').max()).iter_rows())
+
+    scheduler = get_scheduler()
+    rows = []
+    for currency, secid in fixings.items():
+        if currency in last_dates:
+            start = last_dates[currency] + timedelta(days=1)
+        else:
+            # relativedelta, а не replace(year=...): 29 февраля в невисокосном году не существует
+            start = date.today() - relativedelta(years=HISTORY_YEARS)
+
+        # ISS отдает историю страницами, идем до пустой страницы
+        offset = 0
+        while True:
+            url = ISS_FIXING_HISTORY_URL.format(secid=secid, start=start.isoformat(), offset=offset)
+            try:
+                response = scheduler.get(url, priority=PRIORITY_CURRENCY)
+            except requests.RequestException:
+                response = None
+
+            if response is None or response.status_code != 200:
+                warnings.warn(f"Не удалось загрузить историю фиксинга {secid}", RuntimeWarning)
+                break
+
+            block = response.json()['history']
+            if not block['data']:
+                break
+
+            for values in block['data']:
+                record = dict(zip(block['columns'], values))
+                if record.get('CLOSE') is not None:
+                    rows.append({'FACEUNIT': currency, 'TRADEDATE': record['TRADEDATE'], 'RATE': record['CLOSE']})
+
+            offset += len(block['data'])
+
+    db.insert_dicts('fx_history', rows)
+
+
+def fx_history(db=None) -> pl.DataFrame:
+    """
+    История фиксингов: FACEUNIT, TRADEDATE, RATE (отсортирована для join_asof)
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    if not db.table_exists('fx_history'):
+        return pl.DataFrame(schema=HISTORY_SCHEMA)
+
+    if db.backend == 'parquet':
+        df = db.scan_parquet('fx_history').collect()
+    else:
+        with db as cursor:
+            df = pl.read_database("SELECT FACEUNIT, TRADEDATE, RATE FROM fx_history", cursor.connection)
+
+    return (df.select(pl.col('FACEUNIT').cast(pl.String),
+                      pl.col('TRADEDATE').cast(pl.String).str.to_date(),
+                      pl.col('RATE').cast(pl.Float64))
+            .unique(subset=['FACEUNIT', 'TRADEDATE'], keep='last')
+            .sort('FACEUNIT', 'TRADEDATE'))
+
+
+def join_fx_asof(df, date_column, history, alias='FX_RATE'):
+    """
+    Курс фиксинга на дату из date_column (последний известный на эту дату) для каждой строки
+    Для будущих дат берется последний фиксинг, для рублей курс равен 1
+    Результат отсортирован по date_column
+    """
+    schema = df.collect_schema() if isinstance(df, pl.LazyFrame) else df.schema
+
+    right = history.rename({'RATE': alias}).with_columns(pl.col('FACEUNIT').cast(schema['FACEUNIT']))
+    if isinstance(df, pl.LazyFrame):
+        right = right.lazy()
+
+    result = (df.sort(date_column)
+              .join_asof(right, left_on=date_column, right_on='TRADEDATE', by='FACEUNIT', strategy='backward',
+                         check_sortedness=False))
+
+    return result.with_columns(
+        pl.when(pl.col('FACEUNIT').cast(pl.String) == 'RUB').then(pl.lit(1.0))
+        .otherwise(pl.col(alias)).alias(alias)
+    ).drop('TRADEDATE')
+
+
+def add_forward_rates(df, date_column, spot, curves, alias='FX_FORWARD', valuation_date=None) -> pl.DataFrame:
+    """
+    Форвардный курс на дату из date_column по паритету процентных ставок:
+        F = S * ((1 + r_rub) / (1 + r_валюты)) ^ t
+    spot - FACEUNIT, CURRENCY_RUB (например, DatabaseManager.currency_table())
+    curves - {валюта: DataFrame(period, value)}, ставки в процентах, срок в годах
+    Если кривой для валюты или рубля нет, используется спот
+    """
+    valuation_date = valuation_date or date.today()
+
+    df = df.join(spot.select(pl.col('FACEUNIT').cast(df.schema['FACEUNIT']), pl.col('CURRENCY_RUB').alias('_SPOT')),
+                 on='FACEUNIT', how='left')
+
+    years = np.clip((df[date_column] - valuation_date).dt.total_days().to_numpy() / 365, 0, None)
+    currencies = df['FACEUNIT'].cast(pl.String).to_numpy()
+    forward = df['_SPOT'].cast(pl.Float64).to_numpy().copy()
+
+    def rates(curve, t):
+        curve = curve.select(pl.col('period').cast(pl.Float64), pl.col('value').cast(pl.Float64)).sort('period')
+        return np.interp(t, curve['period'].to_numpy(), curve['value'].to_numpy()) / 100
+
+    rub_curve = curves.get('RUB')
+    if rub_curve is not None and not rub_curve.is_empty():
+        for currency in np.unique(currencies):
+            curve = curves.get(currency)
+            if currency == 'RUB' or curve is None or curve.is_empty():
+                continue
+
+            mask = currencies == currency
+            t = years[mask]
+            forward[mask] *= ((1 + rates(rub_curve, t)) / (1 + rates(curve, t))) ** t
+
+    forward[currencies == 'RUB'] = 1.0
+
+    # Валюта без спота после numpy - NaN, возвращаем пустое значение (иначе coalesce его не заменит)
+    return df.with_columns(pl.Series(alias, forward, nan_to_null=True)).drop('_SPOT')
+
+
+class FxConverter:
+    """
+    Пересчет денежных потоков (DATE, FACEUNIT, AMOUNT) в рубли
+        mode='spot' - по фиксингу на дату выплаты (для будущих дат - по последнему)
+        mode='forward' - по форвардному курсу из безрисковых кривых
+    """
+
+    def __init__(self, mode='spot', db=None, history=None, spot=None, curves=None):
+        if mode not in ('spot', 'forward'):
+            raise ValueError(f"Неизвестный режим пересчета {mode}")
+
+        self.mode = mode
+        self.db = db or DatabaseManager()
+        self.history = history
+        self.spot = spot
+        self.curves = curves if curves is not None else {}
+
+    def _curve(self, currency):
+        if currency not in self.curves:
+            try:
+                self.curves[currency] = get_riskoff_yeilds(currency, self.db)
+            except Exception as e:
+                warnings.warn(f"Нет кривой для {currency}: {e}", UserWarning)
+                self.curves[currency] = None
+        return self.curves[currency]
+
+    def convert(self, flows) -> pl.DataFrame:
+        if self.mode == 'spot':
+            if self.history is None:
+                self.history = fx_history(self.db)
+            flows = join_fx_asof(flows, 'DATE', self.history)
+            rate = pl.col('FX_RATE')
+        else:
+            if self.spot is None:
+                self.spot = self.db.currency_table()
+            for currency in ['RUB', *flows['FACEUNIT'].unique().to_list()]:
+                self._curve(currency)
+            flows = add_forward_rates(flows, 'DATE', self.spot, self.curves)
+            rate = pl.col('FX_FORWARD')
+
+        # Если курса нет, остается пересчет по текущему курсу
+        return flows.with_columns(
+            pl.coalesce(pl.col('AMOUNT') * rate.fill_nan(None), pl.col('AMOUNT_RUB')).alias('AMOUNT_RUB')
+        )
@@ -0,0 +1,247 @@
+from collections import defaultdict
+from datetime import date
+
+import polars as pl
+
+from bondization import load_schedules, get_schedules, portfolio_cashflows
+from database import DatabaseManager
+from df_process import build_portfolio_plan, METRICS
+from marketdata import get_marketdata_many
+from visualization import create_monthly_dict
+
+
+# Остатки сумм меньше этого значения после вычитания считаются нулем
+EPSILON = 1e-6
+
+
+class IncrementalPortfolio:
+    """
+    Портфель для интерактивного редактирования (what-if)
+
+    Вклад одного лота каждой бумаги - стоимость, показатели и выплаты по месяцам - кэшируется
+    по ключу (ISIN, версия данных). При изменении позиций к итогам добавляется только
+    разница лотов, умноженная на вклад лота, полный пересчет портфеля не нужен.
+
+    Версия данных бумаги: id строки bonds_info (меняется при каждой перезагрузке),
+    дата загрузки графика выплат, курс валюты и дата расчета
+    """
+
+    def __init__(self, db=None, online=True, to_offer=False, fx=None):
+        self.db = db or DatabaseManager()
+        self.online = online  # дозагружать недостающие бумаги и графики с мосбиржи
+        self.to_offer = to_offer
+        self.fx = fx
+
+        self.lots = {}  # ISIN: количество лотов
+        self._versions = {}  # ISIN: версия данных, по которой посчитан вклад в итоги
+        self._units = {}  # (ISIN, версия): вклад одного лота
+        self._day = date.today()
+        self._reset_totals()
+
+    def _reset_totals(self):
+        self._value = defaultdict(float)  # валюта: стоимость, руб.
+        self._weighted = defaultdict(lambda: dict.fromkeys(METRICS, 0.0))  # валюта: сумма стоимость * показатель
+        self._calendar = defaultdict(float)  # месяц: сумма выплат, руб.
+
+    def _unit(self, isin):
+        return self._units.get((isin, self._versions.get(isin)))
+
+    def _apply(self, unit, lots):
+        # Добавление к итогам вклада lots лотов (lots < 0 - вычитание)
+        currency = unit['FACEUNIT']
+        value = unit['value'] * lots
+
+        self._value[currency] += value
+        for name, metric in unit['metrics'].items():
+            self._weighted[currency][name] += value * metric
+
+        for month, amount in unit['flows'].items():
+            self._calendar[month] += amount * lots
+            if abs(self._calendar[month]) < EPSILON:
+                del self._calendar[month]
+
+    def _read_versions(self, isins) -> dict:
+        # Текущие версии данных по списку ISIN (бумаги, которых нет в базе, пропускаются)
+        if not isins:
+            return {}
+
+        def read_bonds(keys):
+            if not self.db.table_exists('bonds_info'):
+                return {}
+            rows = (self.db.scan_table(keys, 'bonds_info')
+                    .select(pl.col('SECID').cast(pl.String), 'id', pl.col('FACEUNIT').cast(pl.String))
+                    .collect())
+            return {secid: (row_id, faceunit) for secid, row_id, faceunit in rows.iter_rows()}
+
+        bonds = read_bonds(isins)
+
+        missing = [isin for isin in isins if isin not in bonds]
+        if missing and self.online:
+            get_marketdata_many(missing, db=self.db)
+            bonds.update(read_bonds(missing))
+
+        if self.online:
+            # Устаревшие графики перезагружаются, при этом меняется их версия
+            load_schedules(isins, self.db)
+
+        loaded = {}
+        if self.db.table_exists('cashflows_loaded'):
+            loaded = dict(self.db.scan_table(isins, 'cashflows_loaded', key_column='ISIN')
+                          .select(pl.col('ISIN').cast(pl.String), pl.col('LOADED').cast(pl.String))
+                          .collect().iter_rows())
+
+        rates = dict(self.db.currency_table().iter_rows())
+        today = date.today()
+
+        return {isin: (row_id, loaded.get(isin), rates.get(faceunit, 0.0), today)
+                for isin, (row_id, faceunit) in bonds.items()}
+
+    def _load_units(self, versions):
+        # Расчет вклада одного лота для бумаг, которых еще нет в кэше (одним планом на все бумаги)
+        isins = [isin for isin, version in versions.items() if (isin, version) not in self._units]
+        if not isins:
+            return
+
+        positions = pl.DataFrame({'ISIN': isins, 'Количество лотов': [1] * len(isins)},
+                                 schema={'ISIN': pl.String, 'Количество лотов': pl.Int32})
+        df = build_portfolio_plan(positions, self.db).collect()
+        if df.is_empty():
+            return
+
+        schedules = get_schedules(isins, self.db, refresh=False)
+        flows = portfolio_cashflows(df, df['MATDATE'].max(), schedules=schedules, to_offer=self.to_offer,
+                                    fx=self.fx)
+
+        monthly = defaultdict(dict)
+        for isin, month, amount in (flows
+                                    .group_by(pl.col('ISIN').cast(pl.String),
+                                              pl.col('DATE').dt.month_start().alias('month'))
+                                    .agg(pl.col('AMOUNT_RUB').sum())
+                                    .iter_rows()):
+            monthly[isin][month] = amount
+
+        # Пустой показатель не входит в числитель, как при суммировании в portfolio_metrics
+        rows = df.select(
+            pl.col('ISIN').cast(pl.String),
+            pl.col('FACEUNIT').cast(pl.String),
+            'MATDATE',
+            pl.col('FULLVALUE_RUB').cast(pl.Float64).alias('value'),
+            *[expr.cast(pl.Float64).fill_null(0.0).alias(name) for name, expr in METRICS.items()],
+        )
+
+        # Строки кортежами, без промежуточного словаря на каждую бумагу
+        for isin, faceunit, matdate, value, *metrics in rows.iter_rows():
+            self._units[(isin, versions[isin])] = {
+                'FACEUNIT': faceunit,
+                'MATDATE': matdate,
+                'value': value or 0.0,
+                'metrics': dict(zip(METRICS, metrics)),
+                'flows': monthly.get(isin, {}),
+            }
+
+    def _replace(self, isins, versions):
+        # Перевод бумаг на новые версии данных: старый вклад вычитается, новый добавляется
+        self._load_units({isin: versions[isin] for isin in isins if isin in versions})
+
+        for isin in isins:
+            lots = self.lots.get(isin, 0)
+            old_key = (isin, self._versions.get(isin))
+
+            if lots and old_key in self._units:
+                self._apply(self._units[old_key], -lots)
+            self._units.pop(old_key, None)
+
+            if isin in versions:
+                self._versions[isin] = versions[isin]
+                unit = self._unit(isin)
+                if lots and unit is not None:
+                    self._apply(unit, lots)
+            else:
+                self._versions.pop(isin, None)
+
+    def refresh(self) -> list:
+        """
+        Проверка версий данных всех бумаг портфеля (например, после обновления базы или в новый день)
+        Пересчитываются только бумаги, у которых изменилась версия. Возвращает их ISIN
+        """
+        self._day = date.today()
+
+        isins = list(self.lots)
+        versions = self._read_versions(isins)
+        stale = [isin for isin in isins if versions.get(isin) != self._versions.get(isin)]
+
+        self._replace(stale, versions)
+
+        return stale
+
+    def update(self, positions) -> list:
+        """
+        Новое состояние портфеля: pl.DataFrame с ISIN и 'Количество лотов' или словарь {ISIN: лоты}
+        Пересчитываются только изменившиеся позиции. Возвращает их ISIN
+        """
+        if isinstance(positions, pl.DataFrame):
+            positions = dict(positions
+                             .group_by(pl.col('ISIN').cast(pl.String))
+                             .agg(pl.col('Количество лотов').cast(pl.Int64).sum())
+                             .iter_rows())
+
+        changed = {isin: lots for isin, lots in positions.items() if self.lots.get(isin, 0) != lots}
+        changed.update({isin: 0 for isin in self.lots if isin not in positions})
+
+        # Разницы дат считаются от сегодняшнего дня, в новый день обновляются все бумаги
+        if self._day != date.today():
+            self.refresh()
+
+        new = [isin for isin, lots in changed.items() if lots and isin not in self._versions]
+        self._replace(new, self._read_versions(new))
+
+        for isin, lots in changed.items():
+            unit = self._unit(isin)
+            if unit is not None:
+                self._apply(unit, lots - self.lots.get(isin, 0))
+
+            if lots:
+                self.lots[isin] = lots
+            else:
+                self.lots.pop(isin, None)
+
+        if not self.lots:
+            self._reset_totals()
+
+        return list(changed)
+
+    def set_lots(self, isin, lots) -> list:
+        # Изменение одной позиции
+        positions = dict(self.lots)
+        positions[isin] = lots
+        return self.update(positions)
+
+    def metrics(self) -> dict:
+        """
+        Показатели по валютам в формате portfolio_metrics, плюс value_rub - стоимость в рублях
+        """
+        currencies = {unit['FACEUNIT'] for unit in map(self._unit, self.lots) if unit is not None}
+
+        result = {}
+        for currency in sorted(currencies):
+            value = self._value[currency]
+            result[currency] = {name: weighted / value if value else 0.0
+                                for name, weighted in self._weighted[currency].items()}
+            result[currency]['value_rub'] = value
+
+        return result
+
+    def calendar(self) -> dict:
+        """
+        Календарь выплат {месяц: сумма, руб.} - то же, что fill_calendar_with_sums по всему портфелю
+        """
+        dates = [unit['MATDATE'] for unit in map(self._unit, self.lots)
+                 if unit is not None and unit['MATDATE'] is not None]
+        if not dates:
+            return {}
+
+        calendar = create_monthly_dict(max(dates))
+        for month in calendar:
+            calendar[month] += self._calendar.get(month, 0)
+
+        return calendar
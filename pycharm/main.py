@@ -1,3 +1,6 @@
+import sys
+
+import cli
 from df_process import portfolio_upload
 from currency import get_currency
 
@@ -16,5 +19,6 @@ def main(path="bonds.xlsx", update_currency=True):
 
 
 if __name__ == '__main__':
-    main(update_currency=False)
+    # Параметры запуска - в cli.py (python main.py --help)
+    sys.exit(cli.main())
 
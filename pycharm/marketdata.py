@@ -1,26 +1,40 @@
 import requests
 import warnings
+from datetime import date
 from database import DatabaseManager
+from scheduler import get_scheduler, PRIORITY_PORTFOLIO
 
 
-def get_marketdata(isin, try_counter = 1):
+ISS_SECURITY_URL = "https://iss.moex.com/iss/engines/stock/markets/bonds/securities/{isin}.json"
+
+# Коды валют ISS, которые отличаются от кодов в таблице курсов (рубль в ISS - SUR)
+ISS_CURRENCIES = {'SUR': 'RUB'}
+
+
+def get_marketdata(isin, try_counter = 1, response=None, save=True, db=None):
     # Подключение к API мосбиржи
+    # save=False - не записывать в базу, а вернуть словарь с данными
+    # db - локальная база (по умолчанию DatabaseManager())
 
     # Проверка количества попыток для подключения (максимум 4)
     if try_counter >= 4:
         warnings.warn("Попытки подключения к API мосбиржи оказались неудачными", RuntimeWarning)
         return
 
-    url = f"https://iss.moex.com/iss/engines/stock/markets/bonds/securities/{isin}.json"
-    response = requests.get(url)  # запрос данных по url
+    if response is None:
+        url = ISS_SECURITY_URL.format(isin=isin)
+        try:
+            # запрос данных по url через общий планировщик (лимиты ISS)
+            response = get_scheduler().get(url, priority=PRIORITY_PORTFOLIO)
+        except requests.RequestException:
+            response = None
 
     # Проверка успешного подключения
-    if response.status_code != 200:
+    if response is None or response.status_code != 200:
         warnings.warn("Не удалось подключиться к API мосбиржи", RuntimeWarning)
 
         # Выполняем повторное подключение
-        get_marketdata(isin, try_counter = try_counter + 1)
-        return
+        return get_marketdata(isin, try_counter = try_counter + 1, save=save, db=db)
 
     data = response.json()  # Преобразование ответа в JSON
 
@@ -33,12 +47,59 @@ def get_marketdata(isin, try_counter = 1):
     # Получение данных из блока marketdata_yields
     inf2 = get_marketdata_yields_block(inf1, isin, data)
 
-    if inf2:
+    if not inf2:
+        print(f"Информация по {isin} не найдена")
+        return
+
+    # Валюта номинала в тех же кодах, что и курсы валют
+    if inf2.get('FACEUNIT') in ISS_CURRENCIES:
+        inf2['FACEUNIT'] = ISS_CURRENCIES[inf2['FACEUNIT']]
+
+    # Дата загрузки (по ней определяются устаревшие данные)
+    inf2['UPDATED'] = date.today().isoformat()
+
+    if save:
         # Сохранение в базу данных
-        db = DatabaseManager('bonds.db')
+        if db is None:
+            db = DatabaseManager()
         db.insert_dict("bonds_info", inf2)
-    else:
-        print(f"Информация по {isin} не найдена")
+
+    return inf2
+
+
+def get_marketdata_many(isins, priority=PRIORITY_PORTFOLIO, save=True, db=None):
+    # Параллельная загрузка данных по списку ISIN
+    # Все запросы сразу ставятся в очередь планировщика, он сам соблюдает лимиты ISS
+    # Возвращает список словарей с данными, save=False - без записи в базу
+
+    scheduler = get_scheduler()
+    futures = {isin: scheduler.submit(ISS_SECURITY_URL.format(isin=isin), priority=priority)
+               for isin in dict.fromkeys(isins)}
+
+    # Разбор ответов в порядке портфеля
+    rows = []
+    for isin, future in futures.items():
+        try:
+            response = future.result()
+        except requests.RequestException:
+            # Сетевая ошибка - повторяем как в get_marketdata
+            response = None
+
+        if response is None:
+            inf = get_marketdata(isin, try_counter=2, save=False)
+        else:
+            inf = get_marketdata(isin, response=response, save=False)
+
+        if inf:
+            rows.append(inf)
+
+    if save:
+        # Запись в базу одной пачкой
+        if db is None:
+            db = DatabaseManager()
+        db.insert_dicts("bonds_info", rows)
+
+    return rows
 
 
 def get_securities_block(isin, data) -> dict:
@@ -61,6 +122,9 @@ def get_securities_block(isin, data) -> dict:
         # дата следующего купона
         inf[data["securities"]["columns"][6]] = data["securities"]["data"][0][6]
 
+        # ACCRUEDINT (НКД на одну облигацию в валюте номинала)
+        inf[data["securities"]["columns"][7]] = data["securities"]["data"][0][7]
+
         # Lotsize (лотность)
         inf[data["securities"]["columns"][9]] = data["securities"]["data"][0][9]
 
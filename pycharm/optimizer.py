@@ -0,0 +1,420 @@
+import copy
+import warnings
+
+import numpy as np
+import polars as pl
+
+from database import DatabaseManager
+from df_process import dataframe_process, add_currency_rub
+from valuation import add_valuation
+
+
+def prepare_candidates(df, db=None) -> pl.DataFrame:
+    """
+    Подготовка кандидатов для оптимизатора (например, таблицы bonds_info или снимка рынка)
+    Добавляет LOT_COST_RUB - полная стоимость одного лота в рублях
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    lf = df.lazy()
+    if df.schema.get('NEXTCOUPON') != pl.Date:
+        lf = dataframe_process(lf, date_columns=['NEXTCOUPON', 'MATDATE'])
+
+    if 'CURRENCY_RUB' not in df.columns:
+        lf = add_currency_rub(lf, db)
+
+    # Стоимость одного лота считается так же, как стоимость позиции в портфеле
+    lf = add_valuation(lf.with_columns(pl.lit(1).alias('Количество лотов')))
+
+    return (lf.with_columns(pl.col('FULLVALUE_RUB').alias('LOT_COST_RUB'))
+            .drop('Количество лотов')
+            .filter(pl.col('LOT_COST_RUB') > 0,
+                    pl.col('EFFECTIVEYIELD').is_not_null(),
+                    pl.col('DURATION').is_not_null())
+            .collect())
+
+
+class Allocation:
+    """
+    Состояние подбора: лоты по бумагам, остатки лимитов и итоги портфеля
+    Массивы кандидатов общие для всех копий, копируются только изменяемые
+    """
+
+    def __init__(self, yields, durations, lot_cost, issuers, currency_idx, issuer_left, currency_left, budget):
+        self.yields = yields
+        self.durations = durations
+        self.lot_cost = lot_cost
+        self.issuers = issuers
+        self.currency_idx = currency_idx
+
+        self.lots = np.zeros(len(yields), dtype=np.int64)
+        self.issuer_left = issuer_left
+        self.currency_left = currency_left
+        self.budget_left = float(budget)
+        self.value = 0.0  # стоимость портфеля
+        self.duration_sum = 0.0  # сумма дюрация * стоимость
+        self.yield_sum = 0.0  # сумма доходность * стоимость
+
+    def copy(self):
+        other = copy.copy(self)
+        other.lots = self.lots.copy()
+        other.issuer_left = self.issuer_left.copy()
+        other.currency_left = self.currency_left.copy()
+        return other
+
+    @property
+    def duration(self):
+        return self.duration_sum / self.value if self.value > 0 else np.nan
+
+    def capacity(self):
+        # Максимальная сумма покупки по каждой бумаге с учетом всех ограничений
+        return np.minimum.reduce([
+            self.issuer_left[self.issuers],
+            self.currency_left[self.currency_idx],
+            np.full(len(self.lots), self.budget_left),
+        ])
+
+    def trade(self, i, n_lots):
+        # Покупка (n_lots > 0) или продажа (n_lots < 0) лотов бумаги i
+        amount = n_lots * self.lot_cost[i]
+        self.lots[i] += n_lots
+        self.budget_left -= amount
+        self.value += amount
+        self.duration_sum += self.durations[i] * amount
+        self.yield_sum += self.yields[i] * amount
+        self.issuer_left[self.issuers[i]] -= amount
+        self.currency_left[self.currency_idx[i]] -= amount
+
+
+def whole_lots(amount, lot_cost):
+    # Число целых лотов на сумму (с запасом на погрешность сложения)
+    return np.floor(amount / lot_cost + 1e-9)
+
+
+def band_distance(duration, low, high):
+    # Расстояние от дюрации до коридора (пустой портфель - бесконечно далеко)
+    duration = np.nan_to_num(duration, nan=np.inf)
+    return np.maximum(low - duration, 0) + np.maximum(duration - high, 0)
+
+
+def greedy_fill(start, scores):
+    """
+    Покупка бумаг в порядке убывания scores на максимально возможное число лотов
+    """
+    allocation = start.copy()
+    min_cost = allocation.lot_cost.min()
+
+    for i in np.argsort(-scores, kind='stable'):
+        if allocation.budget_left < min_cost:
+            break
+        amount = min(allocation.issuer_left[allocation.issuers[i]],
+                     allocation.currency_left[allocation.currency_idx[i]],
+                     allocation.budget_left)
+        n_lots = int(whole_lots(amount, allocation.lot_cost[i]))
+        if n_lots > 0:
+            allocation.trade(i, n_lots)
+
+    return allocation
+
+
+def better(a, b, low, high):
+    # Сравнение решений: сначала близость к коридору, затем доходность
+    distance_a, distance_b = band_distance(a.duration, low, high), band_distance(b.duration, low, high)
+    if abs(distance_a - distance_b) > 1e-9:
+        return distance_a < distance_b
+    return a.yield_sum > b.yield_sum
+
+
+def penalized_fill(start, target, low, high, steps=40):
+    """
+    Жадный набор по доходности со штрафом за отклонение дюрации от цели:
+    score = доходность - penalty * (дюрация - цель)
+    Без штрафа набор может уйти из коридора (например, длинные бумаги доходнее).
+    Штраф подбирается бисекцией: минимальный, при котором дюрация набора возвращается в коридор
+    """
+    best = greedy_fill(start, start.yields)
+    if best.value == 0 or band_distance(best.duration, low, high) == 0:
+        return best
+
+    # Знак штрафа: портфель слишком длинный - штрафуем длинные бумаги, короткий - короткие
+    sign = 1.0 if best.duration > high else -1.0
+    tolerance = (high - low) / 2
+    deviation = start.durations - target
+
+    def fill(penalty):
+        nonlocal best
+        allocation = greedy_fill(start, start.yields - sign * penalty * deviation)
+        if better(allocation, best, low, high):
+            best = allocation
+        return allocation
+
+    def too_far(allocation):
+        return allocation.value == 0 or sign * (allocation.duration - target) > tolerance
+
+    # Масштаб: разброс доходностей на разброс дюраций
+    unit = (np.ptp(start.yields) + 1.0) / max(np.ptp(start.durations), 1.0)
+    lo, hi = 0.0, unit
+    while too_far(fill(hi)) and hi < unit * 1e6:
+        lo, hi = hi, hi * 4
+
+    for _ in range(steps):
+        mid = (lo + hi) / 2
+        if too_far(fill(mid)):
+            lo = mid
+        else:
+            hi = mid
+
+    return best
+
+
+def exchange(a, sell, sell_lots):
+    """
+    Обмены для матрицы (продаваемая строка x покупаемая бумага): продается sell_lots лотов
+    строки sell (-1 - остаток бюджета, лот 1 рубль), на вырученное покупается максимум целых лотов.
+    Проданная бумага освобождает лимиты своего эмитента и валюты
+    Возвращает суммы покупки и итоги портфеля после обмена: стоимость, сумму дюрация * стоимость
+    и сумму доходность * стоимость
+    """
+    cash = sell < 0
+    freed = sell_lots * np.where(cash, 1.0, a.lot_cost[sell])[:, None]
+    sold = np.where(cash[:, None], 0.0, freed)  # стоимость, ушедшая из портфеля
+
+    issuer = np.where(cash, -1, a.issuers[sell])[:, None]
+    currency = np.where(cash, -1, a.currency_idx[sell])[:, None]
+    capacity = np.minimum(
+        a.issuer_left[a.issuers][None, :] + freed * (issuer == a.issuers[None, :]),
+        a.currency_left[a.currency_idx][None, :] + freed * (currency == a.currency_idx[None, :]),
+    )
+    bought = whole_lots(np.maximum(np.minimum(freed, capacity), 0), a.lot_cost[None, :]) * a.lot_cost[None, :]
+
+    value = a.value - sold + bought
+    duration_sum = a.duration_sum - sold * a.durations[sell][:, None] + bought * a.durations[None, :]
+    yield_sum = a.yield_sum - sold * a.yields[sell][:, None] + bought * a.yields[None, :]
+
+    return bought, value, duration_sum, yield_sum
+
+
+def apply_exchange(a, sell, sell_lots, column, bought):
+    if sell >= 0:
+        a.trade(sell, -int(sell_lots))
+    if bought > 0:
+        a.trade(column, int(round(bought / a.lot_cost[column])))
+
+
+def repair_duration(a, low, high, max_steps=1000):
+    """
+    Ремонт дюрации обменом: часть одной бумаги продается (или берется остаток бюджета)
+    и покупается другая бумага, пока дюрация не попадет в коридор.
+    На каждом шаге все пары (продаваемая позиция, покупаемая бумага) оцениваются одной матрицей
+    и выбирается обмен с минимальной потерей доходности на день исправления дюрации
+    """
+    for _ in range(max_steps):
+        distance = band_distance(a.duration, low, high)
+        if a.value == 0 or distance == 0:
+            break
+
+        # Граница коридора, к которой двигаем дюрацию
+        bound = high if a.duration > high else low
+        excess = a.duration_sum - bound * a.value
+
+        # Строки: позиции портфеля и остаток бюджета
+        sell = np.append(np.flatnonzero(a.lots > 0), -1)
+        cash = sell < 0
+        sell_max = np.where(cash, np.floor(a.budget_left), a.lots[sell])[:, None]
+        sell_lot = np.where(cash, 1.0, a.lot_cost[sell])[:, None]
+        # Остаток бюджета только добавляется к портфелю: в знаменателе нет дюрации проданного
+        sell_duration = np.where(cash, bound, a.durations[sell])[:, None]
+
+        # Сумма обмена, при которой дюрация ровно на границе (с округлением продажи вверх до лота)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            needed = excess / ((sell_duration - bound) + (bound - a.durations[None, :]))
+            sell_lots = np.minimum(np.ceil(needed / sell_lot - 1e-9), sell_max)
+        same = sell[:, None] == np.arange(len(a.lots))[None, :]
+        sell_lots = np.where(np.isfinite(needed) & (needed > 0) & ~same, sell_lots, 0)
+
+        bought, value, duration_sum, yield_sum = exchange(a, sell, sell_lots)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            improvement = distance - band_distance(np.where(value > 0, duration_sum / value, np.nan), low, high)
+            cost = (a.yield_sum - yield_sum) / improvement
+
+        # Остатком бюджета имеет смысл только покупать
+        valid = (sell_lots > 0) & (~cash[:, None] | (bought > 0)) & (improvement > 1e-9)
+        if not valid.any():
+            break
+
+        row, column = np.unravel_index(np.argmin(np.where(valid, cost, np.inf)), cost.shape)
+        apply_exchange(a, sell[row], sell_lots[row, column], column, bought[row, column])
+
+    return a
+
+
+def improve_yield(a, low, high, max_steps=1000):
+    """
+    Улучшение портфеля в коридоре: обмен части позиции на более доходную бумагу
+    на максимальную сумму, при которой дюрация остается в коридоре.
+    На каждом шаге выбирается обмен с максимальным приростом суммы доходность * стоимость
+    """
+    for _ in range(max_steps):
+        if a.value == 0 or band_distance(a.duration, low, high) > 0:
+            break
+
+        sell = np.flatnonzero(a.lots > 0)
+        shift = a.durations[None, :] - a.durations[sell][:, None]
+
+        # Максимальная сумма обмена, не выводящая дюрацию из коридора
+        with np.errstate(divide='ignore', invalid='ignore'):
+            room = np.where(shift > 0, (high * a.value - a.duration_sum) / shift,
+                            np.where(shift < 0, (a.duration_sum - low * a.value) / -shift, np.inf))
+        amount = np.minimum(np.maximum(room, 0), (a.lots[sell] * a.lot_cost[sell])[:, None])
+        sell_lots = whole_lots(amount, a.lot_cost[sell][:, None])
+        sell_lots[sell[:, None] == np.arange(len(a.lots))[None, :]] = 0
+
+        bought, value, duration_sum, yield_sum = exchange(a, sell, sell_lots)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            in_band = band_distance(np.where(value > 0, duration_sum / value, np.nan), low, high) <= 1e-9
+        gain = yield_sum - a.yield_sum
+        valid = (sell_lots > 0) & (bought > 0) & in_band & (gain > 1e-9 * a.value)
+        if not valid.any():
+            break
+
+        row, column = np.unravel_index(np.argmax(np.where(valid, gain, -np.inf)), gain.shape)
+        apply_exchange(a, sell[row], sell_lots[row, column], column, bought[row, column])
+
+    return a
+
+
+def top_up(a, low, high):
+    """
+    Докупка на остаток бюджета: на каждом шаге бумага с максимальной доходностью среди тех,
+    что не уводят дюрацию от коридора (частично, если полная покупка выводит дюрацию за коридор)
+    """
+    while True:
+        cap_amount = a.capacity()
+
+        # Частичная покупка, чтобы остаться в коридоре дюрации
+        with np.errstate(divide='ignore', invalid='ignore'):
+            to_high = np.where(a.durations > high, (high * a.value - a.duration_sum) / (a.durations - high), np.inf)
+            to_low = np.where(a.durations < low, (a.duration_sum - low * a.value) / (low - a.durations), np.inf)
+        in_band_amount = np.minimum(to_high, to_low)
+        limited_by_band = (in_band_amount > 0) & (in_band_amount < cap_amount)
+        amount = np.where(limited_by_band, in_band_amount, cap_amount)
+
+        # Только целые лоты
+        n_lots = whole_lots(np.maximum(amount, 0), a.lot_cost)
+        amount = n_lots * a.lot_cost
+
+        # Бумага допустима, если покупка не ухудшает положение относительно коридора
+        current = band_distance(a.duration, low, high)
+        new_duration = (a.duration_sum + a.durations * amount) / np.maximum(a.value + amount, 1e-9)
+        feasible = (n_lots > 0) & (band_distance(new_duration, low, high) <= current + 1e-9)
+
+        if not feasible.any():
+            return a
+
+        best = np.argmax(np.where(feasible, a.yields, -np.inf))
+        a.trade(best, int(n_lots[best]))
+
+
+def optimize_portfolio(candidates, budget, target_duration, duration_tolerance=30,
+                       issuer_cap=None, currency_caps=None, issuer_column='EMITTER_ID'):
+    """
+    Подбор количества лотов, максимизирующий эффективную доходность портфеля
+
+    candidates - результат prepare_candidates
+    budget - бюджет в рублях
+    target_duration - целевая дюрация в днях, допускается отклонение duration_tolerance
+    issuer_cap - максимальная доля одного эмитента в бюджете (None - без ограничения)
+                 Эмитент берется из столбца issuer_column (EMITTER_ID есть в таблице universe,
+                 см. screener.build_universe), без столбца - ошибка. Бумаги с пустым эмитентом
+                 ограничиваются по отдельности. Чтобы ограничить долю каждой бумаги,
+                 передайте issuer_column='ISIN'
+    currency_caps - максимальные доли по валютам, например {'USD': 0.3}
+
+    Жадный алгоритм с ремонтом:
+        1. набор по доходности со штрафом за отклонение дюрации, штраф подбирается так,
+           чтобы дюрация набора попала в коридор (penalized_fill)
+        2. если коридор недостижим для жадного набора, обмены между бумагами (repair_duration)
+        3. обмены на более доходные бумаги внутри коридора (improve_yield)
+        4. докупка на остаток бюджета без выхода из коридора (top_up)
+    Все кандидаты на каждом шаге оцениваются векторно
+
+    Возвращает DataFrame с ISIN и 'Количество лотов'
+    """
+    currency_caps = currency_caps or {}
+
+    if issuer_cap is not None and issuer_column not in candidates.columns:
+        raise ValueError(f"Нет столбца эмитента '{issuer_column}' для ограничения issuer_cap. "
+                         f"Возьмите кандидатов из таблицы universe, передайте issuer_column='ISIN' "
+                         f"(доля каждой бумаги) или issuer_cap=None")
+
+    isins = candidates['ISIN'].to_numpy()
+    lot_cost = candidates['LOT_COST_RUB'].cast(pl.Float64).to_numpy()
+
+    # Номер эмитента и валюты для каждой бумаги
+    if issuer_cap is None:
+        issuers = np.zeros(len(candidates), dtype=np.int64)
+        issuer_left = np.array([float(budget)])
+    else:
+        issuer = candidates[issuer_column].cast(pl.String)
+        if issuer.null_count():
+            warnings.warn(f"У {issuer.null_count()} бумаг нет эмитента, их доля ограничивается по отдельности",
+                          UserWarning)
+            # Префикс, чтобы ISIN не совпал с кодом эмитента
+            issuer = issuer.fill_null('ISIN:' + candidates['ISIN'].cast(pl.String))
+        issuer_names, issuers = np.unique(issuer.to_numpy(), return_inverse=True)
+        issuer_left = np.full(len(issuer_names), issuer_cap * budget)
+    currency_names, currency_idx = np.unique(candidates['FACEUNIT'].cast(pl.String).to_numpy(),
+                                             return_inverse=True)
+    currency_left = np.array([currency_caps.get(name, 1.0) * budget for name in currency_names])
+
+    low = target_duration - duration_tolerance
+    high = target_duration + duration_tolerance
+
+    start = Allocation(
+        yields=candidates['EFFECTIVEYIELD'].cast(pl.Float64).to_numpy(),
+        durations=candidates['DURATION'].cast(pl.Float64).to_numpy(),
+        lot_cost=lot_cost,
+        issuers=issuers,
+        currency_idx=currency_idx,
+        issuer_left=issuer_left,
+        currency_left=currency_left,
+        budget=budget,
+    )
+
+    allocation = penalized_fill(start, target_duration, low, high) if len(candidates) else start
+    allocation = repair_duration(allocation, low, high)
+    allocation = improve_yield(allocation, low, high)
+    allocation = top_up(allocation, low, high) if len(candidates) else allocation
+
+    if allocation.value > 0 and band_distance(allocation.duration, low, high) > 0:
+        warnings.warn(f"Не удалось попасть в коридор дюрации: {round(allocation.duration, 1)} дней",
+                      UserWarning)
+
+    result = pl.DataFrame({'ISIN': isins, 'Количество лотов': allocation.lots})
+
+    return result.filter(pl.col('Количество лотов') > 0)
+
+
+def allocation_summary(allocation, candidates) -> dict:
+    # Итоговые показатели предложенного портфеля
+    df = allocation.join(candidates, on='ISIN', how='inner').with_columns(
+        (pl.col('Количество лотов') * pl.col('LOT_COST_RUB')).alias('VALUE_RUB')
+    )
+
+    value = df['VALUE_RUB'].sum()
+    if value == 0:
+        return {'value': 0.0, 'yield': 0.0, 'duration': 0.0}
+
+    return {
+        'value': value,
+        'yield': (df['VALUE_RUB'] * df['EFFECTIVEYIELD']).sum() / value,
+        'duration': (df['VALUE_RUB'] * df['DURATION']).sum() / value,
+    }
+
+
+def write_allocation(allocation, path='bonds_proposed.xlsx'):
+    # Сохранение в формате bonds.xlsx: столбцы 'ISIN' и 'Количество лотов'
+    allocation.select('ISIN', 'Количество лотов').write_excel(path)
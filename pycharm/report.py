@@ -0,0 +1,136 @@
+import base64
+import html
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import matplotlib.pyplot as plt
+import polars as pl
+
+from df_process import portfolio_metrics
+from riskoff_yields import get_riskoff_yeilds
+from visualization import create_monthly_dict, fill_calendar_with_sums, plot_coupon_calendar_seaborn, freerisk_plot
+
+
+# Подписи показателей из portfolio_metrics
+METRIC_TITLES = {
+    'ytm': ('YTM портфеля', '%'),
+    'yield': ('Доходность портфеля', '%'),
+    'duration': ('Дюрация портфеля', 'дней'),
+    'couponpercent': ('Взвешенный процент по купонам', '%'),
+    'couponperiod': ('Взвешенный купонный период', 'дней'),
+    'maturity_days': ('Взвешенный срок до погашения', 'дней'),
+}
+
+
+def _init_worker():
+    # В процессах пула графики только сохраняются в файл, окна не открываются
+    plt.switch_backend('Agg')
+
+
+def figure_to_html():
+    # Текущий график matplotlib в <img> с PNG внутри
+    buffer = io.BytesIO()
+    plt.gcf().savefig(buffer, format='png', dpi=100)
+    plt.close('all')
+
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f'<img src="data:image/png;base64,{encoded}"/>'
+
+
+def currency_section(df, currency, curve=None, schedules=None, db=None, fx=None) -> str:
+    """
+    Раздел отчета по одной валюте: таблица показателей, портфель на безрисковой кривой
+    и календарь выплат по бумагам этой валюты
+    Выполняется в отдельном процессе, curve - уже загруженная кривая (иначе загружается,
+    сохраненные кривые берутся из db)
+    """
+    metrics = portfolio_metrics(df)
+
+    rows = ''.join(
+        f'<tr><td>{title}</td><td>{round(metrics[key], 2)} {unit}</td></tr>'
+        for key, (title, unit) in METRIC_TITLES.items()
+    )
+    rows += f"<tr><td>Взвешенный срок до погашения</td><td>{round(metrics['maturity_days'] / 365, 3)} лет</td></tr>"
+    rows += f"<tr><td>Стоимость, руб.</td><td>{df['FULLVALUE_RUB'].sum():,.0f}</td></tr>"
+
+    section = f'<h2>Портфель в валюте {html.escape(currency)}</h2><table>{rows}</table>'
+
+    if curve is None:
+        try:
+            curve = get_riskoff_yeilds(currency, db)
+        except Exception:
+            curve = None
+
+    plt.figure(figsize=(10, 6))
+    ax = freerisk_plot(metrics['maturity_days'] / 365, metrics['ytm'], currency, curve=curve, show=False)
+    if ax is None:
+        plt.close('all')
+        section += f'<p>Нет данных для расчета безрисковой ставки по валюте {html.escape(currency)}</p>'
+    else:
+        section += figure_to_html()
+
+    return section + calendar_section(df, schedules, title=f'Календарь выплат по бумагам в {currency}', level=3,
+                                      fx=fx)
+
+
+def calendar_section(df, schedules=None, title='Календарь выплат по всему портфелю', level=2, fx=None) -> str:
+    # Календарь выплат в рублях по бумагам df (fx - fx.FxConverter, иначе по текущему курсу)
+    end_date = df['MATDATE'].max()
+    calendar = fill_calendar_with_sums(create_monthly_dict(end_date), df, end_date, schedules=schedules, fx=fx)
+
+    header = f'<h{level}>{html.escape(title)}</h{level}>'
+
+    ax = plot_coupon_calendar_seaborn(calendar, title=title, show=False)
+    if ax is None:
+        return header + '<p>Нет выплат</p>'
+
+    return header + figure_to_html()
+
+
+def currency_schedules(schedules, df):
+    # Графики только по бумагам df (в процесс пула передается меньше данных)
+    if schedules is None:
+        return None
+    return schedules.filter(pl.col('ISIN').is_in(df['ISIN'].cast(pl.String).implode()))
+
+
+def generate_report(df, path='report.html', schedules=None, workers=None, curves=None, db=None, fx=None) -> str:
+    """
+    HTML отчет по портфелю (результат build_portfolio_plan / portfolio_upload)
+    Разделы по валютам (со своим календарем выплат) и общий календарь считаются
+    параллельно в пуле процессов, поэтому общее время - время самого долгого раздела
+    curves - {валюта: кривая}, например из локальной базы (иначе кривые загружаются в процессах пула)
+    db - локальная база для процессов пула (по умолчанию DatabaseManager())
+    fx - fx.FxConverter для календарей (пересчет по курсу на дату выплаты)
+    """
+    curves = curves or {}
+
+    currencies = [currency for currency in df['FACEUNIT'].cast(pl.String).unique().sort().to_list()
+                  if round(df.filter(pl.col('FACEUNIT') == currency)['Доля'].sum(), 5) > 0]
+
+    # spawn вместо fork: fork процесса с запущенными потоками polars может зависнуть
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        sections = []
+        for currency in currencies:
+            currency_df = df.filter(pl.col('FACEUNIT') == currency)
+            sections.append(pool.submit(currency_section, currency_df, currency, curves.get(currency),
+                                        currency_schedules(schedules, currency_df), db, fx))
+        calendar = pool.submit(calendar_section, df, schedules, fx=fx)
+
+        body = ''.join(future.result() for future in sections) + calendar.result()
+
+    document = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>Отчет по портфелю на {date.today().isoformat()}</title>'
+        '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse}'
+        'td{border:1px solid #ccc;padding:4px 12px}img{max-width:100%}</style>'
+        f'</head><body><h1>Отчет по портфелю на {date.today().isoformat()}</h1>{body}</body></html>'
+    )
+
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(document)
+
+    return path
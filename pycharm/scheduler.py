@@ -0,0 +1,287 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import requests
+
+
+# Приоритеты запросов (меньше - важнее)
+PRIORITY_PORTFOLIO = 0  # позиции портфеля
+PRIORITY_SCHEDULE = 2  # графики выплат по позициям
+PRIORITY_CURRENCY = 5  # курсы валют
+PRIORITY_CURVE = 10  # кривые и дозагрузка истории
+
+# Лимиты по хостам: (запросов в секунду, размер "пачки")
+# Для ISS мосбиржи держимся ниже порога, после которого начинаются блокировки
+HOST_LIMITS = {
+    'iss.moex.com': (8.0, 8),
+}
+DEFAULT_LIMIT = (4.0, 4)
+
+# Сколько последних ожиданий в очереди хранится по каждому хосту для перцентилей
+WAIT_HISTORY = 1000
+
+
+def freeze(value):
+    # Хэшируемое представление параметров запроса (словари params, headers и т.п.)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity в запасе
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        # Берет токен, если он есть (возвращает 0), иначе - сколько секунд ждать до следующего
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        # Блокирует поток до появления свободного токена
+        while wait := self.try_acquire():
+            time.sleep(wait)
+
+
+class RequestScheduler:
+    """
+    Общий планировщик HTTP запросов.
+    Все загрузчики отправляют запросы сюда, а не напрямую в requests:
+        - на каждый хост своя очередь и свое ведро токенов (HOST_LIMITS)
+        - поток берет запрос только у хоста со свободным токеном, поэтому медленный хост не занимает все потоки
+        - запросы с меньшим priority выполняются раньше
+        - одинаковые запросы (url и параметры), уже стоящие в очереди или в работе, не дублируются,
+          при этом приоритет запроса в очереди поднимается до приоритета повторного
+        - у каждого потока своя requests.Session (сессия не потокобезопасна)
+        - собирается статистика ожидания в очереди
+    """
+
+    def __init__(self, workers=8, timeout=30):
+        self.workers = workers
+        self.timeout = timeout
+
+        # host: куча [priority, порядковый номер, (url, параметры), время постановки, параметры, host]
+        # У замененной записи (приоритет поднят) ключ None, она пропускается при выборке
+        self._queues = {}
+        self._queued = {}  # (url, параметры): запись в очереди
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._in_flight = {}  # (url, параметры): Future
+        self._buckets = {}
+        self._threads = []
+        self._stopped = False
+        self._local = threading.local()
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._waits = {}  # host: последние WAIT_HISTORY ожиданий в очереди, с
+        self._totals = {}  # host: [число запросов, сумма ожиданий, максимальное ожидание]
+        self._coalesced = 0
+
+    def _bucket(self, host):
+        with self._stats_lock:
+            if host not in self._buckets:
+                rate, capacity = HOST_LIMITS.get(host, DEFAULT_LIMIT)
+                self._buckets[host] = TokenBucket(rate, capacity)
+            return self._buckets[host]
+
+    def _start(self):
+        # Потоки запускаются при первом запросе
+        if self._threads:
+            return
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _session(self) -> requests.Session:
+        # Сессия текущего потока
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def submit(self, url, priority=PRIORITY_PORTFOLIO, **kwargs) -> Future:
+        """
+        Ставит GET запрос в очередь, возвращает Future с requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        key = (url, freeze(kwargs))
+
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Планировщик запросов остановлен")
+            self._start()
+
+            # Такой же запрос уже в очереди или выполняется - отдаем его Future
+            if key in self._in_flight:
+                entry = self._queued.get(key)
+                if entry is not None and priority < entry[0]:
+                    entry[2] = None
+                    self._push(priority, key, entry[3], entry[4])
+
+                with self._stats_lock:
+                    self._coalesced += 1
+                return self._in_flight[key]
+
+            future = Future()
+            self._in_flight[key] = future
+            self._push(priority, key, time.monotonic(), kwargs)
+
+        return future
+
+    def _push(self, priority, key, queued_at, kwargs):
+        # Вызывается под self._cond
+        host = urlsplit(key[0]).hostname
+        entry = [priority, next(self._counter), key, queued_at, kwargs, host]
+        heapq.heappush(self._queues.setdefault(host, []), entry)
+        self._queued[key] = entry
+        self._cond.notify()
+
+    def _next(self):
+        # Самый важный запрос среди хостов со свободным токеном (вызывается под self._cond).
+        # Токен берется до извлечения запроса, чтобы поток не спал на ведре одного хоста,
+        # пока запросы к другим хостам ждут в очереди
+        while True:
+            heads = []
+            for host, queue in self._queues.items():
+                while queue and queue[0][2] is None:
+                    heapq.heappop(queue)
+                if queue:
+                    heads.append((queue[0][:2], host))
+
+            if not heads and self._stopped:
+                return None
+
+            wait = None
+            for _, host in sorted(heads):
+                delay = self._bucket(host).try_acquire()
+                if not delay:
+                    entry = heapq.heappop(self._queues[host])
+                    del self._queued[entry[2]]
+                    return entry
+                wait = delay if wait is None else min(wait, delay)
+
+            self._cond.wait(wait)
+
+    def get(self, url, priority=PRIORITY_PORTFOLIO, **kwargs):
+        # Синхронный вариант submit
+        return self.submit(url, priority, **kwargs).result()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                entry = self._next()
+            if entry is None:
+                return
+
+            _, _, key, queued_at, kwargs, host = entry
+            url = key[0]
+
+            wait = time.monotonic() - queued_at
+            with self._stats_lock:
+                self._waits.setdefault(host, deque(maxlen=WAIT_HISTORY)).append(wait)
+                totals = self._totals.setdefault(host, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += wait
+                totals[2] = max(totals[2], wait)
+
+            try:
+                response, error = self._session().get(url, **kwargs), None
+            except Exception as e:
+                response, error = None, e
+
+            # Пока запрос выполнялся, повторные submit получали тот же Future
+            with self._cond:
+                future = self._in_flight.pop(key)
+
+            if error is None:
+                future.set_result(response)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        """
+        Статистика ожидания в очереди по хостам (p95 - по последним WAIT_HISTORY запросам)
+        """
+        with self._stats_lock:
+            result = {}
+            for host, waits in self._waits.items():
+                count, total, longest = self._totals[host]
+                ordered = sorted(waits)
+                result[host] = {
+                    'requests': count,
+                    'mean_wait': total / count,
+                    'p95_wait': ordered[int(0.95 * (len(ordered) - 1))],
+                    'max_wait': longest,
+                }
+            result['coalesced'] = self._coalesced
+            result['queued'] = len(self._queued)
+
+        return result
+
+    def shutdown(self, wait=True):
+        """
+        Останавливает планировщик: новые запросы не принимаются,
+        потоки завершаются после выполнения уже поставленных в очередь
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    # Единый планировщик на процесс
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def configure_scheduler(workers=8, timeout=30) -> RequestScheduler:
+    # Новый общий планировщик с другим числом потоков (например, из параметров командной строки).
+    # Потоки прежнего планировщика завершаются, выполнив его очередь
+    global _scheduler
+    with _scheduler_lock:
+        previous, _scheduler = _scheduler, RequestScheduler(workers=workers, timeout=timeout)
+        scheduler = _scheduler
+
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return scheduler
@@ -0,0 +1,216 @@
+import polars as pl
+
+
+# Объявленная схема таблиц SQLite
+#   columns - столбцы и их типы (DATE хранится строкой YYYY-MM-DD и читается как datetime.date)
+#   key - естественный ключ: новая строка с тем же ключом заменяет старую
+#   autoincrement - суррогатный id (нужен, чтобы брать последнюю загруженную запись)
+#   indexes - индексы под запросы, которые реально выполняются в коде
+TABLES = {
+    'bonds_info': {
+        'columns': {
+            'SECID': 'TEXT',
+            'BOARDID': 'TEXT',
+            'COUPONVALUE': 'REAL',
+            'NEXTCOUPON': 'DATE',
+            'ACCRUEDINT': 'REAL',
+            'LOTSIZE': 'INTEGER',
+            'FACEVALUE': 'REAL',
+            'STATUS': 'TEXT',
+            'MATDATE': 'DATE',
+            'COUPONPERIOD': 'INTEGER',
+            'ISSUESIZE': 'INTEGER',
+            'SECNAME': 'TEXT',
+            'FACEUNIT': 'TEXT',
+            'ISIN': 'TEXT',
+            'COUPONPERCENT': 'REAL',
+            'OFFERDATE': 'DATE',
+            'LAST': 'REAL',
+            'MARKETPRICE': 'REAL',
+            'VALUE': 'REAL',
+            'YIELD': 'REAL',
+            'VALUE_USD': 'REAL',
+            'DURATION': 'INTEGER',
+            'YIELDTOOFFER': 'REAL',
+            'YIELDDATE': 'DATE',
+            'YIELDDATETYPE': 'TEXT',
+            'EFFECTIVEYIELD': 'REAL',
+            'ZSPREADBP': 'REAL',
+            'GSPREADBP': 'REAL',
+            'UPDATED': 'DATE',  # дата загрузки строки с мосбиржи
+        },
+        'key': ['SECID'],
+        'autoincrement': True,
+        # Поиск по SECID покрывается уникальным индексом ключа
+        'indexes': [['ISIN']],
+    },
+    'currency': {
+        'columns': {
+            'BOARDID': 'TEXT',
+            'SECID': 'TEXT',
+            'SHORTNAME': 'TEXT',
+            'LATNAME': 'TEXT',
+            'NAME': 'TEXT',
+            'TRADEDATE': 'DATE',
+            'TIME': 'TEXT',
+            'LASTVALUE': 'REAL',
+        },
+        'key': ['SECID', 'TRADEDATE'],
+        'autoincrement': True,
+        # Последняя запись по каждой валюте (max(id) GROUP BY SECID) читается только из индекса
+        'indexes': [['SECID', 'id', 'LASTVALUE']],
+    },
+    'cashflows': {
+        'columns': {
+            'ISIN': 'TEXT',
+            'DATE': 'DATE',
+            'KIND': 'TEXT',
+            'VALUE': 'REAL',
+            'VALUEPRC': 'REAL',
+        },
+        'key': ['ISIN', 'DATE', 'KIND'],
+        'autoincrement': False,
+        'indexes': [],
+    },
+    'cashflows_loaded': {
+        'columns': {
+            'ISIN': 'TEXT',
+            'LOADED': 'DATE',
+        },
+        'key': ['ISIN'],
+        'autoincrement': False,
+        'indexes': [],
+    },
+    'fx_history': {
+        'columns': {
+            'FACEUNIT': 'TEXT',
+            'TRADEDATE': 'DATE',
+            'RATE': 'REAL',
+        },
+        'key': ['FACEUNIT', 'TRADEDATE'],
+        'autoincrement': False,
+        'indexes': [],
+    },
+    # Безрисковые кривые: срок в годах, ставка в процентах
+    'curves': {
+        'columns': {
+            'CURRENCY': 'TEXT',
+            'TRADEDATE': 'DATE',
+            'PERIOD': 'REAL',
+            'VALUE': 'REAL',
+        },
+        'key': ['CURRENCY', 'TRADEDATE', 'PERIOD'],
+        'autoincrement': False,
+        'indexes': [],
+    },
+}
+
+POLARS_TYPES = {'INTEGER': pl.Int64, 'REAL': pl.Float64, 'TEXT': pl.String, 'DATE': pl.Date}
+
+
+def polars_schema(table_name) -> dict:
+    # Типы polars для столбцов объявленной таблицы (вместе с id)
+    table = TABLES[table_name]
+    schema = {'id': pl.Int64} if table['autoincrement'] else {}
+    schema.update({column: POLARS_TYPES[sql_type] for column, sql_type in table['columns'].items()})
+    return schema
+
+
+def table_columns(cursor, table_name) -> dict:
+    # Столбцы существующей таблицы: имя -> тип
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return {row[1]: row[2] for row in cursor.fetchall()}
+
+
+def create_table(cursor, table_name, name=None):
+    # Создание объявленной таблицы с индексами (name - другое имя таблицы, например при пересборке)
+    table = TABLES[table_name]
+    name = name or table_name
+
+    columns = [f'{column} {sql_type}' for column, sql_type in table['columns'].items()]
+    if table['autoincrement']:
+        columns.insert(0, 'id INTEGER PRIMARY KEY AUTOINCREMENT')
+        columns.append(f"UNIQUE ({', '.join(table['key'])})")
+    else:
+        columns.append(f"PRIMARY KEY ({', '.join(table['key'])})")
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(columns)})")
+
+    for index in table['indexes']:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{'_'.join(index)} "
+                       f"ON {name} ({', '.join(index)})")
+
+
+def rebuild_declared_tables(cursor):
+    """
+    Миграция 1: таблицы, созданные по первой вставленной строке, пересобираются по объявленной схеме
+    Значения приводятся к объявленным типам, при дублях ключа остается последняя загруженная запись
+    """
+    for table_name, table in TABLES.items():
+        existing = table_columns(cursor, table_name)
+        if not existing:
+            continue
+
+        legacy = f'{table_name}_legacy'
+        cursor.execute(f"ALTER TABLE {table_name} RENAME TO {legacy}")
+        create_table(cursor, table_name)
+
+        columns = [column for column in table['columns'] if column in existing]
+        values = []
+        for column in columns:
+            sql_type = table['columns'][column]
+            if sql_type in ('INTEGER', 'REAL'):
+                values.append(f"CAST({column} AS {sql_type})")
+            elif sql_type == 'DATE':
+                # Пустые даты ISS (0000-00-00) и мусор становятся NULL
+                values.append(f"CASE WHEN {column} GLOB '[1-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]' "
+                              f"THEN {column} END")
+            else:
+                values.append(column)
+
+        order = 'ORDER BY id' if 'id' in existing else ''
+        cursor.execute(f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) "
+                       f"SELECT {', '.join(values)} FROM {legacy} {order}")
+        cursor.execute(f"DROP TABLE {legacy}")
+
+
+def add_bonds_updated(cursor):
+    # Миграция 2: дата загрузки строки bonds_info (по ней обновляются только устаревшие бумаги)
+    existing = table_columns(cursor, 'bonds_info')
+    if existing and 'UPDATED' not in existing:
+        cursor.execute("ALTER TABLE bonds_info ADD COLUMN UPDATED DATE")
+
+
+def normalize_rub(cursor):
+    # Миграция 3: рубль из ISS (SUR) хранится как RUB - тем же кодом, что в таблице курсов
+    for table_name in ('bonds_info', 'universe'):
+        if 'FACEUNIT' in table_columns(cursor, table_name):
+            cursor.execute(f"UPDATE {table_name} SET FACEUNIT = 'RUB' WHERE FACEUNIT = 'SUR'")
+
+
+# Миграции по порядку, номер последней примененной хранится в PRAGMA user_version
+# Новые миграции добавляются только в конец списка
+MIGRATIONS = [
+    rebuild_declared_tables,
+    add_bonds_updated,
+    normalize_rub,
+]
+
+
+def migrate(conn):
+    """
+    Применение недостающих миграций к базе одной транзакцией
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.commit()
@@ -0,0 +1,222 @@
+import math
+import re
+import warnings
+from datetime import date, timedelta
+
+import polars as pl
+import requests
+from fake_useragent import UserAgent
+from lxml import etree, html
+
+from database import DatabaseManager
+from scheduler import get_scheduler, PRIORITY_CURVE
+
+
+CHINABOND_URL = 'https://yield.chinabond.com.cn/cbweb-czb-web/czb/moreInfo?locale=en_US&nameType=1'
+INVESTING_URL = 'https://www.investing.com/rates-bonds/germany-government-bonds'
+
+# Таймаут иностранных сайтов (подключение, чтение), с: медленный сайт не должен задерживать расчет
+SCRAPE_TIMEOUT = (5, 15)
+
+# Минимальное число сроков в кривой и допустимый диапазон ставок, %
+MIN_TENORS = 3
+VALUE_RANGE = (-5.0, 50.0)
+
+# Срок вида '3M', '10Y', '6 Month', 'Germany 30Y'
+TENOR_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*-?\s*(M|Y)', re.IGNORECASE)
+
+# Ячейка с датой кривой на chinabond (YYYY-MM-DD), есть только в первой строке данных (rowspan)
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def parse_tenor(text):
+    # Срок из текста в годах (None, если срок не распознан)
+    match = TENOR_PATTERN.search(text)
+    if match is None:
+        return None
+
+    number = float(match.group(1))
+    return number / 12 if match.group(2).upper() == 'M' else number
+
+
+def parse_number(text):
+    try:
+        return float(text.replace(',', '').replace('%', '').strip())
+    except ValueError:
+        return None
+
+
+def cell_texts(row) -> list:
+    return [cell.text_content().strip() for cell in row.xpath('./td|./th')]
+
+
+def parse_chinabond(page) -> pl.DataFrame:
+    """
+    Кривая гособлигаций Китая с chinabond.com.cn
+    Столбцы сроков и доходности ищутся по заголовкам таблицы, а не по номерам
+    Ячейки с датой и заголовок 'Date' пропускаются: дата занимает несколько строк (rowspan),
+    и без фильтра позиции сроков и доходности в первой строке данных сдвигаются
+    """
+    rows = html.fromstring(page).xpath('//div[@id="gjqxData"]//tr')
+
+    header = None
+    periods, values = [], []
+    for row in rows:
+        texts = [text for text in cell_texts(row) if text != 'Date' and not DATE_PATTERN.match(text)]
+
+        if header is None:
+            if 'Maturity' in texts and any(text.startswith('Yield') for text in texts):
+                header = (texts.index('Maturity'),
+                          next(i for i, text in enumerate(texts) if text.startswith('Yield')))
+            continue
+
+        if len(texts) <= max(header):
+            continue
+
+        periods.append(parse_tenor(texts[header[0]]))
+        values.append(parse_number(texts[header[1]]))
+
+    if header is None:
+        raise ValueError("В таблице chinabond нет столбцов Maturity и Yield")
+
+    return pl.DataFrame({'period': periods, 'value': values}, schema={'period': pl.Float64, 'value': pl.Float64})
+
+
+def parse_investing(page) -> pl.DataFrame:
+    """
+    Кривая гособлигаций Германии с investing.com: строки 'Germany 3M' ... 'Germany 30Y'
+    """
+    rows = html.fromstring(page).xpath('//table[contains(@class, "crossRatesTbl")]/tbody/tr')
+
+    periods, values = [], []
+    for row in rows:
+        texts = cell_texts(row)
+        if len(texts) < 3 or not texts[1].startswith('Germany'):
+            continue
+
+        periods.append(parse_tenor(texts[1]))
+        values.append(parse_number(texts[2]))
+
+    return pl.DataFrame({'period': periods, 'value': values}, schema={'period': pl.Float64, 'value': pl.Float64})
+
+
+# Валюта: (страница, разбор)
+SOURCES = {
+    'CNY': (CHINABOND_URL, parse_chinabond),
+    'EUR': (INVESTING_URL, parse_investing),
+}
+
+
+def validate_curve(df, currency):
+    """
+    Проверка структуры разобранной кривой: если разметка сайта изменилась,
+    лучше взять кривую из кэша, чем посчитать спреды по мусору
+    """
+    if df.height < MIN_TENORS:
+        raise ValueError(f"Кривая {currency}: найдено сроков {df.height}, нужно не меньше {MIN_TENORS}")
+
+    if df['period'].null_count() or df['value'].null_count():
+        raise ValueError(f"Кривая {currency}: не распознаны сроки или ставки")
+
+    if df['period'].min() <= 0 or df['period'].n_unique() != df.height:
+        raise ValueError(f"Кривая {currency}: некорректные сроки {df['period'].to_list()}")
+
+    low, high = VALUE_RANGE
+    if not all(math.isfinite(value) and low <= value <= high for value in df['value']):
+        raise ValueError(f"Кривая {currency}: ставки вне диапазона {low}..{high}%")
+
+
+def trading_day(day=None) -> date:
+    # Последний рабочий день (в выходные кривая не меняется)
+    day = day or date.today()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def cached_curve(db, currency, day=None):
+    """
+    Кривая из таблицы curves на дату day (None - последняя сохраненная)
+    Возвращает None, если кривой нет
+    """
+    if not db.table_exists('curves'):
+        return None
+
+    df = db.scan_table([currency], 'curves', key_column='CURRENCY').collect()
+    if df.is_empty():
+        return None
+
+    df = df.with_columns(pl.col('TRADEDATE').cast(pl.Date))
+    df = df.filter(pl.col('TRADEDATE') == (day or df['TRADEDATE'].max()))
+    if df.is_empty():
+        return None
+
+    return curve_frame(df.sort('PERIOD').select(pl.col('PERIOD').alias('period'), pl.col('VALUE').alias('value')))
+
+
+def save_curve(db, currency, day, df):
+    # df - кривая в формате riskoff_yields (лишние столбцы, например tradedate, не сохраняются)
+    rows = df.select(pl.col('period').cast(pl.Float64), pl.col('value').cast(pl.Float64))
+    db.insert_dicts('curves', [{'CURRENCY': currency, 'TRADEDATE': day, 'PERIOD': period, 'VALUE': value}
+                               for period, value in rows.iter_rows()])
+
+
+def curve_frame(df) -> pl.DataFrame:
+    # Формат, в котором кривые возвращает riskoff_yields: period в годах, value в процентах
+    return df.select(pl.col('period').cast(pl.Float64), pl.col('value').cast(pl.Float32)).sort('period')
+
+
+def get_curves(currencies, db=None, refresh=False) -> dict:
+    """
+    Безрисковые кривые с иностранных сайтов {валюта: DataFrame(period, value)}
+
+    Каждая страница разбирается не чаще раза в торговый день: результат сохраняется в таблицу curves.
+    Страницы разных сайтов загружаются параллельно через планировщик, с таймаутом.
+    Если сайт недоступен или разметка не прошла проверку, берется последняя сохраненная кривая
+    (None, если ее нет). refresh=True - загрузить заново, даже если кривая за сегодня уже есть
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    day = trading_day()
+    result = {}
+
+    scheduler = get_scheduler()
+    futures = {}
+    for currency in dict.fromkeys(currencies):
+        if currency not in SOURCES:
+            raise ValueError(f"Нет источника кривой для валюты {currency}")
+
+        if not refresh:
+            cached = cached_curve(db, currency, day)
+            if cached is not None:
+                result[currency] = cached
+                continue
+
+        url, _ = SOURCES[currency]
+        headers = {'User-Agent': UserAgent().random,
+                   'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'}
+        futures[currency] = scheduler.submit(url, priority=PRIORITY_CURVE, headers=headers, timeout=SCRAPE_TIMEOUT)
+
+    for currency, future in futures.items():
+        _, parse = SOURCES[currency]
+        try:
+            response = future.result()
+            response.raise_for_status()
+
+            df = parse(response.content)
+            validate_curve(df, currency)
+        except (requests.RequestException, etree.LxmlError, ValueError) as e:
+            warnings.warn(f"Не удалось загрузить кривую {currency}: {e}. Используется сохраненная кривая",
+                          RuntimeWarning)
+            result[currency] = cached_curve(db, currency)
+            continue
+
+        save_curve(db, currency, day, df)
+        result[currency] = curve_frame(df)
+
+    return result
+
+
+def get_curve(currency, db=None, refresh=False):
+    return get_curves([currency], db, refresh)[currency]
@@ -0,0 +1,246 @@
+from datetime import date
+
+import numpy as np
+import polars as pl
+import requests
+
+from bondization import load_schedules, get_schedules, coupon_types
+from database import DatabaseManager
+from marketdata import ISS_CURRENCIES
+from riskoff_yields import get_riskoff_curves
+from scheduler import get_scheduler, PRIORITY_CURVE
+
+
+ISS_UNIVERSE_URL = ("https://iss.moex.com/iss/engines/stock/markets/bonds/securities.json"
+                    "?iss.meta=off&iss.only=securities,marketdata,marketdata_yields")
+
+# Справочник бумаг: в нем есть эмитент, которого нет в списке бумаг рынка (отдается страницами)
+ISS_EMITTERS_URL = ("https://iss.moex.com/iss/securities.json?iss.meta=off&iss.only=securities"
+                    "&engine=stock&market=bonds&is_trading=1&start={offset}")
+
+# Поля блоков ISS (те же, что в get_securities_block, get_marketdata_block, get_marketdata_yields_block)
+SECURITIES_FIELDS = ['SECID', 'BOARDID', 'SECNAME', 'COUPONVALUE', 'NEXTCOUPON', 'ACCRUEDINT', 'LOTSIZE',
+                     'FACEVALUE', 'STATUS', 'MATDATE', 'COUPONPERIOD', 'ISSUESIZE', 'FACEUNIT', 'ISIN',
+                     'COUPONPERCENT', 'OFFERDATE']
+MARKETDATA_FIELDS = ['SECID', 'BOARDID', 'LAST', 'MARKETPRICE', 'YIELD', 'DURATION', 'YIELDTOOFFER']
+YIELDS_FIELDS = ['SECID', 'BOARDID', 'YIELDDATE', 'YIELDDATETYPE', 'EFFECTIVEYIELD', 'ZSPREADBP', 'GSPREADBP']
+
+DATE_FIELDS = ['NEXTCOUPON', 'MATDATE', 'OFFERDATE', 'YIELDDATE']
+
+# Индексы под фильтры скринера
+UNIVERSE_INDEXES = [
+    ['FACEUNIT', 'MATDATE'],
+    ['FACEUNIT', 'EFFECTIVEYIELD'],
+    ['FACEUNIT', 'DURATION'],
+    ['MATURITY_BUCKET'],
+    ['COUPON_TYPE'],
+    ['OFFERDATE'],
+]
+
+# Границы корзин по сроку до погашения, лет
+MATURITY_BUCKETS = [1, 3, 5, 10]
+
+# Операции фильтра: имя параметра screen -> (столбец, оператор)
+FILTERS = {
+    'currency': ('FACEUNIT', '='),
+    'maturity_from': ('MATDATE', '>='),
+    'maturity_to': ('MATDATE', '<='),
+    'min_yield': ('EFFECTIVEYIELD', '>='),
+    'max_yield': ('EFFECTIVEYIELD', '<='),
+    'min_duration': ('DURATION', '>='),
+    'max_duration': ('DURATION', '<='),
+    'min_spread': ('SPREAD_TO_CURVE_BP', '>='),
+    'coupon_type': ('COUPON_TYPE', '='),
+    'maturity_bucket': ('MATURITY_BUCKET', '='),
+    'offer_from': ('OFFERDATE', '>='),
+    'offer_to': ('OFFERDATE', '<='),
+}
+
+
+def block_frame(data, block, fields) -> pl.DataFrame:
+    # Блок ISS в DataFrame (только нужные и реально присутствующие поля)
+    columns = data[block]['columns']
+    df = pl.DataFrame(data[block]['data'], schema=columns, orient='row', infer_schema_length=None)
+
+    return df.select([field for field in fields if field in columns])
+
+
+def fetch_emitters() -> pl.DataFrame:
+    """
+    Эмитенты торгуемых облигаций: SECID, EMITTER_ID (для ограничения доли эмитента в optimizer)
+    """
+    scheduler = get_scheduler()
+
+    rows = []
+    offset = 0
+    while True:
+        response = scheduler.get(ISS_EMITTERS_URL.format(offset=offset), priority=PRIORITY_CURVE)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Не удалось загрузить эмитентов облигаций: {response.status_code}")
+
+        block = response.json()['securities']
+        if not block['data']:
+            break
+
+        for values in block['data']:
+            record = dict(zip(block['columns'], values))
+            rows.append({'SECID': record.get('secid'), 'EMITTER_ID': record.get('emitent_id')})
+
+        offset += len(block['data'])
+
+    return (pl.DataFrame(rows, schema={'SECID': pl.String, 'EMITTER_ID': pl.Int64})
+            .unique(subset='SECID', keep='first', maintain_order=True))
+
+
+def fetch_universe() -> pl.DataFrame:
+    """
+    Все облигации мосбиржи: одна строка на бумагу, с эмитентом из справочника бумаг
+    """
+    response = get_scheduler().get(ISS_UNIVERSE_URL, priority=PRIORITY_CURVE)
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Не удалось загрузить список облигаций: {response.status_code}")
+
+    data = response.json()
+
+    df = (block_frame(data, 'securities', SECURITIES_FIELDS)
+          .join(block_frame(data, 'marketdata', MARKETDATA_FIELDS), on=['SECID', 'BOARDID'], how='left')
+          .join(block_frame(data, 'marketdata_yields', YIELDS_FIELDS), on=['SECID', 'BOARDID'], how='left'))
+
+    # Одна строка на бумагу: предпочитаем режим торгов, где были сделки
+    df = (df.sort(pl.col('LAST').is_null())
+          .unique(subset='SECID', keep='first', maintain_order=True))
+
+    df = df.join(fetch_emitters(), on='SECID', how='left')
+
+    return df.with_columns(
+        # Пустые даты в ISS приходят как 0000-00-00
+        [pl.col(column).cast(pl.String).str.to_date(strict=False) for column in DATE_FIELDS if column in df.columns]
+    ).with_columns(
+        # Валюта номинала в тех же кодах, что и курсы валют (как в marketdata)
+        pl.col('FACEUNIT').replace(ISS_CURRENCIES),
+    )
+
+
+def curve_spread(df, curves) -> pl.Series:
+    """
+    Спред эффективной доходности к безрисковой кривой валюты бумаги, б.п.
+    Кривая интерполируется линейно по сроку до погашения (в годах)
+    """
+    years = ((df['MATDATE'] - date.today()).dt.total_days() / 365).to_numpy()
+    yields = df['EFFECTIVEYIELD'].cast(pl.Float64).to_numpy()
+    currencies = df['FACEUNIT'].to_numpy()
+
+    spread = np.full(len(df), np.nan)
+    for currency, curve in curves.items():
+        if curve is None or curve.is_empty():
+            continue
+
+        curve = curve.select(pl.col('period').cast(pl.Float64), pl.col('value').cast(pl.Float64)).sort('period')
+        mask = currencies == currency
+        spread[mask] = (yields[mask] - np.interp(years[mask], curve['period'].to_numpy(),
+                                                 curve['value'].to_numpy())) * 100
+
+    return pl.Series('SPREAD_TO_CURVE_BP', spread, nan_to_null=True)
+
+
+def load_universe_schedules(db=None, isins=None):
+    """
+    Отдельный шаг: графики выплат для бумаг из universe (или для списка isins), по ним
+    build_universe определяет тип купона. По запросу на бумагу: для всего рынка
+    (около 3000 бумаг) при лимите ISS это несколько минут, графики кэшируются на неделю
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    if isins is None:
+        isins = screen(db)['SECID'].cast(pl.String).to_list() if db.table_exists('universe') else []
+
+    load_schedules(isins, db)
+
+
+def build_universe(db=None, curves=None, load_coupons=False):
+    """
+    Загрузка всего рынка облигаций в локальную индексированную таблицу universe
+    Предрасчитываются срок в годах, корзина по сроку, тип купона и спред к кривой
+    curves - {валюта: DataFrame(period, value)}, по умолчанию загружаются из riskoff_yields
+    load_coupons - дозагрузить графики выплат всех бумаг (запрос на бумагу, см. load_universe_schedules).
+                   По умолчанию тип купона определяется по уже загруженным графикам,
+                   у бумаг без графика COUPON_TYPE пустой
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    df = fetch_universe()
+
+    secids = df['SECID'].cast(pl.String).to_list()
+    if load_coupons:
+        load_universe_schedules(db, secids)
+    types = coupon_types(get_schedules(secids, db, refresh=False)).rename({'ISIN': 'SECID'})
+
+    if curves is None:
+        curves = get_riskoff_curves(df['FACEUNIT'].drop_nulls().unique().to_list(), db)
+
+    years = (pl.col('MATDATE') - pl.lit(date.today())).dt.total_days() / 365
+
+    bucket = pl.when(years.is_null()).then(pl.lit(None, dtype=pl.String))
+    previous = 0
+    for border in MATURITY_BUCKETS:
+        bucket = bucket.when(years < border).then(pl.lit(f'{previous}-{border}'))
+        previous = border
+    bucket = bucket.otherwise(pl.lit(f'{previous}+'))
+
+    df = df.with_columns(
+        years.alias('YEARS_TO_MATURITY'),
+        bucket.alias('MATURITY_BUCKET'),
+    ).join(types, on='SECID', how='left')
+    df = df.with_columns(curve_spread(df, curves))
+
+    db.write_frame('universe', df, indexes=UNIVERSE_INDEXES, sort_by=['FACEUNIT', 'MATDATE'])
+
+    return df
+
+
+def screen(db=None, sort_by='EFFECTIVEYIELD', descending=True, limit=None, **filters) -> pl.DataFrame:
+    """
+    Запрос к таблице universe, например:
+        screen(currency='RUB', maturity_from=date(2027, 1, 1), maturity_to=date(2029, 12, 31),
+               min_yield=15, min_spread=200)
+    Параметры фильтров - ключи FILTERS
+    """
+    if db is None:
+        db = DatabaseManager()
+
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Неизвестные фильтры: {', '.join(sorted(unknown))}")
+
+    if not sort_by.isidentifier():
+        raise ValueError(f"Некорректный столбец сортировки {sort_by}")
+
+    conditions = [(*FILTERS[name], value) for name, value in filters.items() if value is not None]
+
+    if db.backend == 'parquet':
+        lf = db.scan_parquet('universe')
+        for column, operator, value in conditions:
+            lf = lf.filter(pl.col(column) == value if operator == '=' else
+                           pl.col(column) >= value if operator == '>=' else
+                           pl.col(column) <= value)
+        lf = lf.sort(sort_by, descending=descending, nulls_last=True)
+        if limit:
+            lf = lf.head(limit)
+        return lf.collect()
+
+    # SQLite: фильтры попадают в WHERE и используют индексы
+    where = ' AND '.join(f'{column} {operator} ?' for column, operator, _ in conditions) or '1'
+    params = [value.isoformat() if isinstance(value, date) else value for _, _, value in conditions]
+    query = (f"SELECT * FROM universe WHERE {where} "
+             f"ORDER BY {sort_by} IS NULL, {sort_by} {'DESC' if descending else 'ASC'}")
+    if limit:
+        query += f" LIMIT {int(limit)}"
+
+    with db as cursor:
+        df = pl.read_database(query, cursor.connection, execute_options={'parameters': params})
+
+    return df.with_columns(
+        [pl.col(column).cast(pl.String).str.to_date(strict=False) for column in DATE_FIELDS if column in df.columns]
+    )
@@ -0,0 +1,400 @@
+import asyncio
+import io
+import json
+import math
+import threading
+import time
+import warnings
+from concurrent.futures import Future
+from datetime import date, datetime
+
+import numpy as np
+import polars as pl
+
+from bondization import get_schedules
+from database import DatabaseManager
+from df_process import dataframe_process, compact_positions, add_currency_rub, get_share, portfolio_metrics
+from fx import FxConverter, FIXINGS, fx_history, load_fixings
+from marketdata import get_marketdata_many
+from riskoff_yields import get_riskoff_yeilds
+from screener import curve_spread
+from visualization import create_monthly_dict, fill_calendar_with_sums
+
+
+# Время жизни рыночных данных в кэше, с
+MARKET_TTL = 15 * 60
+
+# Максимальный размер тела запроса
+MAX_BODY = 16 * 1024 * 1024
+
+
+class MarketCache:
+    """
+    Общий для всех запросов кэш рыночных данных в памяти:
+    обработанные строки bonds_info, курсы валют, графики выплат и безрисковые кривые
+    Недостающие ISIN подгружаются с мосбиржи через планировщик.
+    База открывается с одним общим соединением (shared=True)
+    """
+
+    def __init__(self, db=None, ttl=MARKET_TTL):
+        self.db = db or DatabaseManager(shared=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        # Строки по ISIN: bonds - обработанные строки bonds_info, schedules - графики выплат
+        self._frames = {'bonds': None, 'schedules': None}
+        self._loaded = {'bonds': {}, 'schedules': {}}  # ISIN: время загрузки
+        self._pending = {'bonds': {}, 'schedules': {}}  # ISIN: Future загрузки, которая идет сейчас
+        self._currencies = None
+        self._currencies_at = 0.0
+        self._curves = {}  # (валюта, дата): кривая
+        self._fx_history = None
+        self._fx_day = None  # день, за который догружены фиксинги
+        self._day = date.today()
+
+    def _reset_if_new_day(self):
+        # Дельты дат считаются от сегодняшнего дня, поэтому в новый день строки bonds_info сбрасываются
+        if self._day != date.today():
+            self._frames['bonds'] = None
+            self._loaded['bonds'] = {}
+            self._day = date.today()
+
+    def _rows(self, name, isins, load) -> pl.DataFrame:
+        """
+        Строки кэша name по ISIN, устаревшие (старше ttl) загружаются функцией load(isins)
+        Загрузка идет без общей блокировки, чтобы один холодный запрос не задерживал остальных.
+        ISIN, которые уже загружает другой запрос, повторно не загружаются - ждем его Future
+        """
+        with self.lock:
+            self._reset_if_new_day()
+
+            now = time.monotonic()
+            pending = self._pending[name]
+            owned, waiting = [], {}
+            for isin in dict.fromkeys(isins):
+                if isin in pending:
+                    waiting[id(pending[isin])] = pending[isin]
+                elif now - self._loaded[name].get(isin, -self.ttl) >= self.ttl:
+                    owned.append(isin)
+
+            future = Future()
+            for isin in owned:
+                pending[isin] = future
+
+        if owned:
+            try:
+                fresh = load(owned)
+            except Exception as e:
+                with self.lock:
+                    for isin in owned:
+                        pending.pop(isin, None)
+                future.set_exception(e)
+                raise
+
+            with self.lock:
+                frame = self._frames[name]
+                if frame is None:
+                    self._frames[name] = fresh
+                else:
+                    kept = frame.filter(~pl.col('ISIN').cast(pl.String).is_in(owned))
+                    self._frames[name] = pl.concat([kept, fresh], how='diagonal_relaxed')
+
+                for isin in owned:
+                    self._loaded[name][isin] = now
+                    pending.pop(isin, None)
+            future.set_result(None)
+
+        for other in waiting.values():
+            other.result()
+
+        with self.lock:
+            return self._frames[name]
+
+    def _load_bonds(self, isins) -> pl.DataFrame:
+        # Обновление данных по бумагам с мосбиржи: INSERT OR REPLACE по SECID одной транзакцией,
+        # читатели не видят момента, когда старых строк уже нет, а новых еще нет
+        rows = get_marketdata_many(isins, save=False)
+        if rows:
+            self.db.insert_dicts('bonds_info', rows)
+
+        fresh = self.db.scan_table(isins, 'bonds_info').collect()
+        return compact_positions(dataframe_process(
+            fresh,
+            date_columns=['NEXTCOUPON', 'MATDATE', 'YIELDDATE', 'OFFERDATE'],
+            drop_columns=['SECID', 'BOARDID', 'id', 'ISSUESIZE', 'UPDATED']))
+
+    def bonds(self, isins) -> pl.DataFrame:
+        return self._rows('bonds', isins, self._load_bonds)
+
+    def currencies(self) -> pl.DataFrame:
+        with self.lock:
+            if self._currencies is None or time.monotonic() - self._currencies_at >= self.ttl:
+                self._currencies = self.db.currency_table()
+                self._currencies_at = time.monotonic()
+            return self._currencies
+
+    def schedules(self, isins) -> pl.DataFrame:
+        # Графики в памяти; в базе они обновляются не чаще раза в неделю (get_schedules)
+        isins = list(dict.fromkeys(isins))
+        schedules = self._rows('schedules', isins, lambda stale: get_schedules(stale, self.db))
+        return schedules.filter(pl.col('ISIN').is_in(isins))
+
+    def fx(self, mode):
+        # Пересчет выплат по фиксингам или форвардам (None - по текущему курсу)
+        if mode is None:
+            return None
+
+        # Раз в день догружаются новые фиксинги (без общей блокировки, другие запросы
+        # в это время считают по уже загруженной истории)
+        today = date.today()
+        with self.lock:
+            stale = self._fx_day != today
+            self._fx_day = today
+
+        if stale:
+            load_fixings(self.db)
+            history = fx_history(self.db)
+            with self.lock:
+                self._fx_history = history
+
+        with self.lock:
+            history = self._fx_history
+        if history is None:
+            # Первая загрузка еще идет в другом запросе
+            history = fx_history(self.db)
+
+        return FxConverter(mode, self.db, history=history, spot=self.currencies(),
+                           curves={currency: self.curve(currency) for currency in FIXINGS.keys() | {'RUB'}})
+
+    def curve(self, currency) -> pl.DataFrame:
+        key = (currency, date.today())
+        with self.lock:
+            if key in self._curves:
+                return self._curves[key]
+
+        # Загрузка без общей блокировки (кривая раз в день, повторная загрузка не страшна)
+        try:
+            curve = get_riskoff_yeilds(currency, self.db)
+        except Exception as e:
+            warnings.warn(f"Нет кривой для {currency}: {e}", UserWarning)
+            curve = None
+
+        with self.lock:
+            return self._curves.setdefault(key, curve if curve is not None else pl.DataFrame())
+
+
+def parse_positions(body, content_type) -> pl.DataFrame:
+    """
+    Портфель из тела запроса:
+        JSON - {"positions": [{"ISIN": "...", "Количество лотов": 10}, ...]} (вместо названия столбца можно "lots")
+        CSV - столбцы ISIN и 'Количество лотов'
+    """
+    if content_type.startswith('text/csv'):
+        df = pl.read_csv(io.BytesIO(body))
+    else:
+        payload = json.loads(body or b'{}')
+        df = pl.DataFrame(payload.get('positions', []))
+
+    if 'lots' in df.columns:
+        df = df.rename({'lots': 'Количество лотов'})
+
+    if set(df.columns) != {'ISIN', 'Количество лотов'}:
+        raise ValueError("Портфель должен состоять из столбцов 'ISIN' и 'Количество лотов'")
+
+    return df.select(pl.col('ISIN').cast(pl.String), pl.col('Количество лотов').cast(pl.Int32, strict=True))
+
+
+def portfolio_frame(positions, cache) -> pl.DataFrame:
+    # Тот же расчет, что build_portfolio_plan, но по данным из кэша
+    bonds = cache.bonds(positions['ISIN'].to_list())
+    positions = positions.with_columns(pl.col('ISIN').cast(bonds.schema['ISIN']))
+
+    lf = positions.lazy().join(bonds.lazy(), on='ISIN', how='inner')
+    lf = add_currency_rub(lf, currencies=cache.currencies())
+
+    return get_share(lf).collect()
+
+
+def metrics_payload(df) -> dict:
+    result = {}
+    for currency in df['FACEUNIT'].cast(pl.String).unique().sort().to_list():
+        filtered_df = df.filter(pl.col('FACEUNIT') == currency)
+        result[currency] = portfolio_metrics(filtered_df)
+        result[currency]['value_rub'] = filtered_df['FULLVALUE_RUB'].sum()
+
+    return {'currencies': result, 'value_rub': df['FULLVALUE_RUB'].sum()}
+
+
+def calendar_payload(df, cache, to_offer=False, fx_mode=None) -> dict:
+    end_date = df['MATDATE'].max()
+    schedules = cache.schedules(df['ISIN'].cast(pl.String).unique().to_list())
+
+    calendar = fill_calendar_with_sums(create_monthly_dict(end_date), df, end_date,
+                                       schedules=schedules, to_offer=to_offer, fx=cache.fx(fx_mode))
+
+    return {'calendar': [{'month': month.isoformat(), 'amount_rub': amount}
+                         for month, amount in calendar.items() if amount]}
+
+
+def spreads_payload(df, cache) -> dict:
+    currencies = df['FACEUNIT'].cast(pl.String).unique().to_list()
+    curves = {currency: cache.curve(currency) for currency in currencies}
+
+    bonds = df.select(pl.col('ISIN').cast(pl.String), pl.col('FACEUNIT').cast(pl.String),
+                      'MATDATE', 'EFFECTIVEYIELD')
+    bonds = bonds.with_columns(curve_spread(bonds, curves))
+
+    portfolio = {}
+    for currency, curve in curves.items():
+        if curve.is_empty():
+            continue
+
+        metrics = portfolio_metrics(df.filter(pl.col('FACEUNIT') == currency))
+        curve = curve.select(pl.col('period').cast(pl.Float64), pl.col('value').cast(pl.Float64)).sort('period')
+        riskfree = float(np.interp(metrics['maturity_days'] / 365, curve['period'].to_numpy(),
+                                   curve['value'].to_numpy()))
+        portfolio[currency] = {'ytm': metrics['ytm'], 'riskfree': riskfree,
+                               'spread_bp': (metrics['ytm'] - riskfree) * 100}
+
+    return {'bonds': bonds.to_dicts(), 'portfolio': portfolio}
+
+
+def to_json(value):
+    # Сериализация дат и чисел numpy
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Тип {type(value)} не сериализуется")
+
+
+def finite(value):
+    """
+    NaN и бесконечности -> None во вложенных словарях и списках:
+    json.dumps пишет их как NaN/Infinity, а это не JSON (например, 0/0 в показателях
+    валюты без курса). Нужно до json.dumps, default для float не вызывается
+    """
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return float(value) if math.isfinite(value) else None
+    return value
+
+
+def dumps(payload, indent=None) -> str:
+    return json.dumps(finite(payload), ensure_ascii=False, default=to_json, allow_nan=False, indent=indent)
+
+
+class PortfolioService:
+    """
+    Локальный HTTP сервис на asyncio
+
+    GET  /health    - проверка
+    POST /metrics   - показатели портфеля по валютам
+    POST /calendar  - календарь выплат по месяцам (?to_offer=1 - погашение в оферту,
+                      ?fx=spot|forward - пересчет по фиксингам или форвардным курсам)
+    POST /spreads   - спреды к безрисковым кривым
+
+    Расчеты выполняются в пуле потоков, кэш рыночных данных общий для всех запросов
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, cache=None):
+        self.host = host
+        self.port = port
+        self.cache = cache or MarketCache()
+
+    def handle(self, method, path, query, body, content_type):
+        # Синхронная обработка запроса (выполняется в пуле потоков)
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+
+        routes = {'/metrics', '/calendar', '/spreads'}
+        if path not in routes:
+            return 404, {'error': f"Неизвестный путь {path}"}
+        if method != 'POST':
+            return 405, {'error': "Ожидается POST"}
+
+        try:
+            positions = parse_positions(body, content_type)
+        except (ValueError, pl.exceptions.PolarsError) as e:
+            return 400, {'error': str(e)}
+
+        df = portfolio_frame(positions, self.cache)
+        if df.is_empty():
+            return 404, {'error': "Нет данных ни по одной бумаге портфеля"}
+
+        if path == '/metrics':
+            return 200, metrics_payload(df)
+        if path == '/calendar':
+            fx_mode = query.get('fx')
+            if fx_mode not in (None, 'spot', 'forward'):
+                return 400, {'error': f"Неизвестный режим пересчета {fx_mode}"}
+            return 200, calendar_payload(df, self.cache, to_offer=query.get('to_offer') == '1', fx_mode=fx_mode)
+        return 200, spreads_payload(df, self.cache)
+
+    async def _client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, payload = 413, {'error': "Слишком большой запрос"}
+                    body = b''
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    path, _, query_string = target.partition('?')
+                    query = dict(item.partition('=')[::2] for item in query_string.split('&') if item)
+
+                    try:
+                        status, payload = await loop.run_in_executor(
+                            None, self.handle, method, path, query, body, headers.get('content-type', ''))
+                    except Exception as e:
+                        status, payload = 500, {'error': str(e)}
+
+                data = dumps(payload).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+
+                if not keep_alive or length > MAX_BODY:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._client, self.host, self.port)
+        print(f"Сервис запущен на http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+
+def run(host='127.0.0.1', port=8080, db_path=None):
+    service = PortfolioService(host, port, MarketCache(DatabaseManager(db_path, shared=True)))
+    asyncio.run(service.serve())
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,92 @@
+from datetime import date
+import polars as pl
+
+
+# Поддерживаемые конвенции расчета НКД
+DAY_COUNTS = ('ACT/ACT', 'ACT/365', 'ACT/360', '30/360')
+
+
+def price_expr() -> pl.Expr:
+    # Цена в процентах от номинала: последняя сделка, иначе рыночная цена
+    return pl.coalesce(pl.col('LAST'), pl.col('MARKETPRICE'))
+
+
+def quantity_expr() -> pl.Expr:
+    # Количество облигаций в позиции (лоты * лотность)
+    return pl.col('Количество лотов').cast(pl.Int64, strict=True) * pl.col('LOTSIZE')
+
+
+def accrued_interest_expr(day_count='ACT/ACT', valuation_date=None) -> pl.Expr:
+    """
+    НКД на одну облигацию (в валюте номинала) по дате следующего купона и купонному периоду
+
+    ACT/ACT - доля прошедших дней купонного периода от COUPONVALUE (как считает мосбиржа)
+    ACT/365, ACT/360 - ставка купона COUPONPERCENT от номинала за прошедшие дни
+    30/360 - то же, но дни считаются по месяцам в 30 дней
+    """
+    if day_count not in DAY_COUNTS:
+        raise ValueError(f"Неизвестная конвенция {day_count}, доступны: {', '.join(DAY_COUNTS)}")
+
+    today = pl.lit(valuation_date or date.today())
+
+    # Начало текущего купонного периода
+    period = pl.col('COUPONPERIOD')
+    period_start = pl.col('NEXTCOUPON') - pl.duration(days=period)
+
+    # Прошедшие с начала периода дни, не больше длины периода
+    elapsed = (today - period_start).dt.total_days().clip(0, period)
+
+    if day_count == 'ACT/ACT':
+        return pl.col('COUPONVALUE') * elapsed / period
+
+    annual_coupon = pl.col('FACEVALUE') * pl.col('COUPONPERCENT') / 100
+
+    if day_count == 'ACT/365':
+        return annual_coupon * elapsed / 365
+
+    if day_count == 'ACT/360':
+        return annual_coupon * elapsed / 360
+
+    # 30/360: дни 31 считаются как 30
+    start_day = pl.min_horizontal(period_start.dt.day(), 30)
+    end_day = pl.min_horizontal(today.dt.day(), 30)
+    days_30 = ((today.dt.year() - period_start.dt.year()) * 360
+               + (today.dt.month().cast(pl.Int32) - period_start.dt.month().cast(pl.Int32)) * 30
+               + (end_day.cast(pl.Int32) - start_day.cast(pl.Int32))).clip(0, 360)
+
+    return annual_coupon * days_30 / 360
+
+
+def add_valuation(df, day_count='ACT/ACT', use_iss_accrued=True, valuation_date=None):
+    """
+    Добавляет к позициям стоимость (работает с pl.DataFrame и pl.LazyFrame)
+
+    QUANTITY - количество облигаций
+    ACCRUED_PER_BOND - НКД на одну облигацию (ACCRUEDINT мосбиржи, если есть)
+    CLEAN_VALUE, ACCRUED_VALUE, DIRTY_VALUE - чистая стоимость, НКД и полная стоимость в валюте номинала
+    CLEAN_VALUE_RUB, ACCRUED_VALUE_RUB, FULLVALUE_RUB - то же в рублях
+
+    Требуются столбцы: 'Количество лотов', LOTSIZE, FACEVALUE, LAST, MARKETPRICE,
+    COUPONVALUE, COUPONPERIOD, COUPONPERCENT, NEXTCOUPON (pl.Date), CURRENCY_RUB
+    """
+    accrued = accrued_interest_expr(day_count, valuation_date)
+
+    columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+    if use_iss_accrued and 'ACCRUEDINT' in columns:
+        accrued = pl.coalesce(pl.col('ACCRUEDINT'), accrued)
+
+    df = df.with_columns(
+        quantity_expr().alias('QUANTITY'),
+        accrued.fill_null(0.0).alias('ACCRUED_PER_BOND'),
+    ).with_columns(
+        (pl.col('FACEVALUE') * price_expr() / 100 * pl.col('QUANTITY')).alias('CLEAN_VALUE'),
+        (pl.col('ACCRUED_PER_BOND') * pl.col('QUANTITY')).alias('ACCRUED_VALUE'),
+    ).with_columns(
+        (pl.col('CLEAN_VALUE') + pl.col('ACCRUED_VALUE')).alias('DIRTY_VALUE'),
+    ).with_columns(
+        (pl.col('CLEAN_VALUE') * pl.col('CURRENCY_RUB')).alias('CLEAN_VALUE_RUB'),
+        (pl.col('ACCRUED_VALUE') * pl.col('CURRENCY_RUB')).alias('ACCRUED_VALUE_RUB'),
+        (pl.col('DIRTY_VALUE') * pl.col('CURRENCY_RUB')).alias('FULLVALUE_RUB'),
+    )
+
+    return df
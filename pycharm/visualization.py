@@ -1,9 +1,10 @@
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 import seaborn as sns
 import matplotlib.pyplot as plt
 import polars as pl
 from riskoff_yields import get_riskoff_yeilds
+from bondization import portfolio_cashflows
 
 
 def create_monthly_dict(end_date):
@@ -27,7 +28,7 @@ def create_monthly_dict(end_date):
     return monthly_dict
 
 
-def fill_calendar_with_sums(calendar_dict, df, end_date):
+def fill_calendar_with_sums(calendar_dict, df, end_date, schedules=None, to_offer=False, fx=None):
     """
     Заполняет календарь суммами купонных выплат по месяцам
     Все значения приведены к рублю по текущему курсу
@@ -39,43 +40,38 @@ def fill_calendar_with_sums(calendar_dict, df, end_date):
             - days_between_coupons: дни между выплатами
             - coupon_amount: сумма выплаты
         end_date: конечная дата для расчета выплат
+        schedules: графики выплат из bondization.get_schedules
+            Для бумаг с графиком используются точные даты и суммы купонов,
+            амортизаций и погашения, для остальных - оценка по COUPONPERIOD и MATDATE
+        to_offer: считать погашение в дату ближайшей оферты (только для бумаг с графиком)
+        fx: fx.FxConverter - пересчет выплат по курсу на дату выплаты (спот или форвард)
+            вместо текущего курса
     """
     # Создаем копию календаря
     filled_calendar = calendar_dict.copy()
 
-    # Обрабатываем каждую бумагу
-    for row in df.iter_rows(named=True):
-        coupon_date = row['NEXTCOUPON']
-        days_interval = row['COUPONPERIOD']
-        coupon_amount = row['COUPONVALUE'] * row['CURRENCY_RUB'] * row['Количество лотов']
-        maturity_date = row['MATDATE']
-        maturity_sum = row['FACEVALUE'] * row['LOTSIZE'] * row['CURRENCY_RUB'] * row['Количество лотов']
+    flows = portfolio_cashflows(df, end_date, schedules=schedules, to_offer=to_offer, fx=fx)
 
-        # Добавляем все будущие купоны до end_date
-        while coupon_date <= end_date:
-            # Находим первый день месяца для этой даты
-            month_key = coupon_date.replace(day=1)
+    # Суммы по месяцам одним group_by, без цикла по бумагам
+    monthly = (flows
+               .group_by(pl.col('DATE').dt.month_start().alias('month'))
+               .agg(pl.col('AMOUNT_RUB').sum()))
 
-            # Если этот месяц есть в календаре, добавляем сумму
-            if month_key in filled_calendar:
-                filled_calendar[month_key] += coupon_amount
-
-            if maturity_date.month == coupon_date.month and maturity_date.year == coupon_date.year:
-                filled_calendar[month_key] += maturity_sum
-
-            # Переходим к следующей выплате
-            coupon_date += timedelta(days=days_interval)
+    for month_key, amount in monthly.iter_rows():
+        if month_key in filled_calendar:
+            filled_calendar[month_key] += amount
 
     return filled_calendar
 
 
-def plot_coupon_calendar_seaborn(calendar_dict, title="График выплат по месяцам"):
+def plot_coupon_calendar_seaborn(calendar_dict, title="График выплат по месяцам", show=True):
     """
     Строит гистограмму купонных выплат по месяцам с использованием Seaborn
 
     Args:
         calendar_dict: словарь с данными {date: сумма}
         title: заголовок графика
+        show: показать окно с графиком (False - только построить, например для отчета)
     """
     # Фильтруем только месяцы с ненулевыми выплатами и создаем Polars DataFrame
     data = [
@@ -120,16 +116,18 @@ def plot_coupon_calendar_seaborn(calendar_dict, title="График выплат
 
     plt.grid(axis='y', alpha=0.3)
     plt.tight_layout()
-    plt.show()
+    if show:
+        plt.show()
 
     return ax
 
 
-def freerisk_plot(weighted_YTM, weighted_maturity_date, currency):
+def freerisk_plot(weighted_YTM, weighted_maturity_date, currency, curve=None, show=True):
     # Построение графика с эффективной доходностью портфеля относительно
     # безрисковой доходности
+    # curve - уже загруженная кривая (иначе загружается), show=False - без вывода окна
 
-    df = get_riskoff_yeilds(currency)
+    df = curve if curve is not None else get_riskoff_yeilds(currency)
 
     # Проверка существования данных по безрисковой ставке для нужной валюты
     if df is None or df.is_empty():
@@ -165,4 +163,7 @@ def freerisk_plot(weighted_YTM, weighted_maturity_date, currency):
     sns.despine(left=True, bottom=True)
 
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    if show:
+        plt.show()
+
+    return ax
\ No newline at end of file
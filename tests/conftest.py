@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Модули проекта лежат плоско в pycharm/ и импортируют друг друга по имени
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'pycharm'))
+
+from database import DatabaseManager  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    # Пустая локальная база во временной папке
+    return DatabaseManager(str(tmp_path / 'bonds.db'))
+
+
+def bond(isin, currency='RUB', maturity='2029-06-01', period=182, next_coupon='2026-12-01'):
+    # Строка bonds_info в формате get_marketdata
+    return dict(SECID=isin, BOARDID='TQOB', COUPONVALUE=40.0, NEXTCOUPON=next_coupon, ACCRUEDINT=12.3, LOTSIZE=1,
+                FACEVALUE=1000, STATUS='A', MATDATE=maturity, COUPONPERIOD=period, ISSUESIZE=1000000,
+                SECNAME=f'Bond {isin}', FACEUNIT=currency, ISIN=isin, COUPONPERCENT=8.0, OFFERDATE=None, LAST=99.0,
+                MARKETPRICE=98.5, VALUE=None, YIELD=9.5, VALUE_USD=None, DURATION=700, YIELDTOOFFER=None,
+                YIELDDATE=maturity, YIELDDATETYPE='MATDATE', EFFECTIVEYIELD=10.1, ZSPREADBP=50, GSPREADBP=40)
+
+
+@pytest.fixture
+def market(db):
+    """
+    База с облигациями в рублях, юанях и долларах (курсы есть) и в евро (курса нет)
+    У RU000A1 есть график выплат с амортизацией, у остальных выплаты оцениваются по купонному периоду
+    """
+    db.insert_dicts('bonds_info', [
+        bond('RU000A1'),
+        bond('RU000A2', 'CNY', '2027-03-01', period=91),
+        bond('RU000A3', 'USD', '2031-01-01', next_coupon='2026-11-15'),
+        bond('RU000A4', 'EUR', '2030-01-01'),
+    ])
+    db.insert_dicts('currency', [
+        dict(BOARDID='FIXI', SECID=secid, SHORTNAME=secid, LATNAME=secid, NAME=secid, TRADEDATE='2026-10-16',
+             TIME='13:30', LASTVALUE=value)
+        for secid, value in [('USDFIX', 80.0), ('CNYFIX', 11.2)]
+    ])
+    db.insert_dicts('cashflows', [
+        {'ISIN': 'RU000A1', 'DATE': '2026-12-01', 'KIND': 'coupon', 'VALUE': 40.0, 'VALUEPRC': 8.0},
+        {'ISIN': 'RU000A1', 'DATE': '2027-06-01', 'KIND': 'coupon', 'VALUE': 40.0, 'VALUEPRC': 8.0},
+        {'ISIN': 'RU000A1', 'DATE': '2027-06-01', 'KIND': 'amortization', 'VALUE': 500.0, 'VALUEPRC': 50.0},
+        {'ISIN': 'RU000A1', 'DATE': '2029-06-01', 'KIND': 'amortization', 'VALUE': 500.0, 'VALUEPRC': 50.0},
+    ])
+    db.insert_dicts('cashflows_loaded', [{'ISIN': 'RU000A1', 'LOADED': '2026-10-16'}])
+    return db
@@ -0,0 +1,61 @@
+from concurrent.futures import Future
+from datetime import date
+
+import polars as pl
+
+import bondization
+from bondization import SCHEDULE_SCHEMA, coupon_types, load_schedules
+
+
+def schedule(rows):
+    return pl.DataFrame(rows, schema=SCHEDULE_SCHEMA, orient='row')
+
+
+def test_coupon_types_from_schedule():
+    today = date(2026, 10, 19)
+    df = schedule([
+        ('FIXED', date(2026, 12, 1), 'coupon', 40.0, 8.0),
+        ('FIXED', date(2027, 6, 1), 'coupon', 40.0, 8.0),
+        # Флоатер: текущий купон известен (COUPONPERCENT в ISS заполнен), следующие нет
+        ('FLOATER', date(2026, 11, 1), 'coupon', 55.0, 22.0),
+        ('FLOATER', date(2027, 2, 1), 'coupon', None, None),
+        # Неизвестный купон в прошлом не делает бумагу флоатером
+        ('OLD', date(2025, 1, 1), 'coupon', None, None),
+        ('OLD', date(2027, 1, 1), 'coupon', 30.0, 6.0),
+        ('ZERO', date(2028, 1, 1), 'amortization', 1000.0, 100.0),
+    ])
+
+    types = dict(coupon_types(df, today=today).iter_rows())
+
+    assert types == {'FIXED': 'fixed', 'FLOATER': 'floating', 'OLD': 'fixed'}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {'coupons': {'columns': ['coupondate', 'value', 'valueprc'], 'data': [['2027-01-01', 40.0, 8.0]]}}
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.urls = []
+
+    def submit(self, url, priority=None):
+        self.urls.append(url)
+        future = Future()
+        future.set_result(FakeResponse())
+        return future
+
+
+def test_zero_max_age_refetches_schedules_loaded_today(db, monkeypatch):
+    scheduler = FakeScheduler()
+    monkeypatch.setattr(bondization, 'get_scheduler', lambda: scheduler)
+
+    load_schedules(['RU000A1'], db)
+    load_schedules(['RU000A1'], db)
+    assert len(scheduler.urls) == 1
+
+    load_schedules(['RU000A1'], db, max_age_days=0)
+    assert len(scheduler.urls) == 2
+    assert bondization.get_schedules(['RU000A1'], db, refresh=False).height == 1
@@ -0,0 +1,99 @@
+import json
+import pickle
+
+import polars as pl
+import pytest
+
+import cli
+import database
+from database import DatabaseManager
+
+
+@pytest.fixture
+def snapshot(market, tmp_path):
+    # Портфель с бумагой в евро, для которой в базе нет курса
+    portfolio = tmp_path / 'bonds.xlsx'
+    pl.DataFrame({'ISIN': ['RU000A1', 'RU000A4'], 'Количество лотов': [10, 5]}).write_excel(portfolio)
+
+    return market, portfolio
+
+
+def test_db_argument_does_not_change_module_default(snapshot, tmp_path, monkeypatch):
+    db, portfolio = snapshot
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    monkeypatch.chdir(workdir)
+
+    code = cli.main(['analyze', '--cache', 'offline', '--headless', '--db', db.db_path, '-p', str(portfolio)])
+
+    assert code == 0
+    assert database.DEFAULT_DB_PATH == 'bonds.db'
+    assert not (workdir / 'bonds.db').exists()
+
+
+def test_default_stages(snapshot, tmp_path, monkeypatch, capsys):
+    # Без этапов выполняются refresh и analyze (в режиме offline refresh пропускается)
+    db, portfolio = snapshot
+    monkeypatch.chdir(tmp_path)
+
+    assert cli.parse_args([]).stages == ['refresh', 'analyze']
+    assert cli.main(['--cache', 'offline', '--headless', '--db', db.db_path, '-p', str(portfolio)]) == 0
+    assert "Выплаты по месяцам" in capsys.readouterr().out
+
+
+def test_unknown_stage():
+    with pytest.raises(SystemExit):
+        cli.parse_args(['analyse'])
+
+
+def test_json_output_is_strict(snapshot, tmp_path, monkeypatch):
+    # У EUR в базе нет курса: стоимость 0, показатели валюты 0/0 = NaN
+    db, portfolio = snapshot
+    monkeypatch.chdir(tmp_path)
+    output = tmp_path / 'analysis.json'
+
+    cli.main(['analyze', '--cache', 'offline', '--headless', '--format', 'json', '-o', str(output),
+              '--db', db.db_path, '-p', str(portfolio)])
+
+    def reject(token):
+        raise ValueError(f"не JSON: {token}")
+
+    payload = json.loads(output.read_text(encoding='utf-8'), parse_constant=reject)
+    assert payload['calendar']
+
+
+def calendar_json(db, portfolio, output, *extra):
+    cli.main(['analyze', '--cache', 'offline', '--headless', '--format', 'json', '-o', str(output),
+              '--db', db.db_path, '-p', str(portfolio), *extra])
+    return {row['month']: row['amount_rub'] for row in json.loads(output.read_text(encoding='utf-8'))['calendar']}
+
+
+def test_fx_mode_uses_fixings(market, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    portfolio = tmp_path / 'usd.xlsx'
+    pl.DataFrame({'ISIN': ['RU000A3'], 'Количество лотов': [1]}).write_excel(portfolio)
+    # Текущий курс USD в базе 80, последний фиксинг 100
+    market.insert_dicts('fx_history', [{'FACEUNIT': 'USD', 'TRADEDATE': '2026-10-16', 'RATE': 100.0}])
+
+    current = calendar_json(market, portfolio, tmp_path / 'current.json')
+    spot = calendar_json(market, portfolio, tmp_path / 'spot.json', '--fx', 'spot')
+
+    assert current.keys() == spot.keys()
+    for month, amount in current.items():
+        assert spot[month] == pytest.approx(amount * 100 / 80)
+
+
+def test_refresh_loads_fixings(db, monkeypatch):
+    calls = []
+    for name in ('get_marketdata_many', 'get_currency', 'load_schedules', 'refresh_curves', 'load_fixings'):
+        monkeypatch.setattr(cli, name, lambda *args, name=name, **kwargs: calls.append(name))
+
+    cli.refresh(['RU000A1'], db, 'refresh-stale')
+
+    assert 'load_fixings' in calls
+
+
+def test_database_manager_is_passed_to_another_process(db):
+    copy = pickle.loads(pickle.dumps(DatabaseManager(db.db_path, 'parquet', shared=True)))
+
+    assert (copy.db_path, copy.backend, copy.shared) == (db.db_path, 'parquet', True)
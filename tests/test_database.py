@@ -0,0 +1,77 @@
+import os
+from datetime import date
+
+import polars as pl
+import pytest
+
+import database
+from conftest import bond
+from database import DatabaseManager, SQLITE_MAX_PARAMS
+
+
+@pytest.fixture(params=['sqlite', 'parquet'])
+def store(tmp_path, request):
+    return DatabaseManager(str(tmp_path / 'bonds.db'), request.param)
+
+
+def test_round_trip_with_declared_types(store):
+    store.insert_dicts('bonds_info', [bond('RU000A1'), {**bond('RU000A2', 'USD'), 'OFFERDATE': '0000-00-00'}])
+
+    df = store.scan_table(['RU000A1', 'RU000A2'], 'bonds_info').collect().sort('SECID')
+
+    assert df['SECID'].to_list() == ['RU000A1', 'RU000A2']
+    assert df.schema['MATDATE'] == pl.Date and df.schema['LOTSIZE'] == pl.Int64
+    assert df['MATDATE'].to_list() == [date(2029, 6, 1)] * 2
+    assert df['OFFERDATE'].to_list() == [None, None]
+    assert df['id'].to_list() == [1, 2]
+
+
+def test_key_replacement(store):
+    store.insert_dict('bonds_info', bond('RU000A1'))
+    store.insert_dict('bonds_info', bond('RU000A2'))
+    store.insert_dict('bonds_info', {**bond('RU000A1'), 'LAST': 101.0})
+
+    df = store.scan_table(['RU000A1', 'RU000A2'], 'bonds_info').collect().sort('SECID')
+
+    assert df['LAST'].to_list() == [101.0, 99.0]
+
+    store.delete_rows('bonds_info', ['RU000A2'])
+    assert store.scan_table(['RU000A1', 'RU000A2'], 'bonds_info').collect()['SECID'].to_list() == ['RU000A1']
+
+
+def test_chunked_lookup(store):
+    isins = [f'RU{i:06d}' for i in range(SQLITE_MAX_PARAMS + 50)]
+    store.insert_dicts('bonds_info', [bond(isin) for isin in isins])
+
+    df = store.scan_table(isins[::-1], 'bonds_info').collect()
+
+    assert df.height == len(isins)
+    assert set(df['SECID'].to_list()) == set(isins)
+
+
+def test_currency_value(store):
+    assert store.currency_value('RUB') == 1
+
+    store.insert_dicts('currency', [dict(BOARDID='FIXI', SECID='USDFIX', SHORTNAME='USDFIX', LATNAME='USDFIX',
+                                         NAME='USDFIX', TRADEDATE='2026-10-16', TIME='13:30', LASTVALUE=80.0)])
+
+    assert store.currency_value('USD') == (80.0,)
+    assert store.currency_value('CNY') is None
+
+
+def test_parquet_appends_do_not_rewrite_the_table(tmp_path, monkeypatch):
+    # Построчная запись (как get_marketdata): частей O(log n), основной файл собирается по порогу
+    monkeypatch.setattr(database, 'PARQUET_COMPACT_ROWS', 40)
+    db = DatabaseManager(str(tmp_path / 'bonds.db'), 'parquet')
+
+    for i in range(100):
+        db.insert_dict('bonds_info', bond(f'RU{i % 70:06d}'))
+        assert len(db._parquet_parts('bonds_info')) <= 7
+
+    assert os.path.exists(db.parquet_path('bonds_info'))
+
+    df = db.scan_table([f'RU{i:06d}' for i in range(70)], 'bonds_info').collect()
+    assert df.height == 70
+    # У перезаписанных бумаг остается последняя запись
+    assert df.filter(pl.col('SECID') == 'RU000000')['id'].to_list() == [71]
+    assert df['id'].n_unique() == 70
@@ -0,0 +1,116 @@
+from datetime import date
+
+import polars as pl
+import pytest
+from dateutil.relativedelta import relativedelta
+
+import fx
+from fx import FxConverter, add_forward_rates, fx_history, load_fixings
+
+
+TODAY = date.today()
+
+SPOT = pl.DataFrame({'FACEUNIT': ['RUB', 'USD'], 'CURRENCY_RUB': [1.0, 80.0]},
+                    schema={'FACEUNIT': pl.String, 'CURRENCY_RUB': pl.Float32})
+
+
+def flat(rate):
+    return pl.DataFrame({'period': [0.25, 1.0, 10.0], 'value': [rate] * 3})
+
+
+def flows(currencies, amounts, amounts_rub, day):
+    return pl.DataFrame({'DATE': [day] * len(currencies), 'FACEUNIT': currencies,
+                         'AMOUNT': amounts, 'AMOUNT_RUB': amounts_rub})
+
+
+def test_forward_rate_by_interest_parity():
+    day = TODAY + relativedelta(years=2)
+    years = (day - TODAY).days / 365
+    df = pl.DataFrame({'DATE': [day, day], 'FACEUNIT': ['USD', 'RUB']})
+
+    result = add_forward_rates(df, 'DATE', SPOT, {'RUB': flat(15.0), 'USD': flat(5.0)}, valuation_date=TODAY)
+
+    assert result['FX_FORWARD'].to_list() == pytest.approx([80.0 * (1.15 / 1.05) ** years, 1.0])
+
+
+def test_forward_without_curve_uses_spot():
+    day = TODAY + relativedelta(years=1)
+    df = pl.DataFrame({'DATE': [day], 'FACEUNIT': ['USD']})
+
+    result = add_forward_rates(df, 'DATE', SPOT, {'RUB': flat(15.0), 'USD': None}, valuation_date=TODAY)
+
+    assert result['FX_FORWARD'].to_list() == pytest.approx([80.0])
+
+
+def test_forward_without_spot_falls_back_to_current_rate():
+    day = TODAY + relativedelta(years=1)
+    converter = FxConverter('forward', db=object(), spot=SPOT,
+                            curves={'RUB': flat(15.0), 'USD': flat(5.0), 'CNY': flat(2.0)})
+
+    result = converter.convert(flows(['USD', 'CNY'], [10.0, 100.0], [800.0, 1120.0], day))
+
+    # У CNY нет спота: вместо NaN остается сумма по текущему курсу, как в режиме spot
+    assert result['FX_FORWARD'].to_list()[1] is None
+    assert result['AMOUNT_RUB'].to_list() == pytest.approx([10.0 * 80.0 * 1.15 / 1.05, 1120.0], rel=1e-3)
+    assert result['AMOUNT_RUB'].is_nan().sum() == 0
+
+
+def test_spot_mode_uses_fixing_as_of_payment_date():
+    history = pl.DataFrame({'FACEUNIT': ['USD', 'USD'], 'TRADEDATE': [date(2024, 1, 10), date(2024, 2, 10)],
+                            'RATE': [90.0, 95.0]})
+    converter = FxConverter('spot', db=object(), history=history)
+
+    result = converter.convert(pl.concat([
+        flows(['USD'], [1.0], [80.0], date(2024, 2, 1)),
+        flows(['USD'], [1.0], [80.0], date(2030, 1, 1)),
+        flows(['CNY'], [1.0], [11.0], date(2024, 2, 1)),
+    ]))
+
+    by_row = {(row['FACEUNIT'], row['DATE']): row['AMOUNT_RUB'] for row in result.iter_rows(named=True)}
+    assert by_row == {('USD', date(2024, 2, 1)): 90.0, ('USD', date(2030, 1, 1)): 95.0,
+                      ('CNY', date(2024, 2, 1)): 11.0}
+
+
+class FixingResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {'history': {'columns': ['TRADEDATE', 'CLOSE'], 'data': self.data}}
+
+
+class FixingScheduler:
+    # Одна страница с фиксингом, следующая пустая
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, priority=None):
+        self.urls.append(url)
+        return FixingResponse([['2028-02-28', 90.5]] if url.endswith('start=0') else [])
+
+
+def test_first_load_on_february_29(db, monkeypatch):
+    class LeapDay(date):
+        @classmethod
+        def today(cls):
+            return cls(2028, 2, 29)
+
+    scheduler = FixingScheduler()
+    monkeypatch.setattr(fx, 'date', LeapDay)
+    monkeypatch.setattr(fx, 'get_scheduler', lambda: scheduler)
+
+    load_fixings(db, fixings={'USD': 'USDFIX'})
+
+    assert 'from=2023-02-28' in scheduler.urls[0]
+    assert fx_history(db).rows() == [('USD', date(2028, 2, 28), 90.5)]
+
+
+def test_converter_curves_use_its_database(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(fx, 'get_riskoff_yeilds', lambda currency, db=None: calls.append(db) or flat(5.0))
+
+    FxConverter('forward', db)._curve('CNY')
+
+    assert calls == [db]
@@ -0,0 +1,89 @@
+import polars as pl
+import pytest
+
+import incremental
+from bondization import get_schedules
+from df_process import build_portfolio_plan, portfolio_metrics
+from incremental import IncrementalPortfolio
+from visualization import create_monthly_dict, fill_calendar_with_sums
+
+from conftest import bond
+
+
+def full_recalculation(db, positions):
+    # Показатели и календарь полным пересчетом портфеля, как в main
+    df = build_portfolio_plan(pl.DataFrame({'ISIN': list(positions), 'Количество лотов': list(positions.values())}),
+                              db).collect()
+
+    metrics = {}
+    for currency in df['FACEUNIT'].cast(pl.String).unique().to_list():
+        filtered_df = df.filter(pl.col('FACEUNIT') == currency)
+        metrics[currency] = {**portfolio_metrics(filtered_df), 'value_rub': filtered_df['FULLVALUE_RUB'].sum()}
+
+    end_date = df['MATDATE'].max()
+    calendar = fill_calendar_with_sums(create_monthly_dict(end_date), df, end_date,
+                                       schedules=get_schedules(list(positions), db, refresh=False))
+    return metrics, calendar
+
+
+def assert_same(portfolio, db, positions):
+    metrics, calendar = full_recalculation(db, positions)
+
+    incremental = portfolio.metrics()
+    assert set(incremental) == set(metrics)
+    for currency, values in metrics.items():
+        for name, value in values.items():
+            assert incremental[currency][name] == pytest.approx(value), (currency, name)
+
+    assert portfolio.calendar() == pytest.approx(calendar)
+
+
+def test_edits_match_full_recalculation(market):
+    portfolio = IncrementalPortfolio(market, online=False)
+
+    for positions in [
+        {'RU000A1': 10, 'RU000A2': 5, 'RU000A3': 2},
+        {'RU000A1': 10, 'RU000A2': 7, 'RU000A3': 2},
+        {'RU000A1': 3, 'RU000A3': 2},
+        {'RU000A2': 1},
+    ]:
+        portfolio.update(positions)
+        assert_same(portfolio, market, positions)
+
+
+def test_only_changed_positions_are_recalculated(market):
+    portfolio = IncrementalPortfolio(market, online=False)
+    portfolio.update({'RU000A1': 10, 'RU000A2': 5})
+
+    assert portfolio.set_lots('RU000A2', 8) == ['RU000A2']
+    assert portfolio.refresh() == []
+
+
+def test_new_rate_changes_the_version(market):
+    portfolio = IncrementalPortfolio(market, online=False)
+    positions = {'RU000A1': 10, 'RU000A2': 5}
+    portfolio.update(positions)
+
+    market.insert_dicts('currency', [dict(BOARDID='FIXI', SECID='CNYFIX', SHORTNAME='CNYFIX', LATNAME='CNYFIX',
+                                          NAME='CNYFIX', TRADEDATE='2026-10-17', TIME='13:30', LASTVALUE=12.0)])
+
+    assert portfolio.refresh() == ['RU000A2']
+    assert_same(portfolio, market, positions)
+
+
+def test_online_portfolio_loads_missing_bonds_into_its_database(market, monkeypatch):
+    def get_marketdata_many(isins, db=None):
+        # Как marketdata: без db данные ушли бы в базу по умолчанию
+        if db is not None:
+            db.insert_dicts('bonds_info', [bond(isin) for isin in isins])
+
+    monkeypatch.setattr(incremental, 'get_marketdata_many', get_marketdata_many)
+    monkeypatch.setattr(incremental, 'load_schedules', lambda isins, db: None)
+
+    portfolio = IncrementalPortfolio(market, online=True)
+    portfolio.update({'RU000A1': 1, 'RU000A9': 2})
+
+    assert_same(portfolio, market, {'RU000A1': 1, 'RU000A9': 2})
+    # Новая бумага с теми же параметрами: стоимость как у трех лотов RU000A1
+    three_lots = full_recalculation(market, {'RU000A1': 3})[0]['RUB']['value_rub']
+    assert portfolio.metrics()['RUB']['value_rub'] == pytest.approx(three_lots)
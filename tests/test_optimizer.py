@@ -0,0 +1,87 @@
+import warnings
+
+import numpy as np
+import polars as pl
+import pytest
+
+from optimizer import optimize_portfolio, allocation_summary
+
+
+def candidates(durations, yields, lot_cost=None, issuers=None):
+    n = len(durations)
+    return pl.DataFrame({
+        'ISIN': [f'RU{i:06d}' for i in range(n)],
+        'EFFECTIVEYIELD': yields,
+        'DURATION': durations,
+        'LOT_COST_RUB': lot_cost if lot_cost is not None else [1000.0] * n,
+        'FACEUNIT': ['RUB'] * n,
+        'EMITTER_ID': issuers if issuers is not None else [f'E{i}' for i in range(n)],
+    })
+
+
+def test_first_pick_keeps_band_reachable():
+    # Самая доходная бумага - самая длинная: жадный набор по доходности дает 1050 дней
+    df = candidates([2000.0, 100.0, 500.0], [20.0, 15.0, 10.0])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        allocation = optimize_portfolio(df, 100_000, 500, issuer_cap=0.5)
+
+    summary = allocation_summary(allocation, df)
+    assert 470 <= summary['duration'] <= 530
+    # Оптимум в коридоре: максимум длинной бумаги при дюрации не выше 530
+    assert dict(allocation.iter_rows()) == {'RU000000': 15, 'RU000001': 50, 'RU000002': 35}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_universe_hits_band(seed):
+    rng = np.random.default_rng(seed)
+    n = 3000
+    durations = rng.uniform(30, 3000, n)
+    yields = 8 + durations / 300 + rng.normal(0, 2, n)
+    df = candidates(durations.tolist(), yields.tolist(), lot_cost=rng.uniform(500, 1100, n).tolist(),
+                    issuers=[f'E{i % 700}' for i in range(n)])
+    budget = 1_000_000
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        allocation = optimize_portfolio(df, budget, 500, issuer_cap=0.1)
+
+    summary = allocation_summary(allocation, df)
+    assert 470 <= summary['duration'] <= 530
+    assert summary['value'] <= budget
+    assert summary['value'] > 0.99 * budget
+
+    by_issuer = (allocation.join(df, on='ISIN')
+                 .group_by('EMITTER_ID')
+                 .agg((pl.col('Количество лотов') * pl.col('LOT_COST_RUB')).sum().alias('value')))
+    assert by_issuer['value'].max() <= 0.1 * budget + 1e-6
+
+
+def test_missing_issuer_column_fails_loudly():
+    df = candidates([500.0, 400.0], [10.0, 9.0]).drop('EMITTER_ID')
+
+    # По умолчанию доля эмитента не ограничивается
+    assert optimize_portfolio(df, 10_000, 450)['Количество лотов'].sum() == 10
+
+    with pytest.raises(ValueError):
+        optimize_portfolio(df, 10_000, 450, issuer_cap=0.5)
+
+    allocation = optimize_portfolio(df, 10_000, 450, issuer_cap=0.5, issuer_column='ISIN')
+    assert allocation['Количество лотов'].sum() == 10
+
+
+def test_unreachable_band_warns():
+    df = candidates([2000.0, 1500.0], [10.0, 9.0])
+
+    with pytest.warns(UserWarning, match='коридор'):
+        optimize_portfolio(df, 10_000, 500, issuer_cap=None)
+
+
+def test_bonds_without_issuer_are_capped_separately():
+    df = candidates([450.0, 450.0, 450.0], [12.0, 11.0, 10.0], issuers=['E1', None, None])
+
+    with pytest.warns(UserWarning, match='нет эмитента'):
+        allocation = optimize_portfolio(df, 9_000, 450, issuer_cap=0.34)
+
+    assert dict(allocation.iter_rows()) == {'RU000000': 3, 'RU000001': 3, 'RU000002': 3}
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import scheduler
+from scheduler import RequestScheduler, freeze
+
+
+URL = 'https://example.com/iss'
+
+
+def fake_get(calls):
+    # Вместо запроса в сеть: запоминает сессию, поток и параметры
+    def get(session, url, **kwargs):
+        calls.append((id(session), threading.get_ident(), url, kwargs))
+        time.sleep(0.05)
+        return url, kwargs.get('params')
+    return get
+
+
+def fast_host(monkeypatch):
+    monkeypatch.setitem(scheduler.HOST_LIMITS, 'example.com', (1000.0, 1000))
+
+
+def test_coalescing_key_includes_params(monkeypatch):
+    calls = []
+    monkeypatch.setattr(requests.Session, 'get', fake_get(calls))
+    fast_host(monkeypatch)
+    requests_scheduler = RequestScheduler(workers=4)
+
+    first = requests_scheduler.submit(URL, params={'start': 0})
+    same = requests_scheduler.submit(URL, params={'start': 0})
+    other = requests_scheduler.submit(URL, params={'start': 100})
+
+    assert first is same
+    assert first is not other
+    assert first.result() == (URL, {'start': 0})
+    assert other.result() == (URL, {'start': 100})
+    assert len(calls) == 2
+    assert requests_scheduler.stats()['coalesced'] == 1
+
+
+def test_session_per_thread(monkeypatch):
+    calls = []
+    monkeypatch.setattr(requests.Session, 'get', fake_get(calls))
+    fast_host(monkeypatch)
+    requests_scheduler = RequestScheduler(workers=4)
+
+    futures = [requests_scheduler.submit(f'{URL}/{i}') for i in range(16)]
+    for future in futures:
+        future.result()
+
+    threads_by_session = {}
+    for session, thread, _, _ in calls:
+        threads_by_session.setdefault(session, set()).add(thread)
+    assert all(len(threads) == 1 for threads in threads_by_session.values())
+
+
+def test_wait_history_is_bounded(monkeypatch):
+    monkeypatch.setattr(requests.Session, 'get', fake_get([]))
+    monkeypatch.setattr(scheduler, 'WAIT_HISTORY', 5)
+    fast_host(monkeypatch)
+    requests_scheduler = RequestScheduler(workers=4)
+
+    for future in [requests_scheduler.submit(f'{URL}/{i}') for i in range(12)]:
+        future.result()
+
+    stats = requests_scheduler.stats()['example.com']
+    assert len(requests_scheduler._waits['example.com']) == 5
+    assert stats['requests'] == 12
+    assert stats['max_wait'] >= stats['p95_wait'] >= 0
+
+
+def test_freeze_ignores_dict_order():
+    assert freeze({'b': [1, 2], 'a': {'x': 1}}) == freeze({'a': {'x': 1}, 'b': (1, 2)})
+    assert hash(freeze({'headers': {'User-Agent': 'x'}, 'timeout': (5, 15)}))
+
+
+def test_throttled_host_does_not_hold_the_workers(monkeypatch):
+    # Запросы к медленному хосту важнее, но не должны занимать все потоки в ожидании токена
+    calls = []
+    monkeypatch.setattr(requests.Session, 'get', fake_get(calls))
+    fast_host(monkeypatch)
+    monkeypatch.setitem(scheduler.HOST_LIMITS, 'slow.example.com', (5.0, 1))
+    requests_scheduler = RequestScheduler(workers=2)
+
+    slow = [requests_scheduler.submit(f'https://slow.example.com/{i}') for i in range(6)]
+    fast = requests_scheduler.submit(URL, priority=scheduler.PRIORITY_CURVE)
+
+    for future in [*slow, fast]:
+        future.result()
+
+    urls = [url for _, _, url, _ in calls]
+    assert urls.index(URL) < 3
+
+
+def test_coalesced_request_gets_the_higher_priority(monkeypatch):
+    calls, release = [], threading.Event()
+
+    def get(session, url, **kwargs):
+        calls.append(url)
+        if url.endswith('busy'):
+            release.wait(5)
+
+    monkeypatch.setattr(requests.Session, 'get', get)
+    fast_host(monkeypatch)
+    requests_scheduler = RequestScheduler(workers=1)
+
+    busy = requests_scheduler.submit(f'{URL}/busy')
+    while not calls:
+        time.sleep(0.01)
+
+    curve = requests_scheduler.submit(f'{URL}/curve', priority=scheduler.PRIORITY_CURVE)
+    currency = requests_scheduler.submit(f'{URL}/currency', priority=scheduler.PRIORITY_CURRENCY)
+    # Тот же запрос понадобился портфелю
+    assert requests_scheduler.submit(f'{URL}/curve', priority=scheduler.PRIORITY_PORTFOLIO) is curve
+    release.set()
+
+    for future in (busy, curve, currency):
+        future.result()
+
+    assert calls == [f'{URL}/busy', f'{URL}/curve', f'{URL}/currency']
+    assert requests_scheduler.stats()['queued'] == 0
+
+
+def test_configure_scheduler_stops_the_previous_one(monkeypatch):
+    monkeypatch.setattr(requests.Session, 'get', fake_get([]))
+    fast_host(monkeypatch)
+    monkeypatch.setattr(scheduler, '_scheduler', None)
+
+    previous = scheduler.configure_scheduler(workers=2)
+    previous.submit(URL).result()
+    current = scheduler.configure_scheduler(workers=2)
+
+    for thread in previous._threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert scheduler.get_scheduler() is current
+    with pytest.raises(RuntimeError):
+        previous.submit(URL)
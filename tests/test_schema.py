@@ -0,0 +1,85 @@
+import sqlite3
+from datetime import date
+
+import polars as pl
+
+from database import DatabaseManager
+from schema import MIGRATIONS, table_columns
+
+
+def legacy_table(conn, table_name, rows):
+    # Таблица, как ее создавал DatabaseManager до объявленной схемы: типы по первой строке, без ключей
+    columns = list(rows[0])
+    types = ['INTEGER' if isinstance(value, int) else 'REAL' if isinstance(value, float) else 'TEXT'
+             for value in rows[0].values()]
+    conn.execute(f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                 f"{', '.join(f'{column} {sql_type}' for column, sql_type in zip(columns, types))})")
+    for row in rows:
+        conn.execute(f"INSERT INTO {table_name} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                     list(row.values()))
+
+
+def test_iss_rub_code_is_normalized(tmp_path):
+    path = str(tmp_path / 'bonds.db')
+    conn = sqlite3.connect(path)
+    legacy_table(conn, 'bonds_info', [
+        {'SECID': 'RU000A1', 'FACEUNIT': 'SUR', 'FACEVALUE': 1000.0},
+        {'SECID': 'RU000A2', 'FACEUNIT': 'USD', 'FACEVALUE': 1000.0},
+    ])
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    df = db.scan_table(['RU000A1', 'RU000A2'], 'bonds_info').collect()
+
+    assert dict(df.select('SECID', 'FACEUNIT').iter_rows()) == {'RU000A1': 'RUB', 'RU000A2': 'USD'}
+
+
+def test_baseline_database_is_migrated(tmp_path):
+    # База в формате до объявленной схемы: первая строка без купона (столбец стал TEXT),
+    # повторная загрузка той же бумаги и пустые даты ISS
+    path = str(tmp_path / 'bonds.db')
+    conn = sqlite3.connect(path)
+    legacy_table(conn, 'bonds_info', [
+        {'SECID': 'RU000A1', 'COUPONVALUE': None, 'LOTSIZE': 1, 'MATDATE': '2029-06-01', 'OFFERDATE': '0000-00-00',
+         'LAST': 98.0},
+        {'SECID': 'RU000A2', 'COUPONVALUE': 40.5, 'LOTSIZE': 10, 'MATDATE': '2030-01-01', 'OFFERDATE': '2027-01-01',
+         'LAST': 101.0},
+        {'SECID': 'RU000A1', 'COUPONVALUE': 35.0, 'LOTSIZE': 1, 'MATDATE': '2029-06-01', 'OFFERDATE': '0000-00-00',
+         'LAST': 99.0},
+    ])
+    legacy_table(conn, 'currency', [
+        {'SECID': 'USDFIX', 'TRADEDATE': '2026-10-16', 'LASTVALUE': 80.0},
+        {'SECID': 'USDFIX', 'TRADEDATE': '2026-10-16', 'LASTVALUE': 81.0},
+    ])
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    with db as cursor:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        columns = table_columns(cursor, 'bonds_info')
+        stored = cursor.execute("SELECT typeof(COUPONVALUE) FROM bonds_info WHERE SECID = 'RU000A2'").fetchone()[0]
+
+    assert version == len(MIGRATIONS)
+    assert columns['COUPONVALUE'] == 'REAL' and columns['MATDATE'] == 'DATE' and columns['UPDATED'] == 'DATE'
+    assert stored == 'real'
+
+    df = db.scan_table(['RU000A1', 'RU000A2'], 'bonds_info').collect().sort('SECID')
+    assert df['SECID'].to_list() == ['RU000A1', 'RU000A2']
+    # Остается последняя загруженная запись
+    assert df['LAST'].to_list() == [99.0, 101.0]
+    assert df['COUPONVALUE'].to_list() == [35.0, 40.5]
+    assert df['OFFERDATE'].to_list() == [None, date(2027, 1, 1)]
+    assert df['UPDATED'].null_count() == 2
+
+    assert db.currency_table().filter(pl.col('FACEUNIT') == 'USD')['CURRENCY_RUB'].to_list() == [81.0]
+
+
+def test_new_database_starts_at_the_latest_version(db):
+    db.insert_dicts('fx_history', [{'FACEUNIT': 'USD', 'TRADEDATE': '2026-10-16', 'RATE': 80.0}])
+    db.insert_dicts('fx_history', [{'FACEUNIT': 'USD', 'TRADEDATE': '2026-10-16', 'RATE': 81.0}])
+
+    with db as cursor:
+        assert cursor.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        assert cursor.execute("SELECT RATE FROM fx_history").fetchall() == [(81.0,)]
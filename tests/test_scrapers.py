@@ -0,0 +1,35 @@
+import polars as pl
+
+from scrapers import parse_chinabond
+
+
+CHINABOND_PAGE = """
+<html><body><div id="gjqxData"><table>
+<tr><td>Date</td><td>Maturity</td><td>Yield(%)</td></tr>
+<tr><td rowspan="4">2026-10-16</td><td>3M</td><td>1.35</td></tr>
+<tr><td>6M</td><td>1.40</td></tr>
+<tr><td>1Y</td><td>1.45</td></tr>
+<tr><td>10Y</td><td>1.85</td></tr>
+</table></div></body></html>
+"""
+
+
+def test_chinabond_rowspan_date_does_not_shift_columns():
+    curve = parse_chinabond(CHINABOND_PAGE)
+
+    assert curve.to_dict(as_series=False) == {'period': [0.25, 0.5, 1.0, 10.0], 'value': [1.35, 1.40, 1.45, 1.85]}
+
+
+def test_chinabond_columns_by_header():
+    page = """
+    <div id="gjqxData"><table>
+    <tr><th>Date</th><th>Yield(%)</th><th>Maturity</th></tr>
+    <tr><td rowspan="2">2026-10-16</td><td>1.35</td><td>3M</td></tr>
+    <tr><td>1.85</td><td>10Y</td></tr>
+    </table></div>
+    """
+
+    curve = parse_chinabond(page)
+
+    assert curve.rows() == [(0.25, 1.35), (10.0, 1.85)]
+    assert curve.schema == {'period': pl.Float64, 'value': pl.Float64}
@@ -0,0 +1,70 @@
+import screener
+from screener import build_universe, fetch_universe, load_universe_schedules
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def block(columns, data):
+    return {'columns': columns, 'data': data}
+
+
+class IssScheduler:
+    # Список бумаг рынка и справочник бумаг из двух страниц
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, priority=None):
+        self.urls.append(url)
+
+        if url == screener.ISS_UNIVERSE_URL:
+            return Response({
+                'securities': block(['SECID', 'BOARDID', 'FACEUNIT', 'MATDATE', 'OFFERDATE'],
+                                    [['RU000A1', 'TQCB', 'SUR', '2029-06-01', None],
+                                     ['RU000A2', 'TQCB', 'USD', '0000-00-00', None],
+                                     ['RU000A3', 'TQCB', 'SUR', '2030-01-01', '2027-01-01']]),
+                'marketdata': block(['SECID', 'BOARDID', 'LAST', 'DURATION'], [['RU000A1', 'TQCB', 99.0, 700]]),
+                'marketdata_yields': block(['SECID', 'BOARDID', 'EFFECTIVEYIELD'], [['RU000A1', 'TQCB', 15.0]]),
+            })
+
+        pages = {'start=0': [['RU000A1', 101], ['RU000A2', 101]], 'start=2': [['RU000A3', None]]}
+        data = next((page for key, page in pages.items() if url.endswith(key)), [])
+        return Response({'securities': block(['secid', 'emitent_id'], data)})
+
+
+def test_universe_has_emitters(monkeypatch):
+    scheduler = IssScheduler()
+    monkeypatch.setattr(screener, 'get_scheduler', lambda: scheduler)
+
+    df = fetch_universe().sort('SECID')
+
+    assert df['EMITTER_ID'].to_list() == [101, 101, None]
+    assert df['FACEUNIT'].to_list() == ['RUB', 'USD', 'RUB']
+    assert df['MATDATE'].null_count() == 1
+    # Список бумаг и три страницы справочника (последняя пустая)
+    assert len(scheduler.urls) == 4
+
+
+def test_build_universe_does_not_fetch_every_schedule(db, monkeypatch):
+    loaded, curves_db = [], []
+    monkeypatch.setattr(screener, 'get_scheduler', lambda: IssScheduler())
+    monkeypatch.setattr(screener, 'load_schedules', lambda isins, db: loaded.append(list(isins)))
+    monkeypatch.setattr(screener, 'get_riskoff_curves', lambda currencies, db=None: curves_db.append(db) or {})
+
+    df = build_universe(db)
+
+    assert loaded == []
+    assert curves_db == [db]
+    assert df['COUPON_TYPE'].null_count() == 3
+    assert db.table_exists('universe')
+
+    # Графики - отдельным шагом по бумагам из universe
+    load_universe_schedules(db)
+    assert sorted(loaded[0]) == ['RU000A1', 'RU000A2', 'RU000A3']
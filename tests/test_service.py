@@ -0,0 +1,137 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+import polars as pl
+
+import service
+from database import DatabaseManager
+from service import MarketCache, dumps
+
+
+def strict_loads(text):
+    # json.loads по умолчанию принимает NaN, стандарт JSON - нет
+    def reject(token):
+        raise ValueError(token)
+    return json.loads(text, parse_constant=reject)
+
+
+def test_non_finite_values_become_null():
+    payload = {'currencies': {'USD': {'couponperiod': float('nan'), 'ytm': np.float32('inf'), 'value_rub': 0.0}},
+               'calendar': [{'amount_rub': np.float64('nan')}]}
+
+    result = strict_loads(dumps(payload))
+
+    assert result == {'currencies': {'USD': {'couponperiod': None, 'ytm': None, 'value_rub': 0.0}},
+                      'calendar': [{'amount_rub': None}]}
+
+
+def test_cold_fetch_does_not_block_other_requests(tmp_path):
+    cache = MarketCache(DatabaseManager(str(tmp_path / 'bonds.db'), shared=True))
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load_bonds(isins):
+        loads.append(list(isins))
+        started.set()
+        release.wait(5)
+        return pl.DataFrame({'ISIN': isins, 'FACEUNIT': ['RUB'] * len(isins)})
+
+    cache._load_bonds = load_bonds
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(cache.bonds, ['RU000A1'])
+        assert started.wait(5)
+
+        # Пока идет загрузка, общий кэш доступен
+        assert cache.currencies()['FACEUNIT'].to_list() == ['RUB']
+
+        # Тот же ISIN второй раз не загружается - второй запрос ждет первую загрузку
+        second = pool.submit(cache.bonds, ['RU000A1'])
+        release.set()
+
+        assert first.result(5)['ISIN'].to_list() == ['RU000A1']
+        assert second.result(5)['ISIN'].to_list() == ['RU000A1']
+
+    assert loads == [['RU000A1']]
+
+
+def test_schedules_are_cached_in_memory(tmp_path, monkeypatch):
+    cache = MarketCache(DatabaseManager(str(tmp_path / 'bonds.db'), shared=True))
+    calls = []
+
+    def get_schedules(isins, db):
+        calls.append(list(isins))
+        return pl.DataFrame({'ISIN': isins, 'VALUE': [1.0] * len(isins)})
+
+    monkeypatch.setattr(service, 'get_schedules', get_schedules)
+
+    assert cache.schedules(['A', 'B'])['ISIN'].to_list() == ['A', 'B']
+    assert cache.schedules(['B'])['ISIN'].to_list() == ['B']
+    assert cache.schedules(['B', 'C'])['ISIN'].sort().to_list() == ['B', 'C']
+    assert calls == [['A', 'B'], ['C']]
+
+
+def test_shared_connection_across_threads(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'bonds.db'), shared=True)
+
+    with db as cursor:
+        connection = cursor.connection
+
+    def insert(i):
+        db.insert_dicts('fx_history', [{'FACEUNIT': 'USD', 'TRADEDATE': f'2026-01-{i + 1:02d}', 'RATE': 80.0 + i}])
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(insert, range(20)))
+
+    with db as cursor:
+        assert cursor.connection is connection
+        assert cursor.execute("SELECT count(*) FROM fx_history").fetchone()[0] == 20
+
+    db.close()
+
+
+def test_fixings_are_reloaded_on_a_new_day(tmp_path, monkeypatch):
+    days = [date(2026, 10, 19)]
+
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return days[0]
+
+    loads = []
+    monkeypatch.setattr(service, 'date', Today)
+    monkeypatch.setattr(service, 'load_fixings', lambda db: loads.append(days[0]))
+
+    cache = MarketCache(DatabaseManager(str(tmp_path / 'bonds.db'), shared=True))
+    monkeypatch.setattr(cache, 'curve', lambda currency: pl.DataFrame())
+
+    cache.fx('spot')
+    cache.fx('forward')
+    assert loads == [date(2026, 10, 19)]
+
+    # Запрос данных по бумагам в новый день сдвигает общий день кэша раньше, чем fx
+    days[0] = date(2026, 10, 20)
+    cache.bonds([])
+    cache.fx('spot')
+    assert loads == [date(2026, 10, 19), date(2026, 10, 20)]
+
+
+def test_curves_and_bonds_use_the_service_database(market, monkeypatch):
+    cache = MarketCache(market)
+    calls = []
+    monkeypatch.setattr(service, 'get_riskoff_yeilds', lambda currency, db=None: calls.append(db) or pl.DataFrame())
+
+    cache.curve('CNY')
+    assert calls == [market]
+
+    # Перезагруженная бумага заменяет старую строку по SECID
+    row = market.scan_table(['RU000A1'], 'bonds_info').collect().drop('id').to_dicts()[0]
+    monkeypatch.setattr(service, 'get_marketdata_many', lambda isins, save=True: [{**row, 'LAST': 101.0}])
+
+    bonds = cache.bonds(['RU000A1'])
+
+    assert bonds['LAST'].to_list() == [101.0]
+    assert market.scan_table(['RU000A1'], 'bonds_info').collect()['LAST'].to_list() == [101.0]
@@ -0,0 +1,71 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from valuation import accrued_interest_expr, add_valuation
+
+
+VALUATION_DATE = date(2026, 10, 19)
+
+
+def bonds(**columns):
+    # Купон 40 раз в 182 дня, 8% от номинала 1000; период начался 2026-06-02, прошло 139 дней
+    data = {'NEXTCOUPON': [date(2026, 12, 1)], 'COUPONPERIOD': [182], 'COUPONVALUE': [40.0],
+            'FACEVALUE': [1000.0], 'COUPONPERCENT': [8.0]}
+    data.update(columns)
+    return pl.DataFrame(data)
+
+
+def accrued(df, day_count, valuation_date=VALUATION_DATE):
+    return df.select(accrued_interest_expr(day_count, valuation_date))[0, 0]
+
+
+@pytest.mark.parametrize('day_count, expected', [
+    ('ACT/ACT', 40 * 139 / 182),
+    ('ACT/365', 80 * 139 / 365),
+    ('ACT/360', 80 * 139 / 360),
+    # 4 полных месяца по 30 дней + (19 - 2)
+    ('30/360', 80 * 137 / 360),
+])
+def test_accrued_interest_day_counts(day_count, expected):
+    assert accrued(bonds(), day_count) == pytest.approx(expected)
+
+
+def test_30_360_counts_day_31_as_30():
+    # Период 2026-10-31 .. 2027-01-30: на 2026-12-31 по 30/360 прошло ровно 2 месяца, фактически 61 день
+    df = bonds(NEXTCOUPON=[date(2027, 1, 30)], COUPONPERIOD=[91])
+
+    assert accrued(df, '30/360', date(2026, 12, 31)) == pytest.approx(80 * 60 / 360)
+    assert accrued(df, 'ACT/360', date(2026, 12, 31)) == pytest.approx(80 * 61 / 360)
+
+
+def test_accrued_interest_is_clipped_to_the_coupon_period():
+    df = bonds()
+
+    assert accrued(df, 'ACT/ACT', date(2026, 5, 1)) == 0
+    assert accrued(df, 'ACT/ACT', date(2027, 1, 1)) == pytest.approx(40.0)
+
+
+def test_unknown_day_count():
+    with pytest.raises(ValueError):
+        accrued_interest_expr('ACT/364')
+
+
+def test_add_valuation_prefers_iss_accrued():
+    # У второй бумаги нет НКД мосбиржи и есть последняя сделка
+    df = pl.concat([bonds(), bonds()]).with_columns(
+        pl.Series('ACCRUEDINT', [12.3, None]),
+        pl.Series('Количество лотов', [2, 2]),
+        pl.Series('LOTSIZE', [10, 10]),
+        pl.Series('LAST', [None, 99.0]),
+        pl.Series('MARKETPRICE', [98.0, 98.0]),
+        pl.Series('CURRENCY_RUB', [1.0, 1.0]),
+    )
+
+    result = add_valuation(df, valuation_date=VALUATION_DATE)
+
+    assert result['QUANTITY'].to_list() == [20, 20]
+    assert result['ACCRUED_PER_BOND'].to_list() == pytest.approx([12.3, 40 * 139 / 182])
+    assert result['CLEAN_VALUE'].to_list() == pytest.approx([980 * 20, 990 * 20])
+    assert result['FULLVALUE_RUB'].to_list() == pytest.approx([(980 + 12.3) * 20, (990 + 40 * 139 / 182) * 20])